@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Compares load time and disk size of cached results stored as arrays (.npz,
+see result_cache.py) and as pickled ROOT objects (former format).
+
+Uses results in output/cache, so the draw_*.py scripts have to be run first.
+Must be executed from the top directory, e.g.:
+
+    python auxiliary/bench_cache.py
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import os
+import sys
+import glob
+import time
+import pickle
+import tempfile
+
+# shared modules of the top directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import result_cache
+
+def main():
+    """Steering function.
+    """
+    # NOTE: ROOT is imported for the former format only
+    t0 = time.time()
+    import ROOT
+    tImport = time.time() - t0
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.TH1.AddDirectory(False)
+
+    cachefiles = sorted(glob.glob(os.path.join(result_cache.CACHE_DIR, '*.npz')))
+    if not cachefiles:
+        raise Exception('no cached results found in ' + result_cache.CACHE_DIR)
+
+    (sizeNpz, sizePkl, timeNpz, timePkl, timeRebuild) = (0, 0, 0, 0, 0)
+
+    tmpdir = tempfile.mkdtemp()
+
+    for cachefile in cachefiles:
+        t0 = time.time()
+        result = result_cache.load(cachefile)
+        timeNpz += time.time() - t0
+        sizeNpz += os.path.getsize(cachefile)
+
+        # ROOT objects are rebuilt at drawing time
+        t0 = time.time()
+        objs = result_cache.to_root(result)
+        timeRebuild += time.time() - t0
+
+        # former format
+        pklfile = os.path.join(tmpdir, 'result.pkl')
+        with open(pklfile, 'wb') as f:
+            pickle.dump(objs, f)
+        sizePkl += os.path.getsize(pklfile)
+
+        t0 = time.time()
+        with open(pklfile, 'rb') as f:
+            pickle.load(f)
+        timePkl += time.time() - t0
+
+        os.remove(pklfile)
+
+    os.rmdir(tmpdir)
+
+    print('{0} cached results'.format(len(cachefiles)))
+    print('format             size (kB)  load time (s)')
+    print('arrays (.npz)      {0:9.0f}  {1:13.3f}'.format(sizeNpz/1024, timeNpz))
+    print('ROOT objects (.pkl){0:9.0f}  {1:13.3f}'.format(sizePkl/1024, timePkl))
+    print('')
+    print('rebuilding ROOT objects from arrays: {0:.3f} s'.format(timeRebuild))
+    print('import of ROOT: {0:.3f} s'.format(tImport))
+
+
+if __name__ == '__main__':
+    main()
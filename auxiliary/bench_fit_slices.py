@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""Measures performance of block fits in draw_results_helper.cc: compiled vs
+string fit function, warm-started vs from-scratch fits, speedup vs number of
+threads, the out-of-core mode vs the in-memory one, adaptive vs fixed-size
+blocks and the cost of bootstrap errors.
+
+Must be executed from the top directory, e.g.:
+
+    python auxiliary/bench_fit_slices.py --max-threads 8
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import os
+import time
+import fnmatch
+import argparse
+import ROOT
+
+# for keeping drawed ROOT objects in memory
+saves = []
+
+def main():
+    """Steering function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--infile', help='input ntuple (default: first one in input/)')
+    parser.add_argument('--det', choices=['EB', 'EE'], default='EB', help='detector')
+    parser.add_argument('--block-size', type=int, default=3000, help='number of entries per block')
+    parser.add_argument('--max-threads', type=int, default=4, help='maximum number of threads to try')
+    parser.add_argument('--shape-blocks', type=int, default=50,
+                        help='number of blocks to fit with the string and compiled fit functions')
+    parser.add_argument('--warm-start', type=int, default=10, metavar='N',
+                        help='length of chains of warm-started fits to compare with fits from scratch')
+    parser.add_argument('--stream', type=float, default=100, metavar='MB',
+                        help='memory limit of the out-of-core mode to compare with the in-memory one')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='PRECISION',
+                        help='target precision of adaptive blocks to compare with fixed-size blocks '
+                             '(default: median precision of fixed-size blocks)')
+    parser.add_argument('--bootstrap', type=int, default=200, metavar='N',
+                        help='number of bootstrap replicas per block to compare with errors of fits')
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.TH1.AddDirectory(False)
+
+    ROOT.gSystem.SetBuildDir('output', True);
+    ROOT.gROOT.LoadMacro('draw_results_helper.cc+')
+
+    infile = args.infile
+    if not infile:
+        infile = 'input/' + sorted(fnmatch.filter(os.listdir('input'), '*.root'))[0]
+
+    # make output directories
+    for d in ['output', 'output/plots_results', 'output/plots_results/fits', 'output/plots_bench']:
+        if not os.access(d, os.X_OK):
+            os.mkdir(d)
+
+    fname = os.path.basename(infile).replace('.root', '')
+    friend = 'output/friend_{0}.root'.format(fname)
+    ROOT.fill_arrays(infile, friend, '', args.det == 'EE')
+
+    bench_shape(args.shape_blocks, args.block_size)
+    bench_warm(args.warm_start, args.block_size, 'bench_{0}_{1}'.format(fname, args.det))
+    bench_threads(args.max_threads, args.block_size, 'bench_{0}_{1}'.format(fname, args.det))
+    bench_stream(args.stream, args.block_size, 'bench_{0}_{1}'.format(fname, args.det),
+                 (infile, friend, '', args.det == 'EE'))
+    bench_adaptive(args.adaptive, args.block_size, 'bench_{0}_{1}'.format(fname, args.det))
+    bench_bootstrap(args.bootstrap, args.block_size, 'bench_{0}_{1}'.format(fname, args.det))
+
+def bench_shape(nblocks, blockSize):
+    """Compares per-fit time and fitted parameters of the compiled fit function
+    (fit_shape.h) against the TFormula expression it replaced.
+
+    Both are fitted by fit_block() to the same blocks of gDataE.
+    """
+    # the TFormula expression as it was used in draw_results_helper.cc
+    expr = ('[0] * ( (x-[1])/[2] > -[3] ? '
+            '( (x-[1])/[2] < [5] ? exp(-(x-[1])^2/(2*[2]*[2])) : exp(0.5*[5]*[5] - [5]*(x-[1])/[2]) ) : '
+            '([4]/[3])^[4] * exp(-0.5*[3]^2) * (-(x-[1])/[2]-[3]+[4]/[3])^(-[4]) )')
+
+    fits = [('string', ROOT.TF1('fit_string', expr, 0.55, 1.3)),
+            ('compiled', ROOT.NewFitFunction('fit_compiled', 0.55, 1.3))]
+
+    # sorting index of data points by X axis
+    x = list(ROOT.gDataE.x)
+    ind = ROOT.std.vector('size_t')(sorted(range(len(x)), key=x.__getitem__))
+
+    nblocks = min(nblocks, len(x)//blockSize)
+    h = ROOT.TH1D('h_bench', '', 100, 0.55, 1.3)
+
+    times = {}
+    pars = {}
+
+    for (name, fit) in fits:
+        times[name] = []
+        pars[name] = []
+
+        for b in range(nblocks):
+            res = ROOT.block_t()
+
+            t0 = time.time()
+            ROOT.fit_block(ROOT.gDataE.x, ROOT.gDataE.y[0], ind.data(),
+                           b * blockSize, (b + 1) * blockSize, h, fit, res)
+            times[name].append(time.time() - t0)
+
+            pars[name].append([(res.par[i], res.err[i]) for i in range(6)])
+
+    print('function  time per fit (ms)')
+    for (name, fit) in fits:
+        print('{0:8s}  {1:17.2f}'.format(name, 1000 * sum(times[name])/nblocks))
+
+    # largest difference of every parameter in units of its fit error
+    print('parameter  max |compiled - string|/error')
+    for i in range(6):
+        diff = 0
+        for (ps, pc) in zip(pars['string'], pars['compiled']):
+            err = max(ps[i][1], pc[i][1])
+            if err > 0:
+                diff = max(diff, abs(pc[i][0] - ps[i][0])/err)
+
+        print('{0:9d}  {1:28.3g}'.format(i, diff))
+
+def bench_warm(chainSize, blockSize, title):
+    """Compares Minuit calls and wall time of fit_slices() with fits of blocks
+    from scratch and with warm-started fits in chains of chainSize blocks.
+    """
+    ROOT.set_num_threads(1)
+
+    points = {}
+
+    print('chain  warm-started  Minuit calls  time (s)')
+
+    for n in [0, chainSize]:
+        ROOT.set_warm_start(n)
+        ROOT.fit_slices(0, blockSize, '{0}_warm{1}'.format(title, n), 'E^{gen}')
+
+        points[n] = graph_points(ROOT.grMeans[0]) + graph_points(ROOT.grSigmas[0])
+        print('{0:5d}  {1:12d}  {2:12d}  {3:8.2f}'.format(n, ROOT.gFitWarm, ROOT.gFitCalls, ROOT.gFitTime))
+
+    ROOT.set_warm_start(0)
+
+    # largest difference of fitted positions and widths in units of their errors
+    if len(points[0]) != len(points[chainSize]):
+        print('numbers of accepted blocks differ: {0} vs {1}'.format(len(points[0]), len(points[chainSize])))
+    else:
+        # NOTE: points without errors (fits which gave no errors) must agree exactly
+        pairs = list(zip(points[0], points[chainSize]))
+        diff = max([abs(p1[1] - p0[1])/max(p0[3], p1[3]) for (p0, p1) in pairs if max(p0[3], p1[3]) > 0]
+                   or [0])
+        print('max |warm - scratch|/error = {0:.3g}'.format(diff))
+
+        nexact = sum(1 for (p0, p1) in pairs if max(p0[3], p1[3]) == 0)
+        ndiffer = sum(1 for (p0, p1) in pairs if max(p0[3], p1[3]) == 0 and p0[1] != p1[1])
+        if nexact:
+            print('points without errors: {0}, of them differ: {1}'.format(nexact, ndiffer))
+
+def bench_threads(max_threads, blockSize, title):
+    """Measures wall time of fit_slices() vs number of threads.
+
+    Results are verified to be identical to the single-threaded ones.
+    """
+    times = []
+    reference = None
+
+    print('threads  time (s)  speedup')
+
+    for n in range(1, max_threads + 1):
+        ROOT.set_num_threads(n)
+
+        t0 = time.time()
+        ROOT.fit_slices(0, blockSize, '{0}_threads{1}'.format(title, n), 'E^{gen}')
+        times.append(time.time() - t0)
+
+        points = graph_points(ROOT.grMeans[0]) + graph_points(ROOT.grSigmas[0])
+        if reference is None:
+            reference = points
+        elif points != reference:
+            raise Exception('results with {0} threads differ from single-threaded ones'.format(n))
+
+        print('{0:7d}  {1:8.2f}  {2:7.2f}'.format(n, times[-1], times[0]/times[-1]))
+
+    # draw speedup curve
+    gr = ROOT.TGraph()
+    for (i, t) in enumerate(times):
+        gr.SetPoint(i, i + 1, times[0]/t)
+
+    cname = 'speedup_threads_' + title
+    c = ROOT.TCanvas(cname, cname, 700, 700)
+    saves.append((c, gr))
+
+    c.SetLeftMargin(0.14)
+    c.SetRightMargin(0.08)
+    c.SetTopMargin(0.06)
+    c.SetBottomMargin(0.1)
+    c.SetGridx()
+    c.SetGridy()
+
+    frame = c.DrawFrame(0, 0, max_threads + 1, max_threads + 1)
+    frame.SetTitle(title)
+    frame.SetXTitle('Number of threads')
+    frame.SetYTitle('Speedup')
+    frame.SetTitleOffset(1.2, 'X')
+    frame.SetTitleOffset(1.95, 'Y')
+    frame.Draw()
+
+    gr.SetMarkerStyle(20)
+    gr.Draw('PL')
+
+    c.Update()
+    c.SaveAs('output/plots_bench/{0}.png'.format(c.GetTitle()))
+
+def bench_stream(maxMemory, blockSize, title, source):
+    """Compares blocks of the out-of-core mode (set_streaming()) with those of
+    the in-memory mode: numbers of entries and mean X of every block.
+
+    source = arguments of fill_arrays().
+    """
+    ROOT.set_num_threads(1)
+    ROOT.set_warm_start(0)
+
+    print('mode       time (s)')
+
+    blocks = {}
+    for (mode, memory) in [('memory', 0), ('stream', maxMemory)]:
+        ROOT.set_streaming(memory)
+        ROOT.fill_arrays(*source)
+
+        t0 = time.time()
+        ROOT.fit_slices(0, blockSize, '{0}_{1}'.format(title, mode), 'E^{gen}')
+        print('{0:9s}  {1:8.2f}'.format(mode, time.time() - t0))
+
+        # entries and mean X of blocks, see SaveFits()
+        fi = ROOT.TFile.Open('output/plots_results/fits/{0}_{1}.root'.format(title, mode))
+        blocks[mode] = [(sum(b.contents), b.meanX) for b in fi.Get('blocks')]
+        fi.Close()
+
+    ROOT.set_streaming(0)
+
+    # NOTE: both boundaries of a block may be off by the rank error
+    maxError = 2 * ROOT.gStreamError * blockSize
+
+    if len(blocks['memory']) != len(blocks['stream']):
+        raise Exception('numbers of blocks differ: {0} vs {1}'.format(len(blocks['memory']),
+                                                                      len(blocks['stream'])))
+
+    diff = max(abs(s[0] - m[0]) for (m, s) in zip(blocks['memory'], blocks['stream']))
+    print('max |stream - memory| entries per block = {0:.0f} (allowed: {1:.0f})'.format(diff, maxError))
+    if diff > maxError:
+        raise Exception('blocks of the out-of-core mode differ by more than the rank error')
+
+    diff = max(abs(s[1] - m[1]) for (m, s) in zip(blocks['memory'], blocks['stream']))
+    print('max |stream - memory| mean X of blocks = {0:.3g}'.format(diff))
+
+def bench_adaptive(precision, blockSize, title):
+    """Compares fits of blocks of fixed size with fits of adaptive blocks
+    (set_adaptive()): numbers of fits and of rejected blocks, and precision
+    of fitted widths.
+
+    precision <= 0: the median precision reached by fixed-size blocks is the
+    target of adaptive blocks.
+    """
+    ROOT.set_num_threads(1)
+    ROOT.set_warm_start(0)
+
+    print('mode      blocks  refits  rejected  Minuit calls  time (s)  median/max sigma error (%)')
+
+    for mode in ['fixed', 'adaptive']:
+        ROOT.set_adaptive(precision if mode == 'adaptive' else 0)
+        ROOT.fit_slices(0, blockSize, '{0}_{1}'.format(title, mode), 'E^{gen}')
+
+        # relative errors of accepted widths
+        errs = sorted(ey/y for (x, y, ex, ey) in graph_points(ROOT.grSigmas[0]))
+        if not errs:
+            raise Exception('no blocks accepted')
+
+        print('{0:8s}  {1:6d}  {2:6d}  {3:8d}  {4:12d}  {5:8.2f}  {6:12.2f}/{7:.2f}'.format(
+            mode, ROOT.gFitBlocks, ROOT.gFitRefits, ROOT.gFitRejected, ROOT.gFitCalls,
+            ROOT.gFitTime, 100 * errs[len(errs)//2], 100 * errs[-1]))
+
+        if precision <= 0:
+            precision = errs[len(errs)//2]
+
+    ROOT.set_adaptive(0)
+
+def bench_bootstrap(nreplicas, blockSize, title):
+    """Measures the cost of bootstrap errors (set_bootstrap()) relative to
+    fits of blocks, and compares them with errors of fits.
+    """
+    ROOT.set_num_threads(1)
+    ROOT.set_warm_start(0)
+
+    print('replicas  time (s)')
+
+    times = []
+    for n in [0, nreplicas]:
+        ROOT.set_bootstrap(n)
+        ROOT.fit_slices(0, blockSize, '{0}_bootstrap{1}'.format(title, n), 'E^{gen}')
+        times.append(ROOT.gFitTime)
+        print('{0:8d}  {1:8.2f}'.format(n, times[-1]))
+
+    ROOT.set_bootstrap(0)
+
+    print('bootstrap overhead: {0:.1f}% of the time of fits'.format(100 * (times[1]/times[0] - 1)))
+
+    # bootstrap/fit errors of accepted blocks; NOTE: the quality cut passes
+    # fits which gave no errors, see is_accepted()
+    blocks = [b for b in ROOT.gBlocks[0] if b.accepted and b.err[1] > 0 and b.err[2] > 0]
+    if not blocks:
+        raise Exception('no blocks accepted')
+
+    ratios = sorted(b.boot[0]/b.err[1] for b in blocks)
+    print('bootstrap/fit errors of mean:  median {0:.2f}, min {1:.2f}, max {2:.2f}'.format(
+        ratios[len(ratios)//2], ratios[0], ratios[-1]))
+
+    ratios = sorted(b.boot[1]/(b.err[2]/b.par[1]) for b in blocks)
+    print('bootstrap/fit errors of sigma: median {0:.2f}, min {1:.2f}, max {2:.2f}'.format(
+        ratios[len(ratios)//2], ratios[0], ratios[-1]))
+
+def graph_points(gr):
+    """Returns list of (x, y, ex, ey) tuples of a TGraphErrors.
+    """
+    return [(gr.GetX()[i], gr.GetY()[i], gr.GetEX()[i], gr.GetEY()[i]) for i in range(gr.GetN())]
+
+
+if __name__ == '__main__':
+    main()
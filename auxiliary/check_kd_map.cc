@@ -0,0 +1,147 @@
+/* Checks the partition of entries into cells of resolution maps by BuildMap()
+ * of kd_map.h on random columns: leaves must cover every entry exactly once,
+ * contain only entries inside their boxes, and have equal populations.
+ *
+ * Needs no ROOT class; run from the top directory, either as
+ *
+ *    root -l -b -q auxiliary/check_kd_map.cc+
+ *
+ * or compiled on its own:
+ *
+ *    g++ -std=c++11 -O2 -o check_kd_map auxiliary/check_kd_map.cc && ./check_kd_map
+ */
+
+#include <algorithm>
+#include <cstdio>
+#include <numeric>
+#include <random>
+#include <vector>
+
+#include "../kd_map.h"
+
+using namespace std;
+
+//______________________________________________________________________________
+int check_map(size_t n, size_t ndim, size_t blockSize, int layers, bool equal)
+{
+   /* Builds the map of n entries in ndim random variables and returns the
+    * number of failed checks; equal = populations of leaves must be equal,
+    * otherwise they may differ by one entry per split.
+    */
+
+   mt19937 gen(12345);
+   normal_distribution<float> gauss;
+   exponential_distribution<float> expo;
+
+   // one variable with ties, as nVtx
+   vector<vector<float> > columns(ndim, vector<float>(n));
+   for (size_t i = 0; i < n; i++) {
+      columns[0][i] = expo(gen);
+      columns[1][i] = (int) (20 + 5 * gauss(gen));
+      if (ndim == 3) columns[2][i] = gauss(gen);
+   }
+
+   vector<const float*> cols;
+   for (size_t d = 0; d < ndim; d++)
+      cols.push_back(columns[d].data());
+
+   vector<size_t> entries(n);
+   iota(entries.begin(), entries.end(), 0);
+
+   vector<map_leaf_t> leaves = BuildMap(cols, entries, blockSize, layers);
+
+   int nfailed = 0;
+   size_t next = 0;
+   size_t minPop = n, maxPop = 0;
+   int maxLayer = 0;
+
+   for (size_t l = 0; l < leaves.size(); l++) {
+      const map_leaf_t& leaf = leaves[l];
+
+      // leaves are consecutive ranges of entries
+      if (leaf.first != next || leaf.last <= leaf.first) {
+         fprintf(stderr, "   leaf %lu: entries [%lu, %lu), expected first = %lu\n", l, leaf.first,
+                 leaf.last, next);
+         nfailed++;
+      }
+      next = leaf.last;
+
+      size_t pop = leaf.last - leaf.first;
+      minPop = min(minPop, pop);
+      maxPop = max(maxPop, pop);
+      maxLayer = max(maxLayer, leaf.layer);
+
+      // entries are inside the box
+      for (size_t k = leaf.first; k < leaf.last; k++)
+         for (size_t d = 0; d < ndim; d++) {
+            float v = cols[d][entries[k]];
+            if (v < leaf.lo[d] || v > leaf.hi[d]) {
+               fprintf(stderr, "   leaf %lu: entry %lu outside the box in variable %lu\n", l,
+                       entries[k], d);
+               nfailed++;
+               break;
+            }
+         }
+   }
+
+   if (next != n) {
+      fprintf(stderr, "   leaves end at entry %lu of %lu\n", next, n);
+      nfailed++;
+   }
+
+   // every entry exactly once
+   vector<size_t> sorted(entries);
+   sort(sorted.begin(), sorted.end());
+   for (size_t i = 0; i < n; i++)
+      if (sorted[i] != i) {
+         fprintf(stderr, "   entries are not a permutation of 0..%lu\n", n - 1);
+         nfailed++;
+         break;
+      }
+
+   if ((equal && minPop != maxPop) || minPop < blockSize || maxPop >= 2 * blockSize) {
+      fprintf(stderr, "   populations %lu..%lu for blockSize = %lu\n", minPop, maxPop, blockSize);
+      nfailed++;
+   }
+
+   // number of layers is rounded up to a power of 2
+   int nlayers = 1;
+   while (ndim == 3 && nlayers < layers)
+      nlayers *= 2;
+
+   if (maxLayer != nlayers - 1) {
+      fprintf(stderr, "   %d layers, expected %d\n", maxLayer + 1, nlayers);
+      nfailed++;
+   }
+
+   printf("%lu entries, %lu variables: %lu leaves of %lu..%lu entries, %d layer(s): %s\n", n, ndim,
+          leaves.size(), minPop, maxPop, maxLayer + 1, nfailed ? "FAILED" : "ok");
+
+   return nfailed;
+}
+
+//______________________________________________________________________________
+int check_kd_map()
+{
+   /* Runs the checks, returns the number of failed ones.
+    */
+
+   int nfailed = 0;
+
+   // n = power of 2 times blockSize: all leaves equal
+   nfailed += check_map(1000 << 7, 2, 1000, 1, true);
+   nfailed += check_map(1000 << 7, 3, 1000, 4, true);
+
+   // any n
+   nfailed += check_map(123457, 2, 1000, 1, false);
+   nfailed += check_map(123457, 3, 500, 3, false);
+
+   return nfailed;
+}
+
+#ifndef __CLING__
+int main()
+{
+   return check_kd_map() ? 1 : 0;
+}
+#endif
@@ -7,10 +7,15 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
+import sys
 import fnmatch
 import ROOT
 
+# shared modules of the top directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import result_cache
+import graph_math
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
@@ -90,18 +95,25 @@ def main():
     os.rename('plots_comparison', 'plots_comparison_{0}_{1}'.format(mva1, mva2))
 
 def get_graphs(ttype, infile, det, mva_branch, blockSize):
-    """Returns cached results.
+    """Returns cached results of draw_results.py for training ttype.
+
+    NOTE: the most recently used results are taken, see result_cache.py.
     """
     fname = os.path.basename(infile).replace('.root', '')
-    fmt = 'output_{0}/cache/draw_results_{1}_{2}_{3}_{4}.pkl'
-    cachefile = fmt.format(ttype, fname, det, mva_branch, blockSize)
+    name = 'draw_results_{0}_{1}_{2}_{3}'.format(fname, det, mva_branch, blockSize)
 
-    with open(cachefile, 'rb') as f:
-        return pickle.load(f)
+    result = result_cache.load_latest(name, 'output_{0}/cache'.format(ttype))
+    if result is None:
+        raise Exception('cached results {0} not found for {1}'.format(name, ttype))
+
+    return result
 
 def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ymax=-1):
     """Visualization of several graphs on single canvas.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -113,12 +125,11 @@ def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ym
     c.SetGridy()
 
     # draw dummy histogram
-    xmin = min(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (xmin, xmaxAll, ymin, ymaxAll) = graph_math.bounds(grs)
     if xmax < 0:
-        xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
+        xmax = xmaxAll
     if ymax < 0:
-        ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+        ymax = ymaxAll
 
     frame = c.DrawFrame(0 if xmin >= 0 else xmin, ymin * 0.9, xmax, ymax * 1.1)
     frame.SetTitle(title)
@@ -159,6 +170,9 @@ def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ym
 def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ymax=-1):
     """Visualization of graphs along with corrected/uncorrected ratios.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -179,12 +193,11 @@ def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, y
     pad1.SetGridy()
 
     # draw dummy histogram
-    xmin = min(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (xmin, xmaxAll, ymin, ymaxAll) = graph_math.bounds(grs)
     if xmax < 0:
-        xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
+        xmax = xmaxAll
     if ymax < 0:
-        ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+        ymax = ymaxAll
 
     frame = pad1.DrawFrame(0 if xmin >= 0 else xmin, ymin * 0.9, xmax, ymax * 1.1)
     frame.SetTitle(title)
@@ -228,49 +241,12 @@ def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, y
     pad2.SetGridx()
     pad2.SetGridy()
 
-    # make corrected/uncorrected ratios
-    rats = [[ROOT.TGraphErrors() for _ in range(ncorr)] for _ in range(2)]
-
-    for t in range(2):
-        for n in range(ncorr):
-            gru = grs[n]         # uncorrected
-            grc = grs[ncorr * (t + 1) + n] # corrected
-
-            for i in range(grc.GetN()):
-                x  = grc.GetX()[i]
-                y1 = grc.GetY()[i]
-                ex  = grc.GetEX()[i]
-                ey1 = grc.GetEY()[i]
-
-                # NOTE: gru may have different x and ex, but we ignore this
-                # difference. Instead, y for gru is estimated from linear
-                # extrapolation between corresponding nearest points.
-
-                # find nearest points
-                for j in range(gru.GetN() - 1):
-                    x1 = gru.GetX()[j]
-                    x2 = gru.GetX()[j + 1]
-
-                    if  x1 <= x < x2:
-                        a = (gru.GetY()[j] - gru.GetY()[j + 1]) / (x1 - x2)
-                        b = gru.GetY()[j] - a * x1
-                        y2 = a * x + b
-
-                        ea = (gru.GetEY()[j] - gru.GetEY()[j + 1]) / (x1 - x2)
-                        eb = gru.GetEY()[j] - ea * x1
-                        ey2 = ea * x + eb
-
-                        break
-                else:
-                    if x < gru.GetX()[0]:
-                        y2 = gru.GetY()[0]
-                        ey2 = gru.GetEY()[0]
-                    else:
-                        y2 = gru.GetY()[gru.GetN() - 1]
-                        ey2 = gru.GetEY()[gru.GetN() - 1]
-
-                rats[t][n].SetPoint(i, x, y1/y2)
-                rats[t][n].SetPointError(i, ex, y1/y2 * ((ey1/y1)**2 + (ey2/y2)**2)**0.5)
+    # make corrected/uncorrected ratios;
+    # NOTE: uncorrected graphs may have different x and ex, but we ignore this
+    # difference. Instead, their y are estimated from linear interpolation
+    # between the nearest points, see graph_math.interpolate()
+    rats = [[result_cache.to_root(graph_math.ratio(grs[ncorr * (t + 1) + n], grs[n]))
+             for n in range(ncorr)] for t in range(2)]
 
     frame = pad2.DrawFrame(xmin, 0.1, xmax, 1.25)
     frame.SetXTitle(xtitle)
@@ -7,20 +7,39 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
+import sys
+import time
 import fnmatch
+import argparse
+import numpy as np
 import ROOT
 
+# shared modules of the top directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import result_cache
+import graph_math
+import tree_columns
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
 def main():
     """Steering function.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--threads', type=int, default=1,
+                        help='number of threads for fits of blocks (0 = number of CPU cores)')
+    args = parser.parse_args()
+
     ROOT.gROOT.SetBatch(True)
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
 
+    # compiled slice fits (see slice_fit.h)
+    ROOT.gSystem.SetBuildDir('output', True)
+    ROOT.gROOT.LoadMacro('slice_fit.h+')
+    nthreads = ROOT.InitThreads(args.threads)
+
     # ntuples to process
     infiles = fnmatch.filter(os.listdir('input'), '*.root')
     infiles = sorted('input/' + f for f in infiles)
@@ -34,7 +53,7 @@ def main():
             os.mkdir(d)
 
     for det in ['EB', 'EE']:
-        r = [make_graphs(f, det, blockSize=20000, pfSize=0) for f in infiles]
+        r = [make_graphs(f, det, blockSize=20000, pfSize=0, nthreads=nthreads) for f in infiles]
 
         # repack graphs into per-parameter tuples
         r = list(zip(*r))
@@ -51,10 +70,11 @@ def main():
         combine_distr(r[4], txts, 'fit_distr_alphaR_' + det, det, '#alpha_{R}', 11)
         combine_distr(r[5], txts, 'fit_distr_powerR_' + det, det, 'n_{R}', 110)
 
-def make_graphs(infile, det, blockSize=10000, pfSize=0):
+def make_graphs(infile, det, blockSize=10000, pfSize=0, nthreads=1):
     """Fills, fits and visualizes distributions of Etrue/Erec.
 
-    Results are cached into file.
+    Data points are sorted by pT and split into blocks, every block is fitted
+    in C++, see FitSlices() in slice_fit.h. Results are cached into file.
 
     pfSize > 0: take PFClusters of only this size;
     pfSize = 0: take all PFClusters;
@@ -62,12 +82,16 @@ def make_graphs(infile, det, blockSize=10000, pfSize=0):
     """
     # return cached results, if any
     fname = os.path.basename(infile).replace('.root', '')
-    fmt = 'output/cache/draw_fit_params_{0}_{1}_{2}_{3}{4}.pkl'
+    fmt = 'draw_fit_params_{0}_{1}_{2}_{3}{4}'
     sign = 'p' if pfSize >= 0 else 'm'
-    cachefile = fmt.format(fname, det, blockSize, sign, abs(pfSize))
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
+    name = fmt.format(fname, det, blockSize, sign, abs(pfSize))
+    cachefile = result_cache.key(name, [infile], [make_graphs, fit_settings, 'tree_columns.py',
+                                                  'slice_fit.h', 'fit_shape.h'])
+    result = result_cache.load(cachefile)
+    if result is not None:
+        return result
+
+    t0 = time.time()
 
     # get TTree with PFClusters
     fi = ROOT.TFile(infile)
@@ -75,73 +99,91 @@ def make_graphs(infile, det, blockSize=10000, pfSize=0):
     if not tree:
         raise Exception('TTree not found')
 
-    data = []  # (pTtrue, Etrue/Erec) tuples
+    # remove "fakes"; NOTE: cuts were evaluated with draw_inputs.py
+    cuts = ['pfPhoDeltaR <= 0.03', 'pfE/mcE >= 0.4']
 
-    # collect data
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
+    # barrel vs endcaps
+    if det == 'EB':
+        cuts.append('abs(pfEta) <= 1.479')
+    else:
+        cuts.append('abs(pfEta) >= 1.479')
 
-        # skip PFClusters of wrong size
-        if pfSize > 0:
-            if tree.pfSize5x5_ZS != pfSize:
-                continue
-        elif pfSize < 0:
-            if tree.pfSize5x5_ZS < -pfSize:
-                continue
+    # skip PFClusters of wrong size
+    if pfSize > 0:
+        cuts.append('pfSize5x5_ZS == {0}'.format(pfSize))
+    elif pfSize < 0:
+        cuts.append('pfSize5x5_ZS >= {0}'.format(-pfSize))
 
-        # barrel vs endcaps
-        if det == 'EB':
-            if abs(tree.pfEta) > 1.479:
-                continue
-        else:
-            if abs(tree.pfEta) < 1.479:
-                continue
+    columns = tree_columns.read(tree, ['mcPt', 'mcE/pfE'], ' && '.join(cuts))
+    (pt, tgt) = [x.astype(np.float32) for x in columns]
+    t1 = time.time()
 
-        # remove "fakes"; NOTE: cuts were evaluated with draw_inputs.py
-        if tree.pfPhoDeltaR > 0.03 or tree.pfE/tree.mcE < 0.4:
-            continue
+    # sort by pT and fit blocks of data points
+    blocks = ROOT.FitSlices(pt, tgt, len(pt), blockSize, fit_settings(), nthreads)
+    t2 = time.time()
 
-        data.append((tree.mcPt, tree.mcE/tree.pfE))
+    fmt = '{0} {1}: {2} entries read in {3:.1f} s, {4} blocks fitted in {5:.1f} s'
+    print(fmt.format(fname, det, len(pt), t1 - t0, len(blocks), t2 - t1), file=sys.stderr)
 
-    # sort by pT in increasing order
-    data.sort(key=lambda x: x[0])
+    draw_fits(blocks, 'fits_{0}_{1}'.format(fname, det))
 
-    grAmp    = ROOT.TGraphErrors()
-    grMean   = ROOT.TGraphErrors()
-    grSigma  = ROOT.TGraphErrors()
-    grAlphaL = ROOT.TGraphErrors()
-    grAlphaR = ROOT.TGraphErrors()
-    grPowerR = ROOT.TGraphErrors()
-    grChiNdf = ROOT.TGraphErrors()
+    # graphs vs pT: amp, mean, sigma, alphaL, alphaR, powerR and chi2/ndf
+    x = np.array([res.meanX for res in blocks])
+    ex = np.array([res.sigmaX for res in blocks])
 
-    result = (grAmp, grMean, grSigma, grAlphaL, grAlphaR, grPowerR, grChiNdf)
+    result = []
+    for i in range(6):
+        y = np.array([res.par[i] for res in blocks])
+        ey = np.array([res.err[i] for res in blocks])
+        result.append(result_cache.Graph(x, y, ex, ey))
 
-    # loop over blocks of pT-ordered data
-    # NOTE: last block is excluded if it has less than 0.5 * blockSize entries
-    for b in range(int(round(len(data)/blockSize))):
-        block = data[b * blockSize:(b + 1) * blockSize]
+    y = np.array([res.chi2/res.ndf for res in blocks])
+    result.append(result_cache.Graph(x, y, ex, np.zeros(len(x))))
 
-        # mean and sigma in the block of pT and Etrue/Erec
-        (meanPt, sigmaPt)   = mean_sigma([x[0] for x in block])
-        (meanTgt, sigmaTgt) = mean_sigma([x[1] for x in block])
+    result = tuple(result)
+
+    # save cache
+    result_cache.save(cachefile, result)
+
+    return result
 
-        xmin = meanTgt - 5 * sigmaTgt
-        xmax = meanTgt + 6 * sigmaTgt
-        h = ROOT.TH1D('h', '', 100, xmin, xmax)
+def fit_settings():
+    """Returns settings of fits of blocks, see slice_fit_t in slice_fit.h.
 
-        for (pt, tgt) in block:
-            h.Fill(tgt)
+    Etrue/Erec in [mean - 5 sigma, mean + 6 sigma] is fitted by likelihood
+    with Gaussian + exponential left tail + power-law right tail.
+    """
+    cfg = ROOT.slice_fit_t()
+
+    cfg.powerLawOnRight = True
+    cfg.nbins = 100
+    cfg.relative = True
+    cfg.xmin = -5
+    cfg.xmax = 6
+
+    cfg.SetTails(1.5, 1.5, 20)
+    cfg.SetLimits(0, 0.33, 2)     # in units of the histogram maximum
+    cfg.SetLimits(1, 0.9, 1.6)
+    cfg.SetLimits(2, 0.33, 3)     # in units of sigma of Etrue/Erec
+    cfg.SetLimits(3, 0, 10)
+    cfg.SetLimits(4, 0, 10)
+    cfg.SetLimits(5, 1.01, 100)
+
+    cfg.prefit = ''
+    cfg.option = 'QEMLG'
+
+    return cfg
+
+def draw_fits(blocks, title):
+    """Draws fitted distributions of blocks (nine per canvas) and saves
+    canvases as images.
+    """
+    for b in range(len(blocks)):
+        res = blocks[b]
 
         # create new canvas, if necessary
         if b % 9 == 0:
-            try:
-                c.SaveAs('output/plots_fit_params/{0}.png'.format(c.GetTitle()))
-            except UnboundLocalError:
-                pass
-
-            fmt = 'fits_{0}_{1}_blk{2:03d}to{3:03d}'
-            cname = fmt.format(fname, det, b + 1, b + 9)
+            cname = '{0}_blk{1:03d}to{2:03d}'.format(title, b + 1, b + 9)
             c = ROOT.TCanvas(cname, cname, 1000, 700)
             saves.append(c)
 
@@ -157,94 +199,40 @@ def make_graphs(infile, det, blockSize=10000, pfSize=0):
         ROOT.gPad.SetTopMargin(0.08)
         ROOT.gPad.SetBottomMargin(0.08)
 
-        h.SetTitle('p_{{T}}^{{gen}} = {0:.2f} #pm {1:.2f}'.format(meanPt, sigmaPt))
+        # restore fitted histogram
+        h = ROOT.TH1D('h', '', len(res.contents) - 2, res.xmin, res.xmax)
+        for (i, n) in enumerate(res.contents):
+            h.SetBinContent(i, n)
+            h.SetBinError(i, n**0.5)
+
+        h.SetTitle('p_{{T}}^{{gen}} = {0:.2f} #pm {1:.2f}'.format(res.meanX, res.sigmaX))
         h.SetXTitle('E^{gen}/E^{PF}')
         h.SetYTitle('Entries')
         h.SetTitleOffset(1.6, 'Y')
 
-        h.Sumw2(True)
         h.SetLineColor(ROOT.kBlack)
         h.Draw()
-        saves.append(h)
 
         # Gaussian + exponential left tail + power-law right tail
-        gaus = 'exp(-(x-[1])^2/(2*[2]*[2]))'
-        left = 'exp(0.5*[3]*[3] + [3]*(x-[1])/[2])'
-        rght = '([5]/[4])^[5] * exp(-0.5*[4]^2) * ((x-[1])/[2]-[4]+[5]/[4])^(-[5])'
-
-        expr = ('[0] * (' +
-                    '(x-[1])/[2] > -[3] ? ' +
-                        '( (x-[1])/[2] < [4] ? {0}:{1} ) :'.format(gaus, rght) +
-                    '{0} )'.format(left))
-
-        fit = ROOT.TF1('fit', expr, xmin, xmax)
+        fit = ROOT.TailShapeTF1('fit', res.xmin, res.xmax, True)
         fit.SetLineWidth(1)
-        fit.SetNpx(2000)
-
-        fit.SetParameters(h.GetMaximum(), meanTgt, sigmaTgt, 1.5, 1.5, 20)
-        fit.SetParLimits(0, 0.33 * h.GetMaximum(), 2 * h.GetMaximum())
-        fit.SetParLimits(1, 0.9, 1.6)
-        fit.SetParLimits(2, 0.33 * sigmaTgt, 3 * sigmaTgt)
-        fit.SetParLimits(3, 0, 10)
-        fit.SetParLimits(4, 0, 10)
-        fit.SetParLimits(5, 1.01, 100)
-
-        h.Fit(fit, 'QEML', 'same', xmin, xmax)
-
-        ROOT.gPad.Update()
+        fit.SetNpx(500)
+        fit.SetParameters(res.par)
+        fit.Draw('same')
 
-        for (i, gr) in enumerate(result[:-1]):
-            gr.SetPoint(b, meanPt, fit.GetParameter(i))
-            gr.SetPointError(b, sigmaPt, fit.GetParError(i))
+        saves.append((h, fit))
 
-        grChiNdf.SetPoint(b, meanPt, fit.GetChisquare()/fit.GetNDF())
-        grChiNdf.SetPointError(b, sigmaPt, 0)
-
-    # save the very last canvas
-    c.SaveAs('output/plots_fit_params/{0}.png'.format(c.GetTitle()))
-
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
-
-    return result
-
-def mean_sigma(numbers, nsigmas=3):
-    """Returns average (mean) and dispersion (sigma) for an array of numbers.
-
-    Mean and sigma are recalculated iteratively several times. During each
-    calculation, a region [mean - nsigmas * sigma, mean + nsigmas * sigma] is
-    used, where 'mean' and 'sigma' are taken from a previous iteration.
-    """
-    # zero-order iteration
-    mean = sum(numbers)/len(numbers)
-    sigma = (sum(x**2 for x in numbers)/len(numbers) - mean**2)**0.5
-
-    # iterations
-    for _ in range(1000):
-        mean_prev = mean
-        sigma_prev = sigma
-
-        xmin = mean - nsigmas * sigma
-        xmax = mean + nsigmas * sigma
-
-        arr = [x for x in numbers if xmin <= x <= xmax]
-
-        mean = sum(arr)/len(arr)
-        sigma = (sum(x**2 for x in arr)/len(arr) - mean**2)**0.5
-
-        # break when converged
-        if (abs(mean - mean_prev) <= 1e-6 * abs(mean) and
-            abs(sigma - sigma_prev) <= 1e-6 * abs(sigma)):
-           break
-    else:
-        raise Exception('mean/sigma did not converged')
-
-    return (mean, sigma)
+        # save the canvas when it is full or the block is the last one
+        if b % 9 == 8 or b == len(blocks) - 1:
+            c.Update()
+            c.SaveAs('output/plots_fit_params/{0}.png'.format(c.GetTitle()))
 
 def combine(grs, txts, cname, title, ytitle):
     """Visualization of several graphs on single canvas.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -256,9 +244,7 @@ def combine(grs, txts, cname, title, ytitle):
     c.SetGridy()
 
     # draw dummy histogram
-    xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
-    ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (_, xmax, ymin, ymax) = graph_math.bounds(grs)
     frame = c.DrawFrame(0, ymin * 0.9, xmax, ymax * 1.1)
 
     frame.SetTitle(title)
@@ -293,12 +279,15 @@ def combine(grs, txts, cname, title, ytitle):
 def combine_distr(grs, txts, cname, title, xtitle, xmax):
     """Visualization of several distributions on single canvas.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     histos = [ROOT.TH1D('h', '', 100, 0, xmax) for _ in range(len(grs))]
 
     # fill histograms
     for (h, gr) in zip(histos, grs):
-        for i in range(gr.GetN()):
-            h.Fill(gr.GetY()[i])
+        for y in graph_math.arrays(gr).y:
+            h.Fill(y)
 
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
@@ -7,25 +7,44 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
-import fnmatch
+import sys
+import argparse
+import numpy as np
 import ROOT
 
+# shared modules of the top directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import partials
+import result_cache
+import tree_columns
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
+# variables with PFCluster sizes
+SIZE_VARS = ['pfSize5x5_ZS', 'pfSize', 'pfSize5x5_noZS']
+
+# number of histograms per variable; the last one takes larger sizes too
+NSIZES = 6
+
 def main():
     """Steering function.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('infiles', nargs='*', metavar='NTUPLE',
+                        help='ntuples to process, every one a sample of its own '
+                             '(default: samples in input/, see partials.find_samples())')
+    args = parser.parse_args()
+
     ROOT.gROOT.SetBatch(True)
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
 
-    # ntuples to process
-    input = '/afs/cern.ch/work/k/konush/public/PFClusterCalib_Apr2015/input'
-    infiles = fnmatch.filter(os.listdir(input), '*.root')
-    infiles = sorted(input + '/' + f for f in infiles)
-    #infiles = ["/afs/cern.ch/work/k/konush/public/PFClusterCalib_Apr2015/input/ntuple_photongun_nopu.root"]
+    # samples to process: input/<sample>.root or input/<sample>/*.root
+    if args.infiles:
+        samples = [(os.path.basename(f).replace('.root', ''), [f]) for f in args.infiles]
+    else:
+        samples = partials.find_samples('input')
 
     # make output directories
     for d in ['output', 'output/cache', 'output/plots']:
@@ -33,64 +52,64 @@ def main():
             os.mkdir(d)
 
     for det in ['EB', 'EE']:
-        for infile in infiles:
-            r = make_histos(infile, det)
+        for (sample, infiles) in samples:
+            r = make_histos(sample, infiles, det)
 
-            txt = infile[infile.rfind('gun_') + 4:].replace('.root', '')
-            cname = 'pfsize_{0}_{1}'.format(txt, det)
-            combine(r, cname, '{0}, {1}'.format(txt, det))
+            txt = sample[sample.rfind('gun_') + 4:]
+            for (var, histos) in zip(SIZE_VARS, r):
+                cname = '{0}_{1}_{2}'.format(var, txt, det)
+                combine(histos, cname, '{0}, {1}'.format(txt, det), var)
 
-def make_histos(infile, det):
-    """Fills histograms with PFCluster sizes vs pT.
+def make_histos(sample, infiles, det):
+    """Fills histograms with PFCluster sizes vs pT of a sample made of
+    ntuples infiles.
 
-    Results are cached into file.
+    Returns list of histograms of pT, one per size of 1..NSIZES (last one:
+    size >= NSIZES), for every variable of SIZE_VARS. Results are cached per
+    ntuple, see partials.aggregate().
     """
-    # return cached results, if any
-    fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_pfsize_{0}_{1}.pkl'.format(fname, det)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
+    name = 'draw_pfsize_{0}_{1}'.format(sample, det)
+    return partials.aggregate(name, infiles, fill_histos, ['tree_columns.py'], det=det)
 
+def fill_histos(infile, det):
+    """Fills histograms of make_histos() with PFClusters of one ntuple: a 2-D
+    histogram of pT x size for every variable of SIZE_VARS, all of them in one
+    pass over the ntuple.
+    """
     # get TTree with PFClusters
     fi = ROOT.TFile(infile)
     tree = fi.Get('ntuplizer/PFClusterTree')
     if not tree:
         raise Exception('TTree not found')
 
-    result = [ROOT.TH1D('h', '', 60, 0, 6) for _ in range(6)]
-
-    # fill histograms
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
+    # barrel vs endcaps; NOTE: pfEta, not mcEta
+    if det == 'EB':
+        selection = '!(abs(pfEta) > 1.479)'
+    else:
+        selection = '!(abs(pfEta) < 1.479)'
 
-        # barrel vs endcaps
-        if det == 'EB':
-            if abs(tree.pfEta) > 1.479:
-                continue
-        else:
-            if abs(tree.pfEta) < 1.479:
-                continue
+    # remove "fakes"; NOTE: cuts were evaluated with draw_inputs.py
+    selection += ' && !(pfPhoDeltaR > 0.03) && !(pfE/mcE < 0.4)'
 
-        # remove "fakes"; NOTE: cuts were evaluated with draw_inputs.py
-        if tree.pfPhoDeltaR > 0.03 or tree.pfE/tree.mcE < 0.4:
-            continue
+    columns = tree_columns.read(tree, ['mcPt'] + SIZE_VARS, selection)
+    ptTrue = columns[0]
 
-        pfSize = min(len(result), tree.pfSize5x5_ZS)
-        ptTrue = tree.mcPt
+    result = []
+    for (var, size) in zip(SIZE_VARS, columns[1:]):
+        h = ROOT.TH2D('h', '', 60, 0, 6, NSIZES, 0.5, NSIZES + 0.5)
+        tree_columns.fill2(h, ptTrue, np.minimum(size, NSIZES))
 
-        result[pfSize - 1].Fill(ptTrue)
+        # histograms of pT per size
+        result.append([h.ProjectionX('h_{0}_{1}'.format(var, i), i, i) for i in range(1, NSIZES + 1)])
 
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
+    return result_cache.from_root(result)
 
-    return result
-
-def combine(histos, cname, title=''):
+def combine(histos, cname, title='', var='pfSize'):
     """Visualization on single canvas.
     """
+    # ROOT objects from cached arrays
+    histos = [result_cache.to_root(h) for h in histos]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -143,7 +162,7 @@ def combine(histos, cname, title=''):
 
     for (i, h) in enumerate(reversed(hsums)):
         sign = '#geq' if i == len(hsums) - 1 else '='
-        leg.AddEntry(h, 'pfSize {0} {1}'.format(sign, i + 1), 'f')
+        leg.AddEntry(h, '{0} {1} {2}'.format(var, sign, i + 1), 'f')
 
     leg.SetFillColor(ROOT.kWhite)
     leg.Draw('same')
@@ -11,35 +11,55 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
-import fnmatch
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
 import ROOT
 
+import partials
+import result_cache
+import tree_columns
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
+# slices of deltaR histograms in pT and of pfE/mcE histograms in deltaR
+PT_PAIRS = [(0, 1), (1, 10), (10, 20), (20, 100)]
+DR_PAIRS = [(0, 0.005), (0, 0.01), (0, 0.02), (0, 0.03), (0, 0.1)]
+
 def main():
     """Steering function.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes filling histograms '
+                             '(0 = number of CPU cores, default: 1)')
+    args = parser.parse_args()
+
     ROOT.gROOT.SetBatch(True)
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
 
-    # ntuples to process
-    infiles = fnmatch.filter(os.listdir('input'), '*.root')
-    infiles = sorted('input/' + f for f in infiles)
+    # samples to process: input/<sample>.root or input/<sample>/*.root
+    samples = partials.find_samples('input')
+    names = [s for (s, _) in samples]
 
     # text in legends
-    txts = [f[f.rfind('gun_') + 4:].replace('.root', '') for f in infiles]
+    txts = [s[s.rfind('gun_') + 4:] for s in names]
 
     # make output directories
     for d in ['output', 'output/cache', 'output/plots_inputs']:
         if not os.access(d, os.X_OK):
             os.mkdir(d)
 
+    # fill all histograms before drawing
+    histos = make_all(samples, args.jobs)
+
     # draw distributions of inputs
     for det in ['EB', 'EE']:
-        r = [make_histos(infile, det) for infile in infiles]
+        r = [histos[('inputs', s, det)] for s in names]
 
         # repack histograms into per-pileup tuples;
         # order: hE hEta hPhi hRMax hR2nd hR13 hR22 hR25 hR33 hR55 hNVtx
@@ -69,33 +89,31 @@ def main():
 
     # draw distributions of deltaR vs pT slices
     for det in ['EB', 'EE']:
-        ptPairs = [(0, 1), (1, 10), (10, 20), (20, 100)]
-        r = [make_histos_deltaR(infile, det, ptPairs) for infile in infiles]
+        r = [histos[('deltaR', s, det)] for s in names]
 
         # repack histograms into per-pileup tuples
         r = list(zip(*r))
 
-        for ((pt1, pt2), histos) in zip(ptPairs, r):
+        for ((pt1, pt2), hs) in zip(PT_PAIRS, r):
             cname = 'deltaR_{0}_pT_{1:.1f}_{2:.1f}'.format(det, pt1, pt2)
             fmt = '{0}, {1:.1f} <= p_{{T}}^{{gen}} < {2:.1f} GeV/c^{{2}}'
             title = fmt.format(det, pt1, pt2) + ' ' * 50
-            combine(histos, txts, cname, title, '#Delta R(MC photon, PFCluster)', -1, topLegend=True, logY=True)
+            combine(hs, txts, cname, title, '#Delta R(MC photon, PFCluster)', -1, topLegend=True, logY=True)
 
     # draw distributions of pfE/mcE vs deltaR slices
     for det in ['EB', 'EE']:
-        dRPairs = [(0, 0.005), (0, 0.01), (0, 0.02), (0, 0.03), (0, 0.1)]
-        r = [make_histos_pfEToMcE(infile, det, dRPairs) for infile in infiles]
+        r = [histos[('pfEToMcE', s, det)] for s in names]
 
         # repack histograms into per-pileup tuples
         r = list(zip(*r))
 
-        for ((dR1, dR2), histos) in zip(dRPairs, r):
+        for ((dR1, dR2), hs) in zip(DR_PAIRS, r):
             cname = 'pfEToMcE_{0}_dR_{1:.3f}_{2:.3f}'.format(det, dR1, dR2)
             title = '{0}, {1:.3f} <= #Delta R < {2:.3f}'.format(det, dR1, dR2)
-            combine(histos, txts, cname, title, 'E^{PF}/E^{gen}', -1, topLegend=True, logY=True)
+            combine(hs, txts, cname, title, 'E^{PF}/E^{gen}', -1, topLegend=True, logY=True)
 
     # MC truth
-    r = [make_histos_mc(infile) for infile in infiles]
+    r = [histos[('mc', s, None)] for s in names]
 
     # repack histograms into per-pileup tuples;
     # order: hPtEB hPtEE hEta hPhi hPtZoomEB hPtZoomEE
@@ -109,18 +127,77 @@ def main():
     combine(r[2], txts, 'mcEta', 'MC truth', '#eta^{gen}')
     combine(r[3], txts, 'mcPhi', 'MC truth', '#phi^{gen}')
 
-def make_histos(infile, det='EB'):
-    """Fills histograms with distributions of PFCluster parameters.
+def make_all(samples, jobs=1):
+    """Fills histograms of all families for all samples (see
+    partials.find_samples()) and detectors.
+
+    Returns dict (family, sample, det) -> result of the family's make_*()
+    function; det = None for MC truth histograms.
+
+    jobs > 1: work units (family, sample, det) are processed by a pool of
+    jobs worker processes, jobs = 0: by as many workers as CPU cores. Workers
+    return histograms as arrays (see result_cache), which are collected here,
+    so results are the same as with jobs = 1.
+    """
+    units = []
+    for (sample, infiles) in samples:
+        for det in ['EB', 'EE']:
+            units.append(('inputs', sample, infiles, det))
+            units.append(('deltaR', sample, infiles, det))
+            units.append(('pfEToMcE', sample, infiles, det))
+
+        units.append(('mc', sample, infiles, None))
+
+    if jobs < 1:
+        jobs = multiprocessing.cpu_count()
+
+    if jobs == 1:
+        results = [make_unit(unit) for unit in units]
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(units)))
+        results = pool.map(make_unit, units, chunksize=1)
+        pool.close()
+        pool.join()
+
+    keys = [(family, sample, det) for (family, sample, _, det) in units]
+    return dict(zip(keys, results))
 
-    Results are cached into file.
+def make_unit(unit):
+    """Fills histograms of one work unit (family, sample, infiles, det), see
+    make_all().
     """
-    # return cached results, if any
-    fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_inputs_{0}_{1}.pkl'.format(fname, det)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
+    (family, sample, infiles, det) = unit
+
+    if family == 'inputs':
+        return make_histos(sample, infiles, det)
+    elif family == 'deltaR':
+        return make_histos_deltaR(sample, infiles, det, PT_PAIRS)
+    elif family == 'pfEToMcE':
+        return make_histos_pfEToMcE(sample, infiles, det, DR_PAIRS)
+    else:
+        return make_histos_mc(sample, infiles)
+
+def normalize(partial):
+    """Returns histograms of a sum of partials (histograms, entries) divided
+    by the number of entries.
+    """
+    (histos, entries) = partial
+    return type(histos)(partials.scale(h, 1/entries[0]) for h in histos)
+
+def make_histos(sample, infiles, det='EB'):
+    """Fills histograms with distributions of PFCluster parameters of a sample
+    made of ntuples infiles.
+
+    Results are cached per ntuple, see partials.aggregate().
+    """
+    name = 'draw_inputs_{0}_{1}'.format(sample, det)
+    return normalize(partials.aggregate(name, infiles, fill_histos, ['tree_columns.py', select_det], det=det))
 
+def fill_histos(infile, det):
+    """Fills histograms of make_histos() with PFClusters of one ntuple.
+
+    Returns (histograms, number of entries).
+    """
     hE    = ROOT.TH1D('h', '', 250, 0, 1000)
     hEta  = ROOT.TH1D('h', '', 150, -3.2, 3.2)
     hPhi  = ROOT.TH1D('h', '', 150, -3.4, 3.4)
@@ -151,43 +228,6 @@ def make_histos(infile, det='EB'):
     if not tree:
         raise Exception('TTree not found')
 
-    # fill histograms
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
-
-        # barrel vs endcaps
-        if det == 'EB':
-            if abs(tree.pfEta) > 1.479:
-                continue
-        else:
-            if abs(tree.pfEta) < 1.479:
-                continue
-
-        # for brevity and slightly better performance
-        E = tree.pfE
-
-        hE.Fill(E)
-        hEta.Fill(tree.pfEta)
-        hPhi.Fill(tree.pfPhi)
-        hRMax.Fill(tree.pfEMax/E)
-        hR2nd.Fill(tree.pfE2nd/E)
-        hR13 .Fill(tree.pfE1x3/E)
-        hR22 .Fill(tree.pfE2x2/E)
-        hR25 .Fill(tree.pfE2x5Max/E)
-        hR33 .Fill(tree.pfE3x3/E)
-        hR55 .Fill(tree.pfE5x5/E)
-        hNVtx.Fill(tree.nVtx)
-
-        hIEta.Fill(tree.pfIEtaIX)
-        hIPhi.Fill(tree.pfIPhiIY)
-
-        if det == 'EE':
-            hPs1R.Fill(tree.ps1E/E)
-            hPs2R.Fill(tree.ps2E/E)
-            hPs1N.Fill(tree.ps1N)
-            hPs2N.Fill(tree.ps2N)
-
     if det == 'EB':
         result = (hE, hEta, hPhi, hRMax, hR2nd, hR13, hR22, hR25, hR33, hR55,
                   hNVtx, hIEta, hIPhi)
@@ -195,19 +235,30 @@ def make_histos(infile, det='EB'):
         result = (hE, hEta, hPhi, hRMax, hR2nd, hR13, hR22, hR25, hR33, hR55,
                   hNVtx, hIEta, hIPhi, hPs1R, hPs2R, hPs1N, hPs2N)
 
-    # normalization
-    for h in result:
-        h.Scale(1/tree.GetEntriesFast())
+    # quantities to fill, in the order of histograms
+    exprs = ['pfE', 'pfEta', 'pfPhi', 'pfEMax/pfE', 'pfE2nd/pfE', 'pfE1x3/pfE',
+             'pfE2x2/pfE', 'pfE2x5Max/pfE', 'pfE3x3/pfE', 'pfE5x5/pfE', 'nVtx',
+             'pfIEtaIX', 'pfIPhiIY']
 
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
+    if det == 'EE':
+        exprs += ['ps1E/pfE', 'ps2E/pfE', 'ps1N', 'ps2N']
 
-    return result
+    # fill histograms
+    t0 = time.time()
+    columns = tree_columns.read(tree, exprs, select_det(det))
+    for (h, x) in zip(result, columns):
+        tree_columns.fill(h, x)
+
+    report_rate('{0} {1}'.format(infile, det), tree, t0)
+
+    return (result_cache.from_root(result), np.array([tree.GetEntriesFast()], dtype=float))
 
 def combine(histos, txts, cname, title, xtitle, xmax=-1, topLegend=False, logY=False):
     """Visualization of several histograms on single canvas.
     """
+    # ROOT objects from cached arrays
+    histos = [result_cache.to_root(h) for h in histos]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -257,32 +308,22 @@ def combine(histos, txts, cname, title, xtitle, xmax=-1, topLegend=False, logY=F
     c.Update()
     c.SaveAs('output/plots_inputs/distrib_{0}.png'.format(c.GetTitle()))
 
-def make_histos_deltaR(infile, det, ptPairs):
-    """Fills histograms with distributions of deltaR vs pT slices.
+def make_histos_deltaR(sample, infiles, det, ptPairs):
+    """Fills histograms with distributions of deltaR vs pT slices of a sample
+    made of ntuples infiles.
 
-    Results are cached into file.
+    Results are cached per ntuple, see partials.aggregate().
     """
-    cache = {}
-
-    # load cache, if any
-    fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_inputs_{0}_deltaR_{1}.pkl'.format(fname, det)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            cache = pickle.load(f)
-
-    # return cached results if the cache exists for all pT slices
-    try:
-        return [cache[key] for key in ptPairs]
-    except KeyError:
-        pass
+    name = 'draw_inputs_{0}_deltaR_{1}'.format(sample, det)
+    return normalize(partials.aggregate(name, infiles, fill_histos_deltaR, ['tree_columns.py', select_det],
+                                        det=det, ptPairs=ptPairs))
 
-    tofill = {}
+def fill_histos_deltaR(infile, det, ptPairs):
+    """Fills histograms of make_histos_deltaR() with PFClusters of one ntuple.
 
-    # prepare empty histograms
-    for key in ptPairs:
-        if key not in cache:
-            tofill[key] = ROOT.TH1D('h', '', 200, 0, 0.1)
+    Returns (histograms, number of entries).
+    """
+    histos = [ROOT.TH1D('h', '', 200, 0, 0.1) for _ in ptPairs]
 
     # get TTree with PFClusters
     fi = ROOT.TFile(infile)
@@ -290,63 +331,34 @@ def make_histos_deltaR(infile, det, ptPairs):
     if not tree:
         raise Exception('TTree not found')
 
-    # fill histograms
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
-
-        # barrel vs endcaps
-        if det == 'EB':
-            if abs(tree.pfEta) > 1.479:  # NOTE: pfEta, not mcEta
-                continue
-        else:
-            if abs(tree.pfEta) < 1.479:  # NOTE: pfEta, not mcEta
-                continue
+    # fill histograms; NOTE: pfEta, not mcEta
+    t0 = time.time()
+    (mcPt, deltaR) = tree_columns.read(tree, ['mcPt', 'pfPhoDeltaR'], select_det(det))
 
-        for (pt1, pt2) in tofill:
-            if pt1 <= tree.mcPt < pt2:
-                tofill[(pt1, pt2)].Fill(tree.pfPhoDeltaR)
+    for ((pt1, pt2), h) in zip(ptPairs, histos):
+        tree_columns.fill(h, deltaR[(pt1 <= mcPt) & (mcPt < pt2)])
 
-    # normalization
-    for h in tofill.values():
-        h.Scale(1/tree.GetEntriesFast())
+    report_rate('{0} {1} deltaR'.format(infile, det), tree, t0)
 
-    # update cache
-    for (key, item) in tofill.items():
-        cache[key] = item
+    return (result_cache.from_root(histos), np.array([tree.GetEntriesFast()], dtype=float))
 
-    # save updated cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(cache, f)
+def make_histos_pfEToMcE(sample, infiles, det, dRPairs):
+    """Fills histograms with distributions of pfE/mcE vs deltaR slices of a
+    sample made of ntuples infiles.
 
-    return [cache[key] for key in ptPairs]
-
-def make_histos_pfEToMcE(infile, det, dRPairs):
-    """Fills histograms with distributions of pfE/mcE vs deltaR slices.
-
-    Results are cached into file.
+    Results are cached per ntuple, see partials.aggregate().
     """
-    cache = {}
-
-    # load cache, if any
-    fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_inputs_{0}_pfEToMcE_{1}.pkl'.format(fname, det)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            cache = pickle.load(f)
+    name = 'draw_inputs_{0}_pfEToMcE_{1}'.format(sample, det)
+    return normalize(partials.aggregate(name, infiles, fill_histos_pfEToMcE, ['tree_columns.py', select_det],
+                                        det=det, dRPairs=dRPairs))
 
-    # return cached results if the cache exists for all pT slices
-    try:
-        return [cache[key] for key in dRPairs]
-    except KeyError:
-        pass
+def fill_histos_pfEToMcE(infile, det, dRPairs):
+    """Fills histograms of make_histos_pfEToMcE() with PFClusters of one
+    ntuple.
 
-    tofill = {}
-
-    # prepare empty histograms
-    for key in dRPairs:
-        if key not in cache:
-            tofill[key] = ROOT.TH1D('h', '', 200, 0, 1.5)
+    Returns (histograms, number of entries).
+    """
+    histos = [ROOT.TH1D('h', '', 200, 0, 1.5) for _ in dRPairs]
 
     # get TTree with PFClusters
     fi = ROOT.TFile(infile)
@@ -354,52 +366,35 @@ def make_histos_pfEToMcE(infile, det, dRPairs):
     if not tree:
         raise Exception('TTree not found')
 
-    # fill histograms
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
-
-        # barrel vs endcaps
-        if det == 'EB':
-            if abs(tree.pfEta) > 1.479:  # NOTE: pfEta, not mcEta
-                continue
-        else:
-            if abs(tree.pfEta) < 1.479:  # NOTE: pfEta, not mcEta
-                continue
+    # fill histograms; NOTE: pfEta, not mcEta
+    t0 = time.time()
+    (deltaR, resol) = tree_columns.read(tree, ['pfPhoDeltaR', 'pfE/mcE'], select_det(det))
 
-        for (dR1, dR2) in tofill:
-            if dR1 <= tree.pfPhoDeltaR < dR2:
-                tofill[(dR1, dR2)].Fill(tree.pfE/tree.mcE)
+    for ((dR1, dR2), h) in zip(dRPairs, histos):
+        tree_columns.fill(h, resol[(dR1 <= deltaR) & (deltaR < dR2)])
 
-    # normalization
-    for h in tofill.values():
-        h.Scale(1/tree.GetEntriesFast())
+    report_rate('{0} {1} pfE/mcE'.format(infile, det), tree, t0)
 
-    # update cache
-    for (key, item) in tofill.items():
-        cache[key] = item
+    return (result_cache.from_root(histos), np.array([tree.GetEntriesFast()], dtype=float))
 
-    # save updated cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(cache, f)
+def make_histos_mc(sample, infiles):
+    """Fills histograms with distributions of parameters of generated photons
+    of a sample made of ntuples infiles.
 
-    return [cache[key] for key in dRPairs]
+    Results are cached per ntuple, see partials.aggregate().
+    """
+    name = 'draw_inputs_{0}_mc'.format(sample)
+    return normalize(partials.aggregate(name, infiles, fill_histos_mc, ['tree_columns.py']))
 
-def make_histos_mc(infile):
-    """Fills histograms with distributions of parameters of generated photons.
+def fill_histos_mc(infile):
+    """Fills histograms of make_histos_mc() with generated photons of one
+    ntuple.
 
-    Results are cached into file.
+    Returns (histograms, number of entries).
     """
-    # return cached results, if any
-    fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_inputs_{0}_mc.pkl'.format(fname)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
-
     hPtEB = ROOT.TH1D('h', '', 110, 0, 110)
     hPtEE = ROOT.TH1D('h', '', 110, 0, 110)
-    hEta  = ROOT.TH1D('h', '', 250, -3.2, -3.2)
+    hEta  = ROOT.TH1D('h', '', 250, -3.2, 3.2)
     hPhi  = ROOT.TH1D('h', '', 250, -3.4, 3.4)
     hPtZoomEB = ROOT.TH1D('h', '', 60, 0, 3)
     hPtZoomEE = ROOT.TH1D('h', '', 60, 0, 3)
@@ -411,32 +406,43 @@ def make_histos_mc(infile):
         raise Exception('TTree not found')
 
     # fill histograms
-    for ev in range(tree.GetEntriesFast()):
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
+    t0 = time.time()
+    (mcEta, mcPhi, mcPt) = tree_columns.read(tree, ['mcEta', 'mcPhi', 'mcPt'])
 
-        hEta.Fill(tree.mcEta)
-        hPhi.Fill(tree.mcPhi)
+    tree_columns.fill(hEta, mcEta)
+    tree_columns.fill(hPhi, mcPhi)
 
-        # barrel vs endcaps
-        if abs(tree.mcEta) < 1.479:
-            hPtEB.Fill(tree.mcPt)
-            hPtZoomEB.Fill(tree.mcPt)
-        else:
-            hPtEE.Fill(tree.mcPt)
-            hPtZoomEE.Fill(tree.mcPt)
+    # barrel vs endcaps
+    isEB = abs(mcEta) < 1.479
+    tree_columns.fill(hPtEB, mcPt[isEB])
+    tree_columns.fill(hPtZoomEB, mcPt[isEB])
+    tree_columns.fill(hPtEE, mcPt[~isEB])
+    tree_columns.fill(hPtZoomEE, mcPt[~isEB])
+
+    report_rate('{0} MC truth'.format(infile), tree, t0)
 
     result = (hPtEB, hPtEE, hEta, hPhi, hPtZoomEB, hPtZoomEE)
 
-    # normalization
-    for h in result:
-        h.Scale(1/tree.GetEntriesFast())
+    return (result_cache.from_root(result), np.array([tree.GetEntriesFast()], dtype=float))
+
+def select_det(det):
+    """Returns TTree selection of PFClusters in barrel (det = 'EB') or endcaps.
 
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
+    NOTE: written as negated vetoes, so that entries with NaN pfEta are taken
+    for both detectors, as they always were.
+    """
+    if det == 'EB':
+        return '!(abs(pfEta) > 1.479)'
+    else:
+        return '!(abs(pfEta) < 1.479)'
 
-    return result
+def report_rate(what, tree, t0):
+    """Prints number of entries of tree processed per second since time t0.
+    """
+    dt = max(time.time() - t0, 1e-6)
+    n = tree.GetEntriesFast()
+    print('{0}: {1} entries in {2:.1f} s ({3:.0f} entries/s)'.format(what, n, dt, n/dt),
+          file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -2,18 +2,23 @@
  * histograms.
  */
 
+#include <cmath>
 #include <vector>
+#include <algorithm>
 
 #include <TF1.h>
 #include <TH1D.h>
 #include <TFile.h>
 #include <TTree.h>
 #include <TMath.h>
+#include <TROOT.h>
 #include <TSystem.h>
-#include <TCanvas.h>
 #include <TString.h>
 #include <TGraphErrors.h>
 
+#include "fit_shape.h"
+#include "slice_fit.h"
+
 // prints a message and exits gracefully
 #define FATAL(msg) do { fprintf(stderr, "FATAL: %s\n", msg); gSystem->Exit(1); } while (0)
 
@@ -25,8 +30,11 @@ vector<float> gDataPfEta;    // pfEta
 vector<float> gDataResol;    // pfE/mcE * [MVA's mean]
 vector<float> gDataExpWidth; // [MVA's sigma]/[MVA's mean]
 
-TGraphErrors* grMeanVsMean = NULL;
-TGraphErrors* grSigmaVsSigma = NULL;
+// fit results of buckets, see fit_buckets()
+vector<TGraphErrors*> grMeanVsMean;
+vector<TGraphErrors*> grSigmaVsSigma;
+
+int gNumThreads = 1;  // number of threads for block fits, see set_num_threads()
 
 //______________________________________________________________________________
 void SetBranchAddress(TTree* tree, const char* bname, void* ptr)
@@ -101,228 +109,126 @@ void fill_arrays(const char* infile, const char* friendname, const char* mva_nam
 }
 
 //______________________________________________________________________________
-void MeanSigma(vector<float> &numbers, double &mean, double &sigma)
+void set_num_threads(int n)
 {
-   /* Evaluates average (mean) and dispersion (sigma) of numbers "numbers".
+   /* Sets number of threads to be used by fit_buckets().
     *
-    * Mean and sigma are recalculated iteratively several times. During each
-    * calculation, a region [mean - 3*sigma, mean + 3*sigma] is used, where
-    * "mean" and "sigma" are taken from a previous iteration.
+    * n < 1 = number of available CPU cores.
     */
 
-   // zero-order iteration
-   mean = 0;
-   sigma = 0;
-   for (size_t i = 0; i < numbers.size(); i++) {
-      mean += numbers[i];
-      sigma += numbers[i] * numbers[i];
-   }
-   mean /= numbers.size();
-   sigma = sqrt(sigma/numbers.size() - mean*mean);
-
-   // iterations
-   for (int c = 0; c < 1000; c++) {
-      double mean_prev = mean;
-      double sigma_prev = sigma;
-
-      double xmin = mean - 3*sigma;
-      double xmax = mean + 3*sigma;
-
-      // evaluate peak position and width
-      mean = 0;
-      sigma = 0;
-      int nent = 0;
-      for (size_t i = 0; i < numbers.size(); i++) {
-         if (numbers[i] < xmin || numbers[i] > xmax) continue;
-
-         mean += numbers[i];
-         sigma += numbers[i] * numbers[i];
-         nent++;
-      }
-      mean /= nent;
-      sigma = sqrt(sigma/nent - mean*mean);
-
-      // break when converged
-      if (fabs(mean - mean_prev) <= 1e-6 * fabs(mean) &&
-          fabs(sigma - sigma_prev) <= 1e-6 * fabs(sigma))
-         return;
-   }
-
-   const char* fmt = "nent_total=%lli, mean=%f, sigma=%f\n";
-   fprintf(stderr, fmt, numbers.size(), mean, sigma);
-   FATAL("mean and/or sigma did not converged");
+   gNumThreads = InitThreads(n);
 }
 
 //______________________________________________________________________________
-void fit_slices_real(vector<float>& x, vector<float>& y, int blockSize,
-                     const char* title, const char* xtitle)
+slice_fit_t fit_settings()
 {
-    /* Fits distributions of sorted blocks of data points, result is given in
-     * grMeanVsMean and grSigmaVsSigma.
-     *
-     * NOTE: sigma = width/position.
-     */
-
-   // cleanup from previous execution
-   if (grMeanVsMean) delete grMeanVsMean;
-   if (grSigmaVsSigma) delete grSigmaVsSigma;
-
-   grMeanVsMean = new TGraphErrors();
-   grSigmaVsSigma = new TGraphErrors();
-
-   size_t siz = x.size();
-   if (siz < 1) FATAL("x.size() < 1");
-
-   // sort by X axis
-   size_t* ind = new size_t[siz]; // allocate on the heap to avoid segfaults
-   TMath::Sort(siz, &x.front(), ind, false);
+   /* Returns settings of fits of blocks: Etrue/Erec in [0.65, 1.2] is fitted
+    * with Gaussian + left power-law tail + right exponential tail, first by
+    * chi2 to improve convergence, then by likelihood.
+    */
 
-   // NOTE: last block is excluded if it has less than 0.5 * blockSize entries
-   int nblocks = TMath::Nint(round(((float)siz)/blockSize));
+   slice_fit_t cfg;
 
-   TCanvas* c = NULL;
-   vector<TObject*> todel(64);
+   cfg.nbins = 200;
+   cfg.xmin = 0.65;
+   cfg.xmax = 1.2;
 
-   // loop over blocks of ordered data
-   for (int b = 0; b < nblocks; b++) {
-      vector<float> bx;
-      vector<float> by;
+   cfg.SetTails(1.5, 5, 1.5);
+   cfg.SetLimits(0, 0.33, 3);     // in units of the histogram maximum
+   cfg.SetLimits(1, 0.65, 1.2);
+   cfg.SetLimits(2, 0.33, 1.5);   // in units of sigma of Etrue/Erec
+   cfg.SetLimits(3, 0, 10);
+   cfg.SetLimits(4, 1.01, 100);
+   cfg.SetLimits(5, 0, 10);
 
-      // fill separate arrays with current block data
-      for (size_t i = b * blockSize; i < (size_t) (b + 1) * blockSize; i++) {
-         if (i >= siz) break;
-         bx.push_back(x[ind[i]]);
-         by.push_back(y[ind[i]]);
-      }
+   cfg.prefit = "QENG";
+   cfg.option = "QENLG";
 
-      double meanX, sigmaX;
-      double meanY, sigmaY;
-
-      // mean and sigma in the block and Etrue/Erec
-      MeanSigma(bx, meanX, sigmaX);
-      MeanSigma(by, meanY, sigmaY);
-
-      // fill histogram
-      TH1* h = new TH1D("h", "", 200, 0.65, 1.2);
-      for (size_t i = 0; i < by.size(); i++)
-         h->Fill(by[i]);
-
-      // create new canvas, if necessary
-      if (b % 9 == 0) {
-         if (c) {
-            c->SaveAs(Form("output/plots_mva_pars/fits/%s.png", c->GetTitle()));
-
-            // memory cleanup
-            delete c;
-            for (size_t k = 0; k < todel.size(); k++)
-               delete todel[k];
-            todel.clear();
-         }
-
-         TString cname = TString::Format("fits_%s_blk%03dto%03d", title, b + 1, b + 9);
-         c = new TCanvas(cname, cname, 1000, 700);
-
-         c->SetLeftMargin(0);
-         c->SetRightMargin(0);
-         c->SetTopMargin(0);
-         c->SetBottomMargin(0);
-         c->Divide(3, 3);
-      }
+   return cfg;
+}
 
-      c->cd(b % 9 + 1);
-      gPad->SetLeftMargin(0.12);
-      gPad->SetRightMargin(0.02);
-      gPad->SetTopMargin(0.08);
-      gPad->SetBottomMargin(0.08);
-
-      h->SetTitle(Form("%s = (%.4f #pm %.2g)%%", xtitle, meanX * 100, sigmaX * 100));
-      h->SetXTitle("E^{rec}/E^{gen}");
-      h->SetYTitle("Entries");
-      h->SetTitleOffset(1.6, "Y");
-
-      h->Sumw2(true);
-      h->SetLineColor(kBlack);
-      h->Draw();
-
-      // Gaussian + left power-law tail + right exponential tail
-      const char* expr = "[0] * ( (x-[1])/[2] > -[3] ? "
-         "( (x-[1])/[2] < [5] ? exp(-(x-[1])^2/(2*[2]*[2])) : exp(0.5*[5]*[5] - [5]*(x-[1])/[2]) ) : "
-         "([4]/[3])^[4] * exp(-0.5*[3]^2) * (-(x-[1])/[2]-[3]+[4]/[3])^(-[4]) )";
-
-      TF1* fit = new TF1("fit", expr, 0.65, 1.2);
-      fit->SetLineWidth(1);
-      fit->SetNpx(2000);
-
-      fit->SetParameters(h->GetMaximum(), meanY, sigmaY, 1.5, 5, 1.5);
-      fit->SetParLimits(0, 0.33 * h->GetMaximum(), 3 * h->GetMaximum());
-      fit->SetParLimits(1, 0.65, 1.2);
-      fit->SetParLimits(2, 0.33 * sigmaY, 1.5 * sigmaY);
-      fit->SetParLimits(3, 0, 10);
-      fit->SetParLimits(4, 1.01, 100);
-      fit->SetParLimits(5, 0, 10);
-
-      h->Fit(fit, "QEM", "same", 0.65, 1.2);  // improves convergence
-      h->Fit(fit, "QEML", "same", 0.65, 1.2);
-
-      grMeanVsMean->SetPoint(b, meanX, fit->GetParameter(1));
-      grMeanVsMean->SetPointError(b, sigmaX, fit->GetParError(1));
-
-      grSigmaVsSigma->SetPoint(b, meanX, fit->GetParameter(2)/fit->GetParameter(1));
-      grSigmaVsSigma->SetPointError(b, sigmaX, fit->GetParError(2)/fit->GetParameter(1));
-
-      todel.push_back(h);
-      todel.push_back(fit);
-   } // block loop
-
-   // save the very last canvas
-   if (c) {
-      c->SaveAs(Form("output/plots_mva_pars/fits/%s.png", c->GetTitle()));
-
-      // memory cleanup
-      delete c;
-      for (size_t k = 0; k < todel.size(); k++)
-         delete todel[k];
-   }
+//______________________________________________________________________________
+void draw_fits_file(const char* fname)
+{
+   /* Draws fitted distributions of blocks saved by fit_buckets() into fname,
+    * see DrawFitsFile(); positions and widths along X axis are in percent.
+    */
 
-   delete ind;
+   DrawFitsFile(fname, fit_settings(), "%s = (%.4f #pm %.2g)%%", 100);
 }
 
 //______________________________________________________________________________
-void fit_slices(int type, int blockSize, const char* title, const char* xtitle,
-                double pt1=0, double pt2=0)
+void fit_buckets(int blockSize, const char* fname, const char* mva_name,
+                 const double* ptEdges, int nedges)
 {
-   // Steers work of fit_slices_real().
+   /* Fits distributions of sorted blocks of test data points in buckets (EB
+    * or EE, mcPt range [ptEdges[r], ptEdges[r+1])), all of them from one
+    * pass over the global arrays (see fill_arrays()). Results of bucket k =
+    * det * (nedges - 1) + r (det = 0 for EB, 1 for EE) are given in
+    * grMeanVsMean[k] and grSigmaVsSigma[k].
+    *
+    * Blocks of all buckets are fitted by gNumThreads threads, see FitBuckets().
+    *
+    * NOTE: sigma = width/position.
+    */
 
-   // mcPt region, EB
-   if (type == 0) {
-      vector<float> x, y;
+   int npt = nedges - 1;
+   if (npt < 1) FATAL("nedges < 2");
 
-      for (size_t i = 0; i < gDataMcPt.size(); i++) {
-         if (fabs(gDataPfEta[i]) > 1.479) continue;
-         if (gDataMcPt[i] < pt1 || gDataMcPt[i] >= pt2) continue;
+   // partition test data points into buckets;
+   // NOTE: |pfEta| = 1.479 goes into both EB and EE
+   vector<vector<size_t> > buckets(2 * npt);
 
-         x.push_back(gDataExpWidth[i]);
-         y.push_back(gDataResol[i]);
-      }
+   for (size_t i = 0; i < gDataMcPt.size(); i++) {
+      int r = upper_bound(ptEdges, ptEdges + nedges, gDataMcPt[i]) - ptEdges - 1;
+      if (r < 0 || r >= npt) continue;
 
-      fit_slices_real(x, y, blockSize, title, xtitle);
+      if (!(fabs(gDataPfEta[i]) > 1.479)) buckets[r].push_back(i);
+      if (!(fabs(gDataPfEta[i]) < 1.479)) buckets[npt + r].push_back(i);
    }
 
-   // mcPt region, EE
-   else if (type == 1) {
-      vector<float> x, y;
+   for (size_t k = 0; k < buckets.size(); k++)
+      if (buckets[k].empty())
+         FATAL(Form("no data points in %s, %g <= mcPt < %g", k < (size_t) npt ? "EB" : "EE",
+                    ptEdges[k % npt], ptEdges[k % npt + 1]));
 
-      for (size_t i = 0; i < gDataMcPt.size(); i++) {
-         if (fabs(gDataPfEta[i]) < 1.479) continue;
-         if (gDataMcPt[i] < pt1 || gDataMcPt[i] >= pt2) continue;
+   vector<vector<slice_t> > results = FitBuckets(&gDataExpWidth.front(), &gDataResol.front(),
+                                                 buckets, blockSize, fit_settings(), gNumThreads);
 
-         x.push_back(gDataExpWidth[i]);
-         y.push_back(gDataResol[i]);
+   // cleanup from previous execution
+   for (size_t k = 0; k < grMeanVsMean.size(); k++) {
+      delete grMeanVsMean[k];
+      delete grSigmaVsSigma[k];
+   }
+
+   grMeanVsMean.clear();
+   grSigmaVsSigma.clear();
+
+   for (size_t k = 0; k < results.size(); k++) {
+      TGraphErrors* grMM = new TGraphErrors();
+      TGraphErrors* grSS = new TGraphErrors();
+
+      // collect results in block order
+      for (int b = 0; b < (int) results[k].size(); b++) {
+         const slice_t& res = results[k][b];
+
+         grMM->SetPoint(b, res.meanX, res.par[1]);
+         grMM->SetPointError(b, res.sigmaX, res.err[1]);
+
+         grSS->SetPoint(b, res.meanX, res.par[2]/res.par[1]);
+         grSS->SetPointError(b, res.sigmaX, res.err[2]/res.par[1]);
       }
 
-      fit_slices_real(x, y, blockSize, title, xtitle);
-   }
+      grMeanVsMean.push_back(grMM);
+      grSigmaVsSigma.push_back(grSS);
 
-   else
-      FATAL("invalid type");
+      // quality assurance; images are drawn only on request, see draw_fits_file()
+      const char* det = k < (size_t) npt ? "EB" : "EE";
+      double pt1 = ptEdges[k % npt];
+      double pt2 = ptEdges[k % npt + 1];
+
+      TString title = TString::Format("%s_%s_%s_pT%g-%g", fname, det, mva_name, pt1, pt2);
+      TString xtitle = TString::Format("%s, expected width", det);
+      SaveFits(results[k], Form("output/plots_mva_pars/fits/%s.root", title.Data()), xtitle);
+   }
 }
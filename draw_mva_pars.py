@@ -7,16 +7,31 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
 import fnmatch
+import argparse
+import multiprocessing
+import numpy as np
 import ROOT
 
+import result_cache
+import graph_math
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
 def main():
     """Steering function.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--threads', type=int, default=1,
+                        help='number of threads for fits of blocks (0 = number of CPU cores)')
+    parser.add_argument('--pt-edges', type=float, nargs='+', default=[0, 1, 10, 100],
+                        metavar='PT', help='edges of mcPt ranges in GeV (default: 0 1 10 100)')
+    parser.add_argument('--qa', metavar='PATTERN',
+                        help='draw fitted distributions of blocks for fits with titles matching '
+                             'the wildcard PATTERN (default: none)')
+    args = parser.parse_args()
+
     ROOT.gROOT.SetBatch(True)
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
@@ -25,6 +40,7 @@ def main():
     # CPU-intensive part is written in C++ (python is too slow)
     ROOT.gSystem.SetBuildDir('output', True);
     ROOT.gROOT.LoadMacro('draw_mva_pars.cc+')
+    ROOT.set_num_threads(args.threads)
 
     # ntuples to process
     infiles = fnmatch.filter(os.listdir('input'), '*.root')
@@ -41,80 +57,107 @@ def main():
         if not os.access(d, os.X_OK):
             os.mkdir(d)
 
+    # mcPt ranges [pt1, pt2)
+    ptRanges = list(zip(args.pt_edges[:-1], args.pt_edges[1:]))
+
+    # fill and fit distributions
+    graphs = {}
     for mva_name in mva_names:
-        r = [make_graphs(f, mva_name, blockSize=10000) for f in infiles]
+        graphs[mva_name] = [make_graphs(f, mva_name, 10000, args.pt_edges) for f in infiles]
+
+    # draw fits of blocks in background while results are being drawn
+    # NOTE: fits were saved by fit_buckets() when the results were computed, so
+    # this works for cached results as well
+    qa = None
+    if args.qa:
+        qa = multiprocessing.Process(target=draw_qa, args=(args.qa,))
+        qa.start()
+
+    for mva_name in mva_names:
+        r = graphs[mva_name]
 
         # repack graphs into per-type tuples
         r = list(zip(*r))
 
-        # pT ranges [0, 1), [1, 10) and [10, 100) GeV
-        for (i, (pt1, pt2)) in enumerate([(0, 1), (1, 10), (10, 100)]):
+        for (i, (pt1, pt2)) in enumerate(ptRanges):
             mva = mva_name[mva_name.rfind('gun_') + 4:]
-            title = 'Trained on {0}, sliced in {1} < p_{{T}} < {2} GeV/c'.format(mva, pt1, pt2)
+            title = 'Trained on {0}, sliced in {1:g} < p_{{T}} < {2:g} GeV/c'.format(mva, pt1, pt2)
 
             # position, EB
-            cname = 'position_EB_{0}_pT{1}-{2}'.format(mva_name, pt1, pt2)
+            cname = 'position_EB_{0}_pT{1:g}-{2:g}'.format(mva_name, pt1, pt2)
             combine([x[i] for x in r[0]], txts, cname, title, 'Width (expected)', 'Position (real)')
 
             # position, EE
-            cname = 'position_EE_{0}_pT{1}-{2}'.format(mva, pt1, pt2)
+            cname = 'position_EE_{0}_pT{1:g}-{2:g}'.format(mva, pt1, pt2)
             combine([x[i] for x in r[2]], txts, cname, title, 'Width (expected)', 'Position (real)')
 
             # width, EB
-            cname = 'width_EB_{0}_pT{1}-{2}'.format(mva, pt1, pt2)
+            cname = 'width_EB_{0}_pT{1:g}-{2:g}'.format(mva, pt1, pt2)
             combine([x[i] for x in r[1]], txts, cname, title, 'Width (expected)', 'Sigma/Mean (real)')
 
             # width, EE
-            cname = 'width_EE_{0}_pT{1}-{2}'.format(mva, pt1, pt2)
+            cname = 'width_EE_{0}_pT{1:g}-{2:g}'.format(mva, pt1, pt2)
             combine([x[i] for x in r[3]], txts, cname, title, 'Width (expected)', 'Sigma/Mean (real)')
 
-def make_graphs(infile, mva_name, blockSize):
-    """Fills, fits and visualizes distributions of Etrue/Erec.
+    if qa:
+        qa.join()
+
+def make_graphs(infile, mva_name, blockSize, ptEdges):
+    """Fills, fits and visualizes distributions of Etrue/Erec in EB and EE
+    for mcPt ranges between consecutive ptEdges.
 
     Results are cached into file.
     """
     # return cached results, if any
     fname = os.path.basename(infile).replace('.root', '')
-    fmt = 'output/cache/draw_mva_pars_{0}_{1}_{2}.pkl'
-    cachefile = fmt.format(fname, mva_name, blockSize)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
+    friend = 'output/friend_{0}.root'.format(fname)
+    name = 'draw_mva_pars_{0}_{1}_{2}'.format(fname, mva_name, blockSize)
+    cachefile = result_cache.key(name, [infile, friend],
+                                 [make_graphs, 'draw_mva_pars.cc', 'fit_shape.h',
+                                  'slice_fit.h'], ptEdges=list(ptEdges))
+    result = result_cache.load(cachefile)
+    if result is not None:
+        return result
 
     # fill necessary arrays of points in C++
-    friend = 'output/friend_{0}.root'.format(fname)
     ROOT.fill_arrays(infile, friend, mva_name)
 
-    grMM_EB = []
-    grSS_EB = []
-    grMM_EE = []
-    grSS_EE = []
-
-    # pT ranges [0, 1), [1, 10) and [10, 100) GeV
-    for (pt1, pt2) in [(0, 1), (1, 10), (10, 100)]:
-        # EB
-        title = '{0}_EB_{1}_pT{2}-{3}'.format(fname, mva_name, pt1, pt2)
-        ROOT.fit_slices(0, blockSize, title, 'EB, expected width', pt1, pt2)
-        grMM_EB.append(ROOT.grMeanVsMean.Clone())
-        grSS_EB.append(ROOT.grSigmaVsSigma.Clone())
-
-        # EE
-        title = '{0}_EE_{1}_pT{2}-{3}'.format(fname, mva_name, pt1, pt2)
-        ROOT.fit_slices(1, blockSize, title, 'EE, expected width', pt1, pt2)
-        grMM_EE.append(ROOT.grMeanVsMean.Clone())
-        grSS_EE.append(ROOT.grSigmaVsSigma.Clone())
+    # fit all (EB/EE, pT range) buckets at once
+    edges = np.array(ptEdges, dtype=np.float64)
+    ROOT.fit_buckets(blockSize, fname, mva_name, edges, len(edges))
+
+    n = len(edges) - 1
+    grMM_EB = [ROOT.grMeanVsMean[k] for k in range(n)]
+    grSS_EB = [ROOT.grSigmaVsSigma[k] for k in range(n)]
+    grMM_EE = [ROOT.grMeanVsMean[n + k] for k in range(n)]
+    grSS_EE = [ROOT.grSigmaVsSigma[n + k] for k in range(n)]
 
     result = (grMM_EB, grSS_EB, grMM_EE, grSS_EE)
 
     # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
+    result = result_cache.from_root(result)
+    result_cache.save(cachefile, result)
 
     return result
 
+def draw_qa(pattern):
+    """Draws fitted distributions of blocks saved by fit_buckets() for fits with
+    titles matching the wildcard pattern.
+    """
+    fitsdir = 'output/plots_mva_pars/fits'
+    fnames = sorted(fnmatch.filter(os.listdir(fitsdir), pattern + '.root'))
+    if not fnames:
+        print('No saved fits match {0}'.format(pattern))
+
+    for f in fnames:
+        ROOT.draw_fits_file(os.path.join(fitsdir, f))
+
 def combine(grs, txts, cname, title, xtitle, ytitle, xmax=-1, ymax=-1):
     """Visualization of several graphs on single canvas.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -126,12 +169,11 @@ def combine(grs, txts, cname, title, xtitle, ytitle, xmax=-1, ymax=-1):
     c.SetGridy()
 
     # draw dummy histogram
-    xmin = min(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (xmin, xmaxAll, ymin, ymaxAll) = graph_math.bounds(grs)
     if xmax < 0:
-        xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
+        xmax = xmaxAll
     if ymax < 0:
-        ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+        ymax = ymaxAll
 
     frame = c.DrawFrame(0, 0, xmax, ymax * 1.1)
     frame.SetTitle(title)
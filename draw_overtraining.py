@@ -7,10 +7,11 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
-import fnmatch
 import ROOT
 
+import partials
+import result_cache
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
@@ -20,12 +21,9 @@ def main():
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
 
-    # ntuples to process
-    infiles = fnmatch.filter(os.listdir('input'), '*.root')
-    infiles = sorted('input/' + f for f in infiles)
-
-    # names of ntuples
-    fnames = [f[f.rfind('/') + 1:].replace('.root', '') for f in infiles]
+    # ntuples to process: input/<sample>.root only, MVAs and their friends are
+    # made per ntuple
+    samples = partials.find_samples('input', batches=False)
 
     # make output directories
     for d in ['output', 'output/cache', 'output/plots']:
@@ -33,10 +31,10 @@ def main():
             os.mkdir(d)
 
     for det in ['EB', 'EE']:
-        for (infile, fname) in zip(infiles, fnames):
-            r = make_histos(infile, det)
+        for (sample, infiles) in samples:
+            r = make_histos(sample, infiles, det)
 
-            cname = 'overtraining_{0}_{1}'.format(fname, det)
+            cname = 'overtraining_{0}_{1}'.format(sample, det)
             combine(r, cname, det)
 
     # save all open canvases as images
@@ -45,18 +43,29 @@ def main():
         c = canvases.At(i)
         c.SaveAs('output/plots/{0}.png'.format(c.GetTitle()))
 
-def make_histos(infile, det):
-    """Fills energy resolution histograms for train and test trees.
+def make_histos(sample, infiles, det):
+    """Fills energy resolution histograms for train and test trees of a
+    sample made of ntuple infiles = [input/<sample>.root].
+
+    Results are cached per ntuple and its friend, see partials.aggregate().
+    """
+    name = 'draw_overtraining_{0}_{1}'.format(sample, det)
+    (hTrain, hTest, hOrig) = partials.aggregate(name, infiles, fill_histos, inputs=friend_of,
+                                                det=det, mva=sample)
+
+    # normalization
+    return (hTrain, hTest, partials.scale(hOrig, 0.5))
 
-    Results are cached into file.
+def friend_of(infile):
+    """Returns ntuple infile and its friend with outputs from MVAs.
     """
-    # return cached results, if any
     fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_overtraining_{0}_{1}.pkl'.format(fname, det)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
+    return [infile, 'output/friend_{0}.root'.format(fname)]
 
+def fill_histos(infile, det, mva):
+    """Fills histograms of make_histos() with PFClusters of one ntuple,
+    corrected by the MVA of sample mva.
+    """
     hTrain = ROOT.TH1D('h', '', 500, 0., 1.2)
     hTest  = ROOT.TH1D('h', '', 500, 0., 1.2)
     hOrig  = ROOT.TH1D('h', '', 500, 0., 1.2)
@@ -68,7 +77,7 @@ def make_histos(infile, det):
         raise Exception('TTree not found')
 
     # add branches with outputs from MVAs
-    tree.AddFriend('ntuplizer/PFClusterTree', 'output/friend_{0}.root'.format(fname))
+    tree.AddFriend('ntuplizer/PFClusterTree', friend_of(infile)[1])
 
     # fill histograms
     for ev in range(tree.GetEntriesFast()):
@@ -87,7 +96,7 @@ def make_histos(infile, det):
             #continue
 
         orig = tree.pfE/tree.mcE
-        corr = getattr(tree, 'mva_mean_' + fname)
+        corr = getattr(tree, 'mva_mean_' + mva)
 
         if ev % 2 == 0:
             hTrain.Fill(corr * orig)
@@ -96,20 +105,14 @@ def make_histos(infile, det):
 
         hOrig.Fill(orig)
 
-    # normalization
-    hOrig.Scale(0.5)
-
-    result = (hTrain, hTest, hOrig)
-
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
-
-    return result
+    return result_cache.from_root((hTrain, hTest, hOrig))
 
 def combine(histos, cname, det):
     """Visualization of train/test/original distributions on single canvas.
     """
+    # ROOT objects from cached arrays
+    histos = [result_cache.to_root(h) for h in histos]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -7,16 +7,87 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
 import fnmatch
+import argparse
+import multiprocessing
+import numpy as np
 import ROOT
 
+import result_cache
+import graph_math
+import resolution_maps
+
 # for keeping drawed ROOT objects in memory
 saves = []
 
+# output directory of plots, see --preview
+plotsdir = 'output/plots_results'
+
+# per-block diagnostics of fits, see block_table(); strategy: 0 = default fit,
+# 1 = alternative starting values, 2 = unbinned likelihood, 3 = preview
+DIAGNOSTICS = [('slicing', 'i4'), ('block', 'i4'), ('first', 'i8'), ('last', 'i8'),
+               ('meanX', 'f8'), ('sigmaX', 'f8'), ('accepted', '?'), ('strategy', 'i4'),
+               ('status', 'i4'), ('edm', 'f8'), ('ncalls', 'i4'), ('time', 'f8'), ('warm', '?'),
+               ('par', 'f8', (6,)), ('err', 'f8', (6,)), ('boot', 'f8', (2,))]
+
 def main():
     """Steering function.
     """
+    global plotsdir
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--threads', type=int, default=1,
+                        help='number of threads for fits of blocks (0 = number of CPU cores)')
+    parser.add_argument('--qa', metavar='PATTERN',
+                        help='draw fitted distributions of blocks for fits with titles matching '
+                             'the wildcard PATTERN (default: none)')
+    parser.add_argument('--warm-start', type=int, default=0, metavar='N',
+                        help='start fits of blocks from results of previous blocks, in chains of N blocks')
+    parser.add_argument('--stream', type=float, default=0, metavar='MB',
+                        help='stream ntuples from disk instead of loading them into memory, keeping at most '
+                             'MB megabytes of block data in memory (for samples larger than memory)')
+    parser.add_argument('--adaptive', type=float, default=0, metavar='PRECISION',
+                        help='grow or shrink blocks until relative errors of fitted mean and sigma reach '
+                             'PRECISION, e.g. 0.02 (default: blocks of fixed size)')
+    parser.add_argument('--preview', type=float, default=0, metavar='FRACTION',
+                        help='quick preview: use a random FRACTION of test entries, e.g. 0.05, and robust '
+                             'estimators instead of fits; plots go to output/plots_results_preview')
+    parser.add_argument('--estimator', choices=['truncated', 'effective'], default='truncated',
+                        help='estimator of the preview mode: iterative truncated mean and sigma, or median '
+                             'and effective sigma (half-width of the narrowest 68.3%% interval)')
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help='errors of mean and sigma from N bootstrap replicas of truncated mean and sigma '
+                             'per block, e.g. 200 (default: errors of fits)')
+    parser.add_argument('--map', action='append', default=[], metavar='VARS',
+                        help='draw maps of resolution in cells of equal population in two or three '
+                             'comma-separated variables, e.g. mcE,mcEta or mcPt,nVtx,mcEta (repeatable; '
+                             'variables: {0})'.format(', '.join(sorted(resolution_maps.MAP_VARS))))
+    parser.add_argument('--map-layers', type=int, default=4, metavar='N',
+                        help='number of layers along the third variable of maps')
+    parser.add_argument('--retry', action='store_true',
+                        help='refit blocks of cached results which failed the quality cut with alternative '
+                             'strategies and patch them into the cache')
+    parser.add_argument('--slow', type=float, default=0, metavar='SECONDS',
+                        help='with --retry, refit also blocks whose fits took longer than SECONDS')
+    args = parser.parse_args()
+
+    if args.adaptive > 0 and args.stream > 0:
+        parser.error('--adaptive cannot be combined with --stream')
+    if args.preview > 0 and args.stream > 0:
+        parser.error('--preview cannot be combined with --stream')
+    if args.preview > 1:
+        parser.error('--preview takes a fraction of entries, at most 1')
+    if args.retry and (args.stream > 0 or args.preview > 0):
+        parser.error('--retry cannot be combined with --stream or --preview')
+
+    maps = [tuple(m.split(',')) for m in args.map]
+    for mapvars in maps:
+        if len(mapvars) not in (2, 3) or not set(mapvars) <= set(resolution_maps.MAP_VARS):
+            parser.error('--map takes two or three of: {0}'.format(
+                ', '.join(sorted(resolution_maps.MAP_VARS))))
+    if maps and args.stream > 0:
+        parser.error('--map cannot be combined with --stream')
+
     ROOT.gROOT.SetBatch(True)
     ROOT.gStyle.SetOptStat(0)
     ROOT.TH1.AddDirectory(False)
@@ -25,6 +96,23 @@ def main():
     # CPU-intensive part is written in C++ (python is too slow)
     ROOT.gSystem.SetBuildDir('output', True);
     ROOT.gROOT.LoadMacro('draw_results_helper.cc+')
+    ROOT.set_num_threads(args.threads)
+    ROOT.set_warm_start(args.warm_start)
+    ROOT.set_streaming(args.stream)
+    ROOT.set_adaptive(args.adaptive)
+    ROOT.set_bootstrap(args.bootstrap)
+
+    # preview mode: separate output directory, same number of blocks per
+    # slicing as in the full mode
+    blockSize = 3000
+    label = ''
+    if args.preview > 0:
+        ROOT.set_preview(args.preview, ROOT.kEffective if args.estimator == 'effective' else ROOT.kTruncated)
+        plotsdir = 'output/plots_results_preview'
+        blockSize = max(100, int(round(blockSize * args.preview)))
+        label = ' (preview, {0:g}% of entries)'.format(100 * args.preview)
+
+    ROOT.set_plots_dir(plotsdir)
 
     # ntuples to process
     ntuples = fnmatch.filter(os.listdir('input'), '*.root')
@@ -38,22 +126,62 @@ def main():
     txts = [t + ', no correction' for t in txts] + txts[:]
 
     # make output directories
-    for d in ['output', 'output/cache', 'output/plots_results', 'output/plots_results/fits']:
+    for d in ['output', 'output/cache', plotsdir, os.path.join(plotsdir, 'fits')]:
         if not os.access(d, os.X_OK):
             os.mkdir(d)
 
     eregions = [(0, 1), (1, 2), (2, 10), (10, 20), (20, 100), (100, 1000)]
 
+    # energy regions for slicing in mcEta and nVtx;
+    # NOTE: entries are bucketed by them once per fill_arrays() call
+    ROOT.set_eregions(std_vector('double', [e1 for (e1, e2) in eregions]),
+                      std_vector('double', [e2 for (e1, e2) in eregions]))
+
+    # branches with corrections ('' = no correction)
+    branches = [''] + ['mva_mean_' + mva for mva in mvas]
+
+    # fill and fit distributions;
+    # NOTE: loop over ntuples is the outer one, so that every ntuple is read
+    # only once, see load_ntuple() in draw_results_helper.cc; all corrections
+    # are fitted at once
+    graphs = {}
+    for f in ntuples:
+        for det in ['EB', 'EE']:
+            results = make_graphs(f, det, branches, eregions, blockSize, args.slow if args.retry else None)
+            for (branch, result) in zip(branches, results):
+                graphs[(f, det, branch)] = result
+
+    # resolution maps in cells of equal population, see resolution_maps.py
+    for mapvars in maps:
+        for f in ntuples:
+            fname = os.path.basename(f).replace('.root', '')
+            for det in ['EB', 'EE']:
+                tables = resolution_maps.make_maps(f, det, branches, mapvars, blockSize,
+                                                   args.map_layers)
+                for (branch, table) in zip(branches, tables):
+                    name = '{0}_{1}_{2}_{3}'.format('-'.join(mapvars), fname, det, branch or 'nocorr')
+                    cap = '{0}, {1}, {2}'.format(fname[fname.rfind('gun_') + 4:], det,
+                                                 branch.replace('mva_mean_', '') or 'no correction')
+                    resolution_maps.draw_map(table, mapvars, name, cap + label, plotsdir)
+
+    # draw fits of blocks in background while results are being drawn
+    # NOTE: fits were saved by fit_slices() when the results were computed, so
+    # this works for cached results as well
+    qa = None
+    if args.qa:
+        qa = multiprocessing.Process(target=draw_qa, args=(args.qa, os.path.join(plotsdir, 'fits')))
+        qa.start()
+
     for det in ['EB', 'EE']:
         for mva in mvas:
-            r  = [make_graphs(f, det, '',                eregions, blockSize=3000) for f in ntuples]
-            r += [make_graphs(f, det, 'mva_mean_' + mva, eregions, blockSize=3000) for f in ntuples]
+            r  = [graphs[(f, det, '')]               for f in ntuples]
+            r += [graphs[(f, det, 'mva_mean_' + mva)] for f in ntuples]
 
             # repack graphs into per-parameter tuples
             r = list(zip(*r))
 
             # text in captions
-            cap = 'trained on {0}, {1}'.format(mva[mva.rfind('gun_') + 4:], det)
+            cap = 'trained on {0}, {1}'.format(mva[mva.rfind('gun_') + 4:], det) + label
 
             # mean vs E
             title = 'mean_vs_e_{0}_{1}'.format(mva, det)
@@ -90,7 +218,7 @@ def main():
                 except:
                     print('Plot excluded: {0}'.format(title))
 
-                cap = 'trained on {0}, {1} < E^{{gen}} < {2} GeV/c'.format(mva[mva.rfind('gun_') + 4:], e1, e2)
+                cap = 'trained on {0}, {1} < E^{{gen}} < {2} GeV/c'.format(mva[mva.rfind('gun_') + 4:], e1, e2) + label
 
                 # mean and sigma vs eta
                 if det == 'EB': # not necessary to repeat for EE
@@ -101,65 +229,273 @@ def main():
                     title = 'sigma_vs_eta_{0}_E{1}-{2}'.format(mva, e1, e2)
                     combineR([x[i] for x in r[5]], txts, title, cap, '#eta^{gen}', '#sigma_{E^{rec}/E^{gen}}/mean')
 
-def make_graphs(infile, det, mva_branch, eregions, blockSize):
-    """Fills, fits and visualizes distributions of Etrue/Erec.
+    if qa:
+        qa.join()
+
+def make_graphs(infile, det, branches, eregions, blockSize, retry=None):
+    """Fills, fits and visualizes distributions of Etrue/Erec for corrections
+    from branches ('' = no correction), returns list of results.
 
-    Results are cached into file.
+    Results are cached into files, one per correction; corrections which are
+    not cached are fitted together by fit_graphs(). Unless retry is None,
+    failed or slow blocks of cached results are refitted, see retry_graphs().
+
+    Diagnostics of blocks are written next to the plots, see write_diagnostics().
     """
-    # return cached results, if any
+    # return cached results, if any; NOTE: keyed by the whole script, since
+    # results are shaped by several helpers and constants of it (get_slicings(),
+    # repack(), block_table(), DIAGNOSTICS, ...)
+    # NOTE: warm-started fits and the out-of-core mode give slightly different
+    # results, adaptive blocks and the preview mode give different ones
     fname = os.path.basename(infile).replace('.root', '')
-    fmt = 'output/cache/draw_results_{0}_{1}_{2}_{3}.pkl'
-    cachefile = fmt.format(fname, det, mva_branch, blockSize)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            return pickle.load(f)
-
-    # fill necessary arrays of points in C++
     friend = 'output/friend_{0}.root'.format(fname)
-    ROOT.fill_arrays(infile, friend, mva_branch, True if det == 'EE' else False)
-
-    # resolution vs mcE
-    title = 'mcE_{0}_{1}_{2}'.format(fname, det, mva_branch)
-    ROOT.fit_slices(0, blockSize, title, 'E^{gen}')
-    grMeanE = ROOT.grMean.Clone()
-    grSigmaE = ROOT.grSigma.Clone()
-
-    # resolution vs mcPt
-    title = 'mcPt_{0}_{1}_{2}'.format(fname, det, mva_branch)
-    ROOT.fit_slices(1, blockSize, title, 'p_{T}^{gen}')
-    grMeanPt = ROOT.grMean.Clone()
-    grSigmaPt = ROOT.grSigma.Clone()
-
-    # resolution vs mcEta in energy ranges
-    grMeanEta = []
-    grSigmaEta = []
-    for (e1, e2) in eregions:
-        title = 'mcEta_{0}_{1}_{2}_E{3}-{4}'.format(fname, det, mva_branch, e1, e2)
-        ROOT.fit_slices(2, blockSize, title, '#eta^{gen}', e1, e2)
-        grMeanEta.append(ROOT.grMean.Clone())
-        grSigmaEta.append(ROOT.grSigma.Clone())
-
-    # resolution vs nVtx in energy ranges
-    grMeanVtx = []
-    grSigmaVtx = []
-    for (e1, e2) in eregions:
-        title = 'nVtx_{0}_{1}_{2}_E{3}-{4}'.format(fname, det, mva_branch, e1, e2)
-        ROOT.fit_slices(3, blockSize, title, 'nVtx', e1, e2)
-        grMeanVtx.append(ROOT.grMean.Clone())
-        grSigmaVtx.append(ROOT.grSigma.Clone())
-
-    result = (grMeanE, grSigmaE, grMeanPt, grSigmaPt, grMeanEta, grSigmaEta,
-              grMeanVtx, grSigmaVtx)
-
-    # save cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(result, f)
-
-    return result
+
+    cachefiles = []
+    for branch in branches:
+        name = 'draw_results_{0}_{1}_{2}_{3}'.format(fname, det, branch, blockSize)
+        cachefiles.append(result_cache.key(name, [infile, friend],
+                                           ['draw_results.py', 'draw_results_helper.cc',
+                                            'fit_shape.h', 'quantile_sketch.h', 'slice_fit.h'],
+                                           eregions=eregions, warmStart=max(1, ROOT.gWarmStart),
+                                           stream=ROOT.gStreamMemory > 0, adaptive=ROOT.gAdaptive,
+                                           preview=(ROOT.gPreview, ROOT.gPreviewEstimator),
+                                           bootstrap=ROOT.gBootstrap))
+
+    results = [result_cache.load(f) for f in cachefiles]
+    todo = [c for (c, result) in enumerate(results) if result is None]
+
+    # refit failed or slow blocks of cached results and patch the cache
+    if retry is not None:
+        redo = [c for (c, result) in enumerate(results)
+                if result is not None and retry_mask(result[8], retry).any()]
+        if redo:
+            patched = retry_graphs(infile, friend, det, [branches[c] for c in redo],
+                                   [results[c] for c in redo], eregions, retry)
+            for (c, result) in zip(redo, patched):
+                results[c] = result
+                result_cache.save(cachefiles[c], result)
+
+    # NOTE: the out-of-core mode takes one correction at a time
+    if ROOT.gStreamMemory > 0:
+        groups = [[c] for c in todo]
+    else:
+        groups = [todo] if todo else []
+
+    for group in groups:
+        fitted = fit_graphs(infile, friend, det, [branches[c] for c in group], eregions, blockSize)
+
+        # save cache
+        for (c, result) in zip(group, fitted):
+            results[c] = result_cache.from_root(result)
+            result_cache.save(cachefiles[c], results[c])
+
+    titles = [prefix + region_suffix(eregions, i) for (_, prefix, _, i) in get_slicings(eregions)]
+    for (branch, result) in zip(branches, results):
+        path = os.path.join(plotsdir, 'diagnostics_{0}_{1}_{2}.txt'.format(fname, det, branch))
+        write_diagnostics(path, result[8], titles)
+
+    return results
+
+def fit_graphs(infile, friend, det, branches, eregions, blockSize):
+    """Fills and fits distributions of Etrue/Erec for all corrections from
+    branches at once, returns list of results (tuples of graphs and
+    diagnostics of blocks, see repack()).
+
+    NOTE: entries are sorted and split into blocks once for all corrections,
+    see fill_arrays() in draw_results_helper.cc.
+    """
+    fname = os.path.basename(infile).replace('.root', '')
+
+    # fill necessary arrays of points in C++;
+    # NOTE: the ntuple is read from disk only once for all detectors/branches,
+    # unless in the out-of-core mode (see set_streaming())
+    ROOT.fill_arrays(infile, friend, std_vector('string', branches), True if det == 'EE' else False)
+
+    # resolution vs X axis for all corrections;
+    # means[k][c], sigmas[k][c] = graphs of slicing k and correction c,
+    # tables[c][k] = diagnostics of blocks of correction c in slicing k
+    means = []
+    sigmas = []
+    tables = [[] for b in branches]
+    for (k, (typ, prefix, xtitle, i)) in enumerate(get_slicings(eregions)):
+        titles = [fit_title(prefix, fname, det, b, eregions, i) for b in branches]
+
+        ROOT.fit_slices(typ, blockSize, std_vector('string', titles), xtitle, i)
+        means.append([gr.Clone() for gr in ROOT.grMeans])
+        sigmas.append([gr.Clone() for gr in ROOT.grSigmas])
+
+        for c in range(len(branches)):
+            tables[c].append(block_table(ROOT.gBlocks[c], k))
+
+    results = []
+    for c in range(len(branches)):
+        results.append(repack([gr[c] for gr in means], [gr[c] for gr in sigmas],
+                              np.concatenate(tables[c]), len(eregions)))
+
+    return results
+
+def retry_graphs(infile, friend, det, branches, results, eregions, retry):
+    """Refits failed or slow blocks (see retry_mask()) of cached results of
+    corrections from branches with alternative strategies, see refit_blocks()
+    in draw_results_helper.cc; returns patched results.
+
+    A refit replaces a block if it passes the quality cut and either the block
+    did not or the refit has converged. Graphs of patched slicings are rebuilt
+    from the diagnostics, see table_graphs().
+    """
+    fname = os.path.basename(infile).replace('.root', '')
+
+    # NOTE: blocks are given by positions of data points sorted by X axis,
+    # which do not depend on the set of corrections
+    ROOT.fill_arrays(infile, friend, std_vector('string', branches), True if det == 'EE' else False)
+
+    patched = []
+    for (c, (branch, result)) in enumerate(zip(branches, results)):
+        (means, sigmas, table) = unpack(result)
+        table = table.copy()
+
+        for (k, (typ, prefix, xtitle, i)) in enumerate(get_slicings(eregions)):
+            rows = np.flatnonzero((table['slicing'] == k) & retry_mask(table, retry))
+            if len(rows) == 0:
+                continue
+
+            ROOT.refit_blocks(typ, i, c, std_vector('Long64_t', [int(x) for x in table['first'][rows]]),
+                              std_vector('Long64_t', [int(x) for x in table['last'][rows]]),
+                              fit_title(prefix, fname, det, branch, eregions, i))
+
+            refits = block_table(ROOT.gRefits, k)
+            refits['block'] = table['block'][rows]
+
+            better = refits['accepted'] & (~table['accepted'][rows] | (refits['status'] == 0))
+            table[rows[better]] = refits[better]
+
+            (means[k], sigmas[k]) = table_graphs(table[table['slicing'] == k])
+
+        patched.append(repack(means, sigmas, table, len(eregions)))
+
+    return patched
+
+def get_slicings(eregions):
+    """Returns slicings of fit_graphs(): list of (type, title prefix, X axis
+    title, index of energy region), see fit_slices() in draw_results_helper.cc.
+    """
+    slicings  = [(0, 'mcE', 'E^{gen}', -1), (1, 'mcPt', 'p_{T}^{gen}', -1)]
+    slicings += [(2, 'mcEta', '#eta^{gen}', i) for i in range(len(eregions))]
+    slicings += [(3, 'nVtx', 'nVtx', i) for i in range(len(eregions))]
+    return slicings
+
+def fit_title(prefix, fname, det, branch, eregions, i):
+    """Returns title of fits of a slicing, see get_slicings().
+    """
+    return '{0}_{1}_{2}_{3}{4}'.format(prefix, fname, det, branch, region_suffix(eregions, i))
+
+def region_suffix(eregions, i):
+    """Returns suffix of titles for energy region i, '' for i < 0.
+    """
+    return '_E{0}-{1}'.format(*eregions[i]) if i >= 0 else ''
+
+def repack(means, sigmas, table, n):
+    """Returns result of one correction from graphs of slicings means[k],
+    sigmas[k] (see get_slicings()) and diagnostics table of blocks, n = number
+    of energy regions.
+
+    NOTE: slicings in mcEta and nVtx are lists over energy regions.
+    """
+    return (means[0], sigmas[0], means[1], sigmas[1],
+            list(means[2:2 + n]), list(sigmas[2:2 + n]),
+            list(means[2 + n:]), list(sigmas[2 + n:]), table)
+
+def unpack(result):
+    """Inverse of repack(): returns (means, sigmas, table).
+    """
+    means = [result[0], result[2]] + list(result[4]) + list(result[6])
+    sigmas = [result[1], result[3]] + list(result[5]) + list(result[7])
+    return (means, sigmas, result[8])
+
+def block_table(blocks, k):
+    """Returns diagnostics of fitted blocks (std::vector<block_t>) of
+    slicing k, see DIAGNOSTICS.
+    """
+    table = np.zeros(len(blocks), dtype=DIAGNOSTICS)
+
+    for (b, res) in enumerate(blocks):
+        table[b] = (k, b, res.first, res.last, res.meanX, res.sigmaX, res.accepted, res.strategy,
+                    res.status, res.edm, res.ncalls, res.time, res.warm,
+                    [res.par[i] for i in range(6)], [res.err[i] for i in range(6)],
+                    [res.boot[0], res.boot[1]])
+
+    return table
+
+def table_graphs(table):
+    """Returns (means, sigmas) graphs of accepted blocks in a diagnostics
+    table of one slicing, as collect_blocks() in draw_results_helper.cc does:
+    bootstrap errors are taken, if evaluated.
+    """
+    t = table[table['accepted']]
+    t = t[np.argsort(t['block'], kind='mergesort')]
+    (x, ex, par, err, boot) = (t['meanX'], t['sigmaX'], t['par'], t['err'], t['boot'])
+
+    errMean = np.where(boot[:, 0] > 0, boot[:, 0], err[:, 1])
+    errSigma = np.where(boot[:, 1] > 0, boot[:, 1], err[:, 2]/par[:, 1])
+
+    means = result_cache.Graph(x.copy(), par[:, 1].copy(), ex.copy(), errMean)
+    sigmas = result_cache.Graph(x.copy(), par[:, 2]/par[:, 1], ex.copy(), errSigma)
+    return (means, sigmas)
+
+def retry_mask(table, retry):
+    """Returns mask of blocks in a diagnostics table to be refitted: blocks
+    which failed the quality cut, and blocks whose fits took longer than retry
+    seconds, if retry > 0. Blocks fitted out of core (first = -1, see
+    set_streaming()) cannot be refitted and are never selected.
+    """
+    mask = ~table['accepted']
+    if retry > 0:
+        mask |= table['time'] > retry
+    return mask & (table['first'] >= 0)
+
+def write_diagnostics(path, table, titles):
+    """Writes diagnostics table of one correction as text, one line per
+    block; titles[k] = title of slicing k without the correction.
+    """
+    with open(path, 'w') as f:
+        f.write('# strategy: 0 = default fit, 1 = alternative starting values, '
+                '2 = unbinned likelihood, 3 = preview\n')
+        f.write('# slicing block first last meanX sigmaX accepted strategy status edm ncalls time warm '
+                'par0 par1 par2 par3 par4 par5 err0 err1 err2 err3 err4 err5 bootMean bootSigma\n')
+
+        for r in table:
+            f.write('{0} {1} {2} {3} {4:.6g} {5:.6g} {6:d} {7} {8} {9:.3g} {10} {11:.4f} {12:d} '.format(
+                titles[r['slicing']], r['block'], r['first'], r['last'], r['meanX'], r['sigmaX'],
+                int(r['accepted']), r['strategy'], r['status'], r['edm'], r['ncalls'], r['time'],
+                int(r['warm'])))
+            values = list(r['par']) + list(r['err']) + list(r['boot'])
+            f.write(' '.join('{0:.6g}'.format(v) for v in values) + '\n')
+
+def std_vector(typ, items):
+    """Returns std::vector<typ> filled with items.
+    """
+    v = ROOT.std.vector(typ)()
+    for item in items:
+        v.push_back(item)
+    return v
+
+def draw_qa(pattern, fitsdir):
+    """Draws fitted distributions of blocks saved by fit_slices() into fitsdir
+    for fits with titles matching the wildcard pattern.
+    """
+    fnames = sorted(fnmatch.filter(os.listdir(fitsdir), pattern + '.root'))
+    if not fnames:
+        print('No saved fits match {0}'.format(pattern))
+
+    for f in fnames:
+        ROOT.draw_fits_file(os.path.join(fitsdir, f))
 
 def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ymax=-1):
     """Visualization of several graphs on single canvas.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -171,12 +507,11 @@ def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ym
     c.SetGridy()
 
     # draw dummy histogram
-    xmin = min(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (xmin, xmaxAll, ymin, ymaxAll) = graph_math.bounds(grs)
     if xmax < 0:
-        xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
+        xmax = xmaxAll
     if ymax < 0:
-        ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+        ymax = ymaxAll
 
     frame = c.DrawFrame(xmin, ymin * 0.9, xmax, ymax * 1.1)
     frame.SetTitle(title)
@@ -212,11 +547,14 @@ def combine(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ym
     saves.append((frame, grs, leg))
 
     c.Update()
-    c.SaveAs('output/plots_results/{0}.png'.format(c.GetTitle()))
+    c.SaveAs(os.path.join(plotsdir, '{0}.png'.format(c.GetTitle())))
 
 def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, ymax=-1):
     """Visualization of graphs along with corrected/uncorrected ratios.
     """
+    # ROOT objects from cached arrays
+    grs = [result_cache.to_root(gr) for gr in grs]
+
     c = ROOT.TCanvas(cname, cname, 700, 700)
     saves.append(c)
 
@@ -237,12 +575,11 @@ def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, y
     pad1.SetGridy()
 
     # draw dummy histogram
-    xmin = min(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
-    ymin = min(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+    (xmin, xmaxAll, ymin, ymaxAll) = graph_math.bounds(grs)
     if xmax < 0:
-        xmax = max(gr.GetX()[i] for gr in grs for i in range(gr.GetN()))
+        xmax = xmaxAll
     if ymax < 0:
-        ymax = max(gr.GetY()[i] for gr in grs for i in range(gr.GetN()))
+        ymax = ymaxAll
 
     frame = pad1.DrawFrame(xmin, ymin * 0.9, xmax, ymax * 1.1)
     frame.SetTitle(title)
@@ -286,48 +623,11 @@ def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, y
     pad2.SetGridx()
     pad2.SetGridy()
 
-    # make corrected/uncorrected ratios
-    rats = [ROOT.TGraphErrors() for _ in range(ncorr)]
-
-    for n in range(ncorr):
-        gru = grs[n]         # uncorrected
-        grc = grs[ncorr + n] # corrected
-
-        for i in range(grc.GetN()):
-            x  = grc.GetX()[i]
-            y1 = grc.GetY()[i]
-            ex  = grc.GetEX()[i]
-            ey1 = grc.GetEY()[i]
-
-            # NOTE: gru may have different x and ex, but we ignore this
-            # difference. Instead, y for gru is estimated from linear
-            # extrapolation between corresponding nearest points.
-
-            # find nearest points
-            for j in range(gru.GetN() - 1):
-                x1 = gru.GetX()[j]
-                x2 = gru.GetX()[j + 1]
-
-                if  x1 <= x < x2:
-                    a = (gru.GetY()[j] - gru.GetY()[j + 1]) / (x1 - x2)
-                    b = gru.GetY()[j] - a * x1
-                    y2 = a * x + b
-
-                    ea = (gru.GetEY()[j] - gru.GetEY()[j + 1]) / (x1 - x2)
-                    eb = gru.GetEY()[j] - ea * x1
-                    ey2 = ea * x + eb
-
-                    break
-            else:
-                if x < gru.GetX()[0]:
-                    y2 = gru.GetY()[0]
-                    ey2 = gru.GetEY()[0]
-                else:
-                    y2 = gru.GetY()[gru.GetN() - 1]
-                    ey2 = gru.GetEY()[gru.GetN() - 1]
-
-            rats[n].SetPoint(i, x, y1/y2)
-            rats[n].SetPointError(i, ex, y1/y2 * ((ey1/y1)**2 + (ey2/y2)**2)**0.5)
+    # make corrected/uncorrected ratios;
+    # NOTE: uncorrected graphs may have different x and ex, but we ignore this
+    # difference. Instead, their y are estimated from linear interpolation
+    # between the nearest points, see graph_math.interpolate()
+    rats = [result_cache.to_root(graph_math.ratio(grs[ncorr + n], grs[n])) for n in range(ncorr)]
 
     frame = pad2.DrawFrame(xmin, 0.1, xmax, 1.25)
     frame.SetXTitle(xtitle)
@@ -352,7 +652,7 @@ def combineR(grs, txts, cname, title, xtitle, ytitle, skipNoPU=False, xmax=-1, y
     saves.append((frame, rats))
 
     c.Update()
-    c.SaveAs('output/plots_results/{0}.png'.format(c.GetTitle()))
+    c.SaveAs(os.path.join(plotsdir, '{0}.png'.format(c.GetTitle())))
 
 
 if __name__ == '__main__':
@@ -2,17 +2,43 @@
  * histograms.
  */
 
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <functional>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <numeric>
+#include <random>
+#include <string>
+#include <thread>
 #include <vector>
 
 #include <TF1.h>
 #include <TH1D.h>
 #include <TFile.h>
+#include <TFitResult.h>
 #include <TTree.h>
 #include <TMath.h>
+#include <TROOT.h>
 #include <TSystem.h>
-#include <TCanvas.h>
 #include <TString.h>
+#include <TRandom3.h>
+#include <TStopwatch.h>
 #include <TGraphErrors.h>
+#include <TFriendElement.h>
+#include <Math/Factory.h>
+#include <Math/Functor.h>
+#include <Math/Minimizer.h>
+#include <Math/MinimizerOptions.h>
+
+#include "fit_shape.h"
+#include "kd_map.h"
+#include "quantile_sketch.h"
+#include "slice_fit.h"
 
 // prints a message and exits gracefully
 #define FATAL(msg) do { fprintf(stderr, "FATAL: %s\n", msg); gSystem->Exit(1); } while (0)
@@ -24,20 +50,135 @@ struct pair_t {
    vector<float> y;
 };
 
-struct trio_t {
-   vector<float> x;
-   vector<float> y;
-   vector<float> z;
+// data points of one slicing sorted by X axis, see make_slicing(); the
+// sorting is shared by all corrections, which differ by y only
+struct slicing_t {
+   vector<float> x;            // X values
+   vector<vector<float> > y;   // pfE/mcE per correction, in the order of x
+};
+
+// test entries of one ntuple + friend, see load_ntuple()
+struct ntuple_t {
+   string infile;
+   string friendname;
+   double fraction;  // fraction of test entries read, see set_preview()
+
+   vector<float> mcE;
+   vector<float> mcPt;
+   vector<float> mcEta;
+   vector<float> nVtx;
+   vector<float> pfE;
+   vector<float> pfEta;
+
+   map<string, vector<float> > mva_mean;  // branch name -> MVA's mean
+};
+
+// how a block was fitted, see fit_block() and fit_block_retry()
+enum {
+   kStrategyDefault = 0,   // warm-started or three-stage binned fit
+   kStrategyStart = 1,     // three-stage binned fit from alternative starting values
+   kStrategyUnbinned = 2,  // unbinned likelihood fit
+   kStrategyPreview = 3    // robust estimators of the preview mode, no fit
+};
+
+// result of fit of one block of data points, see fit_block(); first = last =
+// -1 out of core (no order of data points is kept)
+struct block_t : slice_t {
+   int strategy;             // how the block was fitted, kStrategy*
+   double time;              // wall time of fits, in seconds
+   bool accepted;            // passes the quality cut, see is_accepted()
+   double boot[2];           // bootstrap errors of position and width/position,
+                             // 0 = not evaluated, see bootstrap_block()
+};
+
+// robust estimators of the preview mode, see set_preview()
+enum { kTruncated = 0, kEffective = 1 };
+
+// sorting key of an entry: X value, ties are broken by entry number, so that
+// the order is the same in memory and out of core, see fit_slices_stream()
+struct slice_key_t {
+   float x;
+   Long64_t ev;
+
+   bool operator<(const slice_key_t& other) const {
+      return x < other.x || (x == other.x && ev < other.ev);
+   }
+};
+
+// location of a piece of block data spilled to disk
+struct spill_chunk_t {
+   off_t offset;
+   size_t n;
+};
+
+// selection of entries for the out-of-core mode, see fill_arrays()
+struct stream_source_t {
+   string infile;
+   string friendname;
+   string mva_branch;
+   bool isEE;
 };
 
 // global variables
-pair_t gDataE;    // array of (mcE,   pfE/mcE)
-pair_t gDataPt;   // array of (mcPt,  pfE/mcE)
-trio_t gDataEta;  // array of (mcEta, pfE/mcE, mcE)
-trio_t gDataVtx;  // array of (nVtx,  pfE/mcE, mcE)
+ntuple_t gNtuple;   // currently loaded ntuple
+slicing_t gDataE;   // (mcE,  pfE/mcE)
+slicing_t gDataPt;  // (mcPt, pfE/mcE)
+
+// energy regions [e1, e2) of mcE for slicing in mcEta and nVtx, see set_eregions()
+vector<pair<double, double> > gERegions;
+
+// per energy region: (mcEta, pfE/mcE) and (nVtx, pfE/mcE)
+vector<slicing_t> gDataEta;
+vector<slicing_t> gDataVtx;
+
+// test entries of gNtuple selected by the last fill_arrays() and columns of
+// corrections to apply (NULL = no correction), for fit_map()
+vector<size_t> gEntries;
+vector<const vector<float>*> gCorrections;
+
+// k-d tree of the last fit_map(): entries ordered by leaves, and leaves
+vector<size_t> gMapEntries;
+vector<map_leaf_t> gLeaves;
+
+// per correction: positions and widths vs X axis, see fit_slices()
+vector<TGraphErrors*> grMeans;
+vector<TGraphErrors*> grSigmas;  // NOTE: sigma = width/position
+
+// per correction: fitted blocks of the last fit_slices() call, for diagnostics
+vector<vector<block_t> > gBlocks;
+
+// results of the last refit_blocks() call
+vector<block_t> gRefits;
+
+int gNumThreads = 1;  // number of threads for block fits, see set_num_threads()
+int gWarmStart = 0;   // length of chains of warm-started fits, see set_warm_start()
+
+// out-of-core mode, see set_streaming()
+double gStreamMemory = 0;    // MB of block data kept in memory, 0 = in-memory mode
+double gStreamError = 0.01;  // rank error of block boundaries, in units of block size
+stream_source_t gStreamSource;
+
+// target relative precision of fitted positions and widths in the adaptive
+// mode, 0 = blocks of fixed size, see set_adaptive()
+double gAdaptive = 0;
+
+// preview mode, see set_preview()
+double gPreview = 0;                  // fraction of test entries read, 0 = full mode
+int gPreviewEstimator = kTruncated;   // estimator of positions and widths
+
+// number of bootstrap replicas per block, 0 = errors of fits, see set_bootstrap()
+int gBootstrap = 0;
 
-TGraphErrors* grMean = NULL;
-TGraphErrors* grSigma = NULL;  // NOTE: sigma = width/position
+// output directory of saved fits, see set_plots_dir()
+string gPlotsDir = "output/plots_results";
+
+// statistics of the last fit_slices() call, summed over corrections
+int gFitBlocks = 0;   // number of blocks
+long gFitCalls = 0;   // number of function calls made by Minuit
+int gFitWarm = 0;     // number of accepted warm-started fits
+int gFitRefits = 0;   // number of refits of grown blocks in the adaptive mode
+int gFitRejected = 0; // number of blocks rejected by the quality cut
+double gFitTime = 0;  // wall time of fits, in seconds
 
 //______________________________________________________________________________
 void SetBranchAddress(TTree* tree, const char* bname, void* ptr)
@@ -59,10 +200,24 @@ void SetBranchAddress(TTree* tree, const char* bname, void* ptr)
 }
 
 //______________________________________________________________________________
-void fill_arrays(const char* infile, const char* friendname,
-                 const char* mva_branch, bool isEE)
+void load_ntuple(const char* infile, const char* friendname)
 {
-   // Fills global variables-arrays.
+   /* Reads test entries of an ntuple and of its friend with outputs from MVAs
+    * into gNtuple. Shared columns and all "mva_mean_*" columns are read in one
+    * pass, so that any detector and any correction can be selected later in
+    * memory.
+    *
+    * In the preview mode, only a random subsample of test entries is read,
+    * see set_preview(); the subsample is the same in every run.
+    *
+    * Nothing is done if this ntuple is already loaded.
+    */
+
+   if (gNtuple.infile == infile && gNtuple.friendname == friendname &&
+       gNtuple.fraction == gPreview)
+      return;
+
+   TStopwatch timer;
 
    // open root file
    TFile* fi = TFile::Open(infile);
@@ -74,16 +229,26 @@ void fill_arrays(const char* infile, const char* friendname,
    if (!tree) FATAL("TFile::Get() failed");
 
    // add branches with outputs from MVAs
-   if (!tree->AddFriend("ntuplizer/PFClusterTree", friendname))
+   TFriendElement* fe = tree->AddFriend("ntuplizer/PFClusterTree", friendname);
+   if (!fe || !fe->GetTree())
       FATAL("TTree::AddFriend() failed");
 
+   // names of branches with MVA's means
+   vector<string> mva_branches;
+   TObjArray* branches = fe->GetTree()->GetListOfBranches();
+   for (int i = 0; i < branches->GetEntriesFast(); i++) {
+      TString bname = branches->At(i)->GetName();
+      if (bname.BeginsWith("mva_mean_"))
+         mva_branches.push_back(bname.Data());
+   }
+
    // disable all branches by default
    tree->SetBranchStatus("*", 0);
 
    // variables to be associated with the input tree branches
    Int_t nVtx;
    float mcE, mcPt, mcEta, pfE, pfEta;
-   float mva_output;
+   vector<float> mva_mean(mva_branches.size());
 
    // associate tree branches with variables
    SetBranchAddress(tree, "mcE",   &mcE);
@@ -93,306 +258,1632 @@ void fill_arrays(const char* infile, const char* friendname,
    SetBranchAddress(tree, "pfEta", &pfEta);
    SetBranchAddress(tree, "nVtx",  &nVtx);
 
-   if (mva_branch[0] != '\0')
-      SetBranchAddress(tree, mva_branch, &mva_output);
+   for (size_t i = 0; i < mva_branches.size(); i++)
+      SetBranchAddress(tree, mva_branches[i].c_str(), &mva_mean[i]);
 
    // cleanup from previous execution
-   gDataE.x.clear();
-   gDataE.y.clear();
-   gDataPt.x.clear();
-   gDataPt.y.clear();
-   gDataEta.x.clear();
-   gDataEta.y.clear();
-   gDataEta.z.clear();
-   gDataVtx.x.clear();
-   gDataVtx.y.clear();
-   gDataVtx.z.clear();
+   gNtuple = ntuple_t();
+
+   Long64_t nent = tree->GetEntriesFast()/2;
+   gNtuple.mcE.reserve(nent);
+   gNtuple.mcPt.reserve(nent);
+   gNtuple.mcEta.reserve(nent);
+   gNtuple.nVtx.reserve(nent);
+   gNtuple.pfE.reserve(nent);
+   gNtuple.pfEta.reserve(nent);
+
+   vector<vector<float>*> mva_columns;
+   for (size_t i = 0; i < mva_branches.size(); i++) {
+      mva_columns.push_back(&gNtuple.mva_mean[mva_branches[i]]);
+      mva_columns.back()->reserve(nent);
+   }
+
+   // random subsample of the preview mode, fixed seed
+   TRandom3 rnd(4357);
 
    // loop over events and collect data
    for (Long64_t ev = 1; ev < tree->GetEntriesFast(); ev += 2) {// NOTE: take only test events
+      // NOTE: skipped entries are not read at all
+      if (gPreview > 0 && rnd.Rndm() >= gPreview)
+         continue;
+
       if (tree->GetEntry(ev) <= 0)
          FATAL("TTree::GetEntry() failed");
 
-      float resol = pfE/mcE;
+      gNtuple.mcE.push_back(mcE);
+      gNtuple.mcPt.push_back(mcPt);
+      gNtuple.mcEta.push_back(mcEta);
+      gNtuple.nVtx.push_back((float)nVtx);
+      gNtuple.pfE.push_back(pfE);
+      gNtuple.pfEta.push_back(pfEta);
+
+      for (size_t i = 0; i < mva_columns.size(); i++)
+         mva_columns[i]->push_back(mva_mean[i]);
+   } // event loop
+
+   gNtuple.infile = infile;
+   gNtuple.friendname = friendname;
+   gNtuple.fraction = gPreview;
+
+   delete fi;
+
+   fprintf(stderr, "   %s: %lu test entries, %lu MVA outputs read in %.1f s\n", infile,
+           gNtuple.mcE.size(), mva_branches.size(), timer.RealTime());
+}
+
+//______________________________________________________________________________
+void set_eregions(const vector<double>& e1, const vector<double>& e2)
+{
+   /* Sets energy regions [e1[i], e2[i]) of mcE in which fit_slices() slices
+    * in mcEta and nVtx. Must be called before fill_arrays().
+    */
+
+   if (e1.size() != e2.size())
+      FATAL("e1.size() != e2.size()");
+
+   gERegions.clear();
+   for (size_t i = 0; i < e1.size(); i++)
+      gERegions.push_back(make_pair(e1[i], e2[i]));
+}
+
+//______________________________________________________________________________
+float resolution(size_t i, const vector<float>* corr)
+{
+   /* Returns pfE/mcE of test entry i of gNtuple, corrected by corr (NULL = no
+    * correction).
+    */
+
+   float resol = gNtuple.pfE[i]/gNtuple.mcE[i];
+
+   // apply correction, if necessary
+   if (corr)
+      resol *= (*corr)[i];
 
-      // apply correction, if necessary
-      if (mva_branch[0] != '\0')
-         resol *= mva_output;
+   return resol;
+}
+
+//______________________________________________________________________________
+void make_slicing(slicing_t& data, const vector<float>& x, vector<size_t> ent,
+                  const vector<const vector<float>*>& corrs)
+{
+   /* Fills data with test entries ent of gNtuple sorted by x; y is filled for
+    * every correction in corrs (NULL = no correction), so the sorting is done
+    * only once for all of them.
+    *
+    * NOTE: stable sort, i.e. ties are kept in the order of entries, as in
+    * fit_slices_stream().
+    */
+
+   std::stable_sort(ent.begin(), ent.end(), [&x](size_t i, size_t j) { return x[i] < x[j]; });
+
+   size_t siz = ent.size();
+
+   data.x.resize(siz);
+   for (size_t k = 0; k < siz; k++)
+      data.x[k] = x[ent[k]];
+
+   data.y.assign(corrs.size(), vector<float>(siz));
+   for (size_t c = 0; c < corrs.size(); c++)
+      for (size_t k = 0; k < siz; k++)
+         data.y[c][k] = resolution(ent[k], corrs[c]);
+}
+
+//______________________________________________________________________________
+void fill_arrays(const char* infile, const char* friendname,
+                 const vector<string>& mva_branches, bool isEE)
+{
+   /* Fills global variables-arrays for corrections from mva_branches ("" = no
+    * correction). Entries are selected and sorted once for all corrections.
+    */
 
-      gDataEta.x.push_back(mcEta);
-      gDataEta.y.push_back(resol);
-      gDataEta.z.push_back(mcE);
+   // out-of-core mode: entries are read by fit_slices_stream() from the ntuple
+   if (gStreamMemory > 0) {
+      if (mva_branches.size() != 1)
+         FATAL("out-of-core mode takes one correction at a time");
+
+      gStreamSource.infile = infile;
+      gStreamSource.friendname = friendname;
+      gStreamSource.mva_branch = mva_branches[0];
+      gStreamSource.isEE = isEE;
+      return;
+   }
+
+   // read ntuple, if not yet in memory
+   load_ntuple(infile, friendname);
+
+   // corrections to apply
+   vector<const vector<float>*> corrs;
+   for (size_t c = 0; c < mva_branches.size(); c++) {
+      const string& bname = mva_branches[c];
+
+      if (bname.empty()) {
+         corrs.push_back(NULL);
+         continue;
+      }
+
+      map<string, vector<float> >::const_iterator it = gNtuple.mva_mean.find(bname);
+      if (it == gNtuple.mva_mean.end())
+         FATAL(Form("tree branch \"%s\" does not exist", bname.c_str()));
+      corrs.push_back(&it->second);
+   }
+
+   // selected entries, for mcE and mcPt (ent) and per energy region
+   vector<size_t> ent;
+   vector<vector<size_t> > entEta(gERegions.size());
+   vector<vector<size_t> > entVtx(gERegions.size());
+
+   // loop over test entries in memory
+   for (size_t i = 0; i < gNtuple.mcE.size(); i++) {
+      float mcE = gNtuple.mcE[i];
+
+      for (size_t r = 0; r < gERegions.size(); r++)
+         if (mcE >= gERegions[r].first && mcE < gERegions[r].second)
+            entEta[r].push_back(i);
 
       // barrel vs endcaps
       if (isEE) {
-         if (fabs(pfEta) < 1.479)
+         if (fabs(gNtuple.pfEta[i]) < 1.479)
             continue;
       } else {
-         if (fabs(pfEta) > 1.479)
+         if (fabs(gNtuple.pfEta[i]) > 1.479)
             continue;
       }
 
-      gDataE.x.push_back(mcE);
-      gDataE.y.push_back(resol);
+      ent.push_back(i);
+
+      for (size_t r = 0; r < gERegions.size(); r++)
+         if (mcE >= gERegions[r].first && mcE < gERegions[r].second)
+            entVtx[r].push_back(i);
+   }
 
-      gDataPt.x.push_back(mcPt);
-      gDataPt.y.push_back(resol);
+   make_slicing(gDataE, gNtuple.mcE, ent, corrs);
+   make_slicing(gDataPt, gNtuple.mcPt, ent, corrs);
 
-      gDataVtx.x.push_back((float)nVtx);
-      gDataVtx.y.push_back(resol);
-      gDataVtx.z.push_back(mcE);
+   // NOTE: columns of corrections are owned by gNtuple
+   gEntries.swap(ent);
+   gCorrections = corrs;
 
-   } // event loop
+   gDataEta.resize(gERegions.size());
+   gDataVtx.resize(gERegions.size());
+
+   for (size_t r = 0; r < gERegions.size(); r++) {
+      make_slicing(gDataEta[r], gNtuple.mcEta, entEta[r], corrs);
+      make_slicing(gDataVtx[r], gNtuple.nVtx, entVtx[r], corrs);
+   }
 }
 
 //______________________________________________________________________________
-void MeanSigma(vector<float> &numbers, double &mean, double &sigma)
+void fill_arrays(const char* infile, const char* friendname,
+                 const char* mva_branch, bool isEE)
+{
+   // Fills global variables-arrays for one correction, see above.
+
+   fill_arrays(infile, friendname, vector<string>(1, mva_branch), isEE);
+}
+
+//______________________________________________________________________________
+void MedianEffSigma(vector<float> numbers, double &median, double &sigma)
+{
+   /* Evaluates median and effective sigma of numbers "numbers": half-width of
+    * the narrowest interval which contains 68.3% of the numbers.
+    *
+    * Unlike MeanSigma(), no iterations are needed and tails of any size do
+    * not bias the result.
+    */
+
+   size_t siz = numbers.size();
+   sort(numbers.begin(), numbers.end());
+
+   median = (siz % 2) ? numbers[siz/2] : 0.5 * (numbers[siz/2 - 1] + numbers[siz/2]);
+
+   // number of numbers in the interval
+   size_t w = max((size_t) 1, (size_t) ceil(0.683 * siz));
+
+   double width = numbers[siz - 1] - numbers[0];
+   for (size_t i = 0; i + w <= siz; i++)
+      width = min(width, (double) numbers[i + w - 1] - numbers[i]);
+
+   sigma = 0.5 * width;
+}
+
+//______________________________________________________________________________
+bool WeightedMeanSigma(const vector<float>& sorted, const vector<double>& sum0,
+                       const vector<double>& sum1, const vector<double>& sum2,
+                       double& mean, double& sigma)
 {
-   /* Evaluates average (mean) and dispersion (sigma) of numbers "numbers".
+   /* Evaluates truncated mean and sigma as MeanSigma() does, for sorted
+    * numbers with weights given by prefix sums: sum0[i] = sum of weights of
+    * sorted[0..i), sum1[i] = sum of weight*sorted, sum2[i] = sum of
+    * weight*sorted^2. Each iteration costs two binary searches.
     *
-    * Mean and sigma are recalculated iteratively several times. During each
-    * calculation, a region [mean - 3*sigma, mean + 3*sigma] is used, where
-    * "mean" and "sigma" are taken from a previous iteration.
+    * Returns false if the iterations do not converge or run out of entries.
     */
 
+   auto eval = [&](size_t i1, size_t i2) {
+      double nent = sum0[i2] - sum0[i1];
+      if (!(nent > 0))
+         return false;
+
+      mean = (sum1[i2] - sum1[i1])/nent;
+      sigma = sqrt(TMath::Max(0., (sum2[i2] - sum2[i1])/nent - mean*mean));
+      return true;
+   };
+
    // zero-order iteration
-   mean = 0;
-   sigma = 0;
-   for (size_t i = 0; i < numbers.size(); i++) {
-      mean += numbers[i];
-      sigma += numbers[i] * numbers[i];
-   }
-   mean /= numbers.size();
-   sigma = sqrt(sigma/numbers.size() - mean*mean);
+   if (!eval(0, sorted.size()))
+      return false;
 
-   // iterations
    for (int c = 0; c < 1000; c++) {
       double mean_prev = mean;
       double sigma_prev = sigma;
 
-      double xmin = mean - 3*sigma;
-      double xmax = mean + 3*sigma;
-
-      // evaluate peak position and width
-      mean = 0;
-      sigma = 0;
-      int nent = 0;
-      for (size_t i = 0; i < numbers.size(); i++) {
-         if (numbers[i] < xmin || numbers[i] > xmax) continue;
+      size_t i1 = lower_bound(sorted.begin(), sorted.end(), mean - 3*sigma) - sorted.begin();
+      size_t i2 = upper_bound(sorted.begin(), sorted.end(), mean + 3*sigma) - sorted.begin();
 
-         mean += numbers[i];
-         sigma += numbers[i] * numbers[i];
-         nent++;
-      }
-      mean /= nent;
-      sigma = sqrt(sigma/nent - mean*mean);
+      if (!eval(i1, i2))
+         return false;
 
-      // break when converged
       if (fabs(mean - mean_prev) <= 1e-6 * fabs(mean) &&
           fabs(sigma - sigma_prev) <= 1e-6 * fabs(sigma))
-         return;
+         return true;
    }
 
-   const char* fmt = "nent_total=%lli, mean=%f, sigma=%f\n";
-   fprintf(stderr, fmt, numbers.size(), mean, sigma);
-   FATAL("mean and/or sigma did not converged");
+   return false;
 }
 
 //______________________________________________________________________________
-void fit_slices_real(vector<float>& x, vector<float>& y, int blockSize,
-                     const char* title, const char* xtitle)
+void set_num_threads(int n)
 {
-    /* Fits distributions of sorted blocks of data points, result is given in
-     * grMean and grSigma -- positions and widths vs X axis.
-     *
-     * NOTE: sigma = width/position.
-     */
+   /* Sets number of threads to be used by fit_parallel().
+    *
+    * n < 1 = number of available CPU cores.
+    */
 
-   // cleanup from previous execution
-   if (grMean) delete grMean;
-   if (grSigma) delete grSigma;
+   gNumThreads = InitThreads(n);
+}
+
+//______________________________________________________________________________
+void set_warm_start(int n)
+{
+   /* Sets length of chains of consecutive blocks in fit_blocks(): the
+    * first block of a chain is fitted from scratch, every other block starts
+    * from the parameters of the previous block (see fit_block()).
+    *
+    * n < 2 = no warm starts. Chains do not depend on the number of threads,
+    * hence results do not either.
+    */
 
-   grMean = new TGraphErrors();
-   grSigma = new TGraphErrors();
+   gWarmStart = n;
+}
 
-   size_t siz = x.size();
-   if (siz < 1) FATAL("x.size() < 1");
+//______________________________________________________________________________
+void set_adaptive(double precision)
+{
+   /* Switches fit_slices() to blocks of adaptive size: instead of blockSize
+    * data points per block, blocks are grown or shrunk along X axis until
+    * relative errors of fitted position and width reach precision, see
+    * fit_segment_adaptive(). blockSize is then the initial size.
+    *
+    * precision <= 0 = blocks of fixed size (default). Warm starts are not
+    * used in the adaptive mode, nor is the out-of-core mode adaptive.
+    */
 
-   // sort by X axis
-   size_t* ind = new size_t[siz]; // allocate on the heap to avoid segfaults
-   TMath::Sort(siz, &x.front(), ind, false);
+   gAdaptive = precision;
+}
 
-   // NOTE: last block is excluded if it has less than 0.5 * blockSize entries
-   int nblocks = TMath::Nint(round(((float)siz)/blockSize));
+//______________________________________________________________________________
+void set_preview(double fraction, int estimator = kTruncated)
+{
+   /* Switches to the preview mode: only a random fraction of test entries is
+    * read (see load_ntuple()), and instead of fits of blocks, positions and
+    * widths are evaluated with robust estimators, see estimate_block():
+    *
+    *    estimator = kTruncated: iterative truncated mean and sigma, MeanSigma();
+    *    estimator = kEffective: median and effective sigma, MedianEffSigma().
+    *
+    * fraction <= 0 = full mode with fits (default). The preview mode is not
+    * available out of core.
+    */
 
-   TCanvas* c = NULL;
-   vector<TObject*> todel(64);
+   if (estimator != kTruncated && estimator != kEffective)
+      FATAL("invalid estimator");
 
-   // counter of accepted blocks
-   int b0 = 0;
+   gPreview = fraction;
+   gPreviewEstimator = estimator;
+}
 
-   // loop over blocks of ordered data
-   for (int b = 0; b < nblocks; b++) {
-      vector<float> bx;
-      vector<float> by;
+//______________________________________________________________________________
+void set_bootstrap(int nreplicas)
+{
+   /* Switches on bootstrap errors: errors of positions and widths in
+    * grMeans and grSigmas are taken from nreplicas bootstrap replicas of
+    * every block, see bootstrap_block(), instead of from fits.
+    *
+    * nreplicas < 1 = errors of fits (default).
+    */
 
-      // fill separate arrays with current block data
-      for (size_t i = b * blockSize; i < (size_t) (b + 1) * blockSize; i++) {
-         if (i >= siz) break;
-         bx.push_back(x[ind[i]]);
-         by.push_back(y[ind[i]]);
-      }
+   gBootstrap = nreplicas;
+}
+
+//______________________________________________________________________________
+void set_plots_dir(const char* dir)
+{
+   /* Sets directory into whose "fits" subdirectory fits of blocks are saved
+    * (see collect_blocks()) and drawn by draw_fits_file().
+    */
+
+   gPlotsDir = dir;
+}
 
-      double meanX, sigmaX;
-      double meanY, sigmaY;
+//______________________________________________________________________________
+void set_streaming(double maxMemory, double relError = 0.01)
+{
+   /* Switches fit_slices() to the out-of-core mode: instead of loading the
+    * ntuple into memory, entries are streamed from disk twice per slicing and
+    * at most maxMemory MB of block data are kept in memory (the rest is
+    * spilled into a temporary file). Block boundaries are then determined
+    * within relError * blockSize entries, see fit_slices_stream().
+    *
+    * maxMemory <= 0 = in-memory mode (default).
+    */
 
-      // mean and sigma in the block and Etrue/Erec
-      MeanSigma(bx, meanX, sigmaX);
-      MeanSigma(by, meanY, sigmaY);
+   gStreamMemory = maxMemory;
+   gStreamError = relError;
+}
+
+//______________________________________________________________________________
+slice_fit_t fit_settings(bool gradients = true)
+{
+   /* Returns settings of fits of distributions of Etrue/Erec, see
+    * FitSlice(): Gaussian + left power-law tail + right exponential tail
+    * (see fit_shape.h), pre-fitted first with fixed and then with free tails
+    * (improves convergence, especially in the EB/EE gap region).
+    *
+    * gradients = true: analytic gradients, the fit function must provide them.
+    */
 
-      // fill histogram
-      TH1* h = new TH1D("h", "", 100, 0.55, 1.3);
-      for (size_t i = 0; i < by.size(); i++)
-         h->Fill(by[i]);
+   slice_fit_t cfg;
+   cfg.nbins = 100;
+   cfg.xmin = 0.55;
+   cfg.xmax = 1.3;
+   cfg.sigma0 = 0.5;
+   cfg.SetTails(1.5, 5, 1.5);
+   cfg.fixTails = true;
+
+   cfg.SetPreLimits(0, 0.33, 2);
+   cfg.SetPreLimits(1, -1, 1);
+   cfg.SetPreLimits(2, 0.1, 1.1);
+   cfg.SetPreLimits(3, 0.4, 10);
+   cfg.SetPreLimits(4, 1.01, 100);
+   cfg.SetPreLimits(5, 0.4, 10);
+
+   cfg.SetLimits(1, 0.65, 1.2);
+   cfg.SetLimits(2, 0, 1.1);
+
+   // with statistics of fits
+   cfg.prefit = gradients ? "QENSG" : "QENS";
+   cfg.option = cfg.prefit + "L";
+
+   return cfg;
+}
 
-      // create new canvas, if necessary
-      if (b % 9 == 0) {
-         if (c) {
-            c->SaveAs(Form("output/plots_results/fits/%s.png", c->GetTitle()));
+//______________________________________________________________________________
+bool is_sane_fit(TFitResultPtr& r, TF1* fit, const slice_t& res)
+{
+   /* Returns true if a warm-started fit has converged with usable results.
+    */
 
-            // memory cleanup
-            delete c;
-            for (size_t k = 0; k < todel.size(); k++)
-               delete todel[k];
-            todel.clear();
-         }
+   double meanY = res.meanY;
+   double sigmaY = res.sigmaY;
 
-         TString cname = TString::Format("fits_%s_blk%03dto%03d", title, b + 1, b + 9);
-         c = new TCanvas(cname, cname, 1000, 700);
+   if (!r.Get() || r->Status() != 0 || !r->IsValid())
+      return false;
 
-         c->SetLeftMargin(0);
-         c->SetRightMargin(0);
-         c->SetTopMargin(0);
-         c->SetBottomMargin(0);
-         c->Divide(3, 3);
-      }
+   for (int i = 0; i < 6; i++) {
+      double err = fit->GetParError(i);
+      if (!(err > 0) || !std::isfinite(err))
+         return false;
+   }
 
-      c->cd(b % 9 + 1);
-      gPad->SetLeftMargin(0.12);
-      gPad->SetRightMargin(0.02);
-      gPad->SetTopMargin(0.08);
-      gPad->SetBottomMargin(0.08);
-
-      h->SetTitle(Form("%s = %.2f #pm %.2f", xtitle, meanX, sigmaX));
-      h->SetXTitle("E^{rec}/E^{gen}");
-      h->SetYTitle("Entries");
-      h->SetTitleOffset(1.6, "Y");
-
-      h->Sumw2(true);
-      h->SetLineColor(kBlack);
-      h->Draw();
-
-      // Gaussian + left power-law tail + right exponential tail
-      const char* expr = "[0] * ( (x-[1])/[2] > -[3] ? "
-         "( (x-[1])/[2] < [5] ? exp(-(x-[1])^2/(2*[2]*[2])) : exp(0.5*[5]*[5] - [5]*(x-[1])/[2]) ) : "
-         "([4]/[3])^[4] * exp(-0.5*[3]^2) * (-(x-[1])/[2]-[3]+[4]/[3])^(-[4]) )";
-
-      TF1* fit = new TF1("fit", expr, 0.55, 1.3);
-      fit->SetLineWidth(1);
-      fit->SetNpx(2000);
-
-      fit->SetParameters(h->GetMaximum(), meanY, 0.5 * sigmaY, 1.5, 5, 1.5);
-      fit->SetParLimits(0, 0.33 * h->GetMaximum(), 2 * h->GetMaximum());
-      fit->SetParLimits(1, meanY - sigmaY, meanY + sigmaY);
-      fit->SetParLimits(2, 0.1 * sigmaY, 1.1 * sigmaY);
-
-      // pre-fit to improve convergence (especially in the EB/EE gap region)
-      fit->FixParameter(3, 1.5);
-      fit->FixParameter(4, 5);
-      fit->FixParameter(5, 1.5);
-      h->Fit(fit, "QEM", "same", 0.55, 1.3);
-
-      fit->SetParLimits(3, 0.4, 10);
-      fit->SetParLimits(4, 1.01, 100);
-      fit->SetParLimits(5, 0.4, 10);
-      h->Fit(fit, "QEM", "same", 0.55, 1.3);
-
-      fit->ReleaseParameter(0);
-      fit->ReleaseParameter(0);
-      fit->SetParLimits(1, 0.65, 1.2);
-      fit->SetParLimits(2, 0, 1.1 * sigmaY);
-      fit->ReleaseParameter(3);
-      fit->ReleaseParameter(4);
-      fit->ReleaseParameter(5);
-      h->Fit(fit, "QEML", "same", 0.55, 1.3);
+   // the same acceptance as in collect_blocks()
+   double mean = fit->GetParameter(1);
+   if (fit->GetParError(1)/mean >= 0.15 || fit->GetParError(2)/mean >= 0.15)
+      return false;
 
-      // do not accept really bad fitting results
-      if (fit->GetParError(1)/fit->GetParameter(1) < 0.15 &&
-          fit->GetParError(2)/fit->GetParameter(2) < 0.15) {
-        grMean->SetPoint(b0, meanX, fit->GetParameter(1));
-        grMean->SetPointError(b0, sigmaX, fit->GetParError(1));
+   // position must stay where fits from scratch would look for it
+   if (fabs(mean - meanY) > sigmaY)
+      return false;
 
-        grSigma->SetPoint(b0, meanX, fit->GetParameter(2)/fit->GetParameter(1));
-        grSigma->SetPointError(b0, sigmaX, fit->GetParError(2)/fit->GetParameter(1));
+   return true;
+}
 
-        b0++;
-      }
+//______________________________________________________________________________
+bool is_accepted(const block_t& res)
+{
+   /* Returns true if fitted position and width of a block are precise enough
+    * to be kept, see collect_blocks().
+    */
 
-      todel.push_back(h);
-      todel.push_back(fit);
-   } // block loop
+   return res.err[1]/res.par[1] < 0.15 && res.err[2]/res.par[2] < 0.15;
+}
+
+//______________________________________________________________________________
+void set_alternative_start(const slice_t& res, TH1D* h, TF1* fit)
+{
+   /* Sets starting values of refits, see fit_block_retry(): the mode of the
+    * histogram, a wider core and other tails.
+    */
 
-   // save the very last canvas
-   if (c) {
-      c->SaveAs(Form("output/plots_results/fits/%s.png", c->GetTitle()));
+   double mode = h->GetBinCenter(h->GetMaximumBin());
+   double mean0 = TMath::Range(res.meanY - 0.9 * res.sigmaY, res.meanY + 0.9 * res.sigmaY, mode);
 
-      // memory cleanup
-      delete c;
-      for (size_t k = 0; k < todel.size(); k++)
-         delete todel[k];
+   fit->SetParameters(h->GetMaximum(), mean0, 0.8 * res.sigmaY, 1, 10, 1);
+}
+
+//______________________________________________________________________________
+void fit_block_unbinned(const vector<float>& by, TH1D* h, TF1* fit, double sigmaY,
+                        block_t& res)
+{
+   /* Unbinned maximum-likelihood fit of by in the fit range, starting from
+    * the current parameters of fit, see fit_block_retry(). The fit function
+    * is normalized numerically; its amplitude is fixed during the fit and
+    * scaled to the histogram h afterwards. Number of Minuit function calls
+    * is added to res.
+    */
+
+   vector<double> xs;
+   for (size_t i = 0; i < by.size(); i++)
+      if (by[i] >= 0.55 && by[i] <= 1.3)
+         xs.push_back(by[i]);
+
+   // negative log-likelihood
+   auto nll = [&](const double* p) {
+      fit->SetParameters(p);
+
+      double norm = fit->Integral(0.55, 1.3);
+      if (!(norm > 0) || !std::isfinite(norm))
+         return 1e30;
+
+      double s = xs.size() * log(norm);
+      for (size_t i = 0; i < xs.size(); i++)
+         s -= log(TMath::Max(fit->EvalPar(&xs[i], p), 1e-300));
+
+      return s;
+   };
+
+   ROOT::Math::Functor fcn(nll, 6);
+
+   std::unique_ptr<ROOT::Math::Minimizer> minuit(ROOT::Math::Factory::CreateMinimizer("Minuit2", "Migrad"));
+   if (!minuit) FATAL("ROOT::Math::Factory::CreateMinimizer() failed");
+
+   minuit->SetFunction(fcn);
+   minuit->SetErrorDef(0.5);
+   minuit->SetPrintLevel(-1);
+   minuit->SetMaxFunctionCalls(10000);
+
+   // starting values within the limits of the final binned fit
+   double par[6], err[6];
+   for (int i = 0; i < 6; i++)
+      par[i] = fit->GetParameter(i);
+
+   double lo[6] = {0, 0.65, 0.05 * sigmaY, 0.4, 1.01, 0.4};
+   double hi[6] = {0, 1.2, 1.1 * sigmaY, 10, 100, 10};
+   double step[6] = {0, 0.1 * sigmaY, 0.1 * sigmaY, 0.1, 0.5, 0.1};
+
+   minuit->SetFixedVariable(0, fit->GetParName(0), par[0]);
+   for (int i = 1; i < 6; i++)
+      minuit->SetLimitedVariable(i, fit->GetParName(i), TMath::Range(lo[i], hi[i], par[i]),
+                                 step[i], lo[i], hi[i]);
+
+   minuit->Minimize();
+
+   for (int i = 0; i < 6; i++) {
+      par[i] = minuit->X()[i];
+      err[i] = minuit->Errors()[i];
    }
 
-   delete ind;
+   // amplitude matching the histogram, entries per bin width
+   fit->SetParameters(par);
+   double norm = fit->Integral(0.55, 1.3);
+   if (norm > 0)
+      par[0] *= xs.size() * h->GetBinWidth(1)/norm;
+   err[0] = 0;
+
+   fit->SetParameters(par);
+   fit->SetParErrors(err);
+
+   res.ncalls += minuit->NCalls();
+   res.status = minuit->Status();
+   res.edm = minuit->Edm();
 }
 
 //______________________________________________________________________________
-void fit_slices(int type, int blockSize, const char* title, const char* xtitle,
-                double e1 = 0, double e2 = 0)
+void estimate_block(const vector<float>& by, TH1D* h, double meanY, double sigmaY,
+                    block_t& res)
 {
-   // Steers work of fit_slices_real().
+   /* Fills res with estimates of the preview mode instead of fitted
+    * parameters, see set_preview(); meanY and sigmaY = truncated mean and
+    * sigma of by, h = filled histogram.
+    *
+    * Errors are asymptotic ones for a Gaussian of the estimated width:
+    * sigma/sqrt(n) for the truncated mean and sqrt(pi/2)*sigma/sqrt(n) for
+    * the median. The error of the width is nominal, that of the standard
+    * deviation, for both estimators.
+    *
+    * The tail parameters are the starting ones of fit_settings(), so that
+    * draw_fits_file() shows a curve of about the estimated position and
+    * width.
+    */
 
-   // mcE
-   if (type == 0)
-      fit_slices_real(gDataE.x, gDataE.y, blockSize, title, xtitle);
+   if (gPreviewEstimator == kEffective)
+      MedianEffSigma(by, meanY, sigmaY);
 
-   // mcPt
-   else if (type == 1)
-      fit_slices_real(gDataPt.x, gDataPt.y, blockSize, title, xtitle);
-
-   // mcEta in mcE region
-   else if (type == 2) {
-      pair_t data;
-      for (size_t i = 0; i < gDataEta.x.size(); i++) {
-         if (gDataEta.z[i] < e1 || gDataEta.z[i] >= e2) continue;
-         data.x.push_back(gDataEta.x[i]);
-         data.y.push_back(gDataEta.y[i]);
-      }
+   double n = by.size();
+
+   double par[6] = {h->GetMaximum(), meanY, sigmaY, 1.5, 5, 1.5};
+   double errMean = sigmaY/sqrt(n);
+   if (gPreviewEstimator == kEffective)
+      errMean *= sqrt(TMath::PiOver2());  // efficiency of median vs mean
+
+   double err[6] = {0, errMean, sigmaY/sqrt(2*n), 0, 0, 0};
+
+   res.contents.assign(h->GetArray(), h->GetArray() + h->GetNbinsX() + 2);
+   for (int i = 0; i < 6; i++) {
+      res.par[i] = par[i];
+      res.err[i] = err[i];
+   }
+
+   res.strategy = kStrategyPreview;
+   res.status = 0;
+   res.edm = 0;
+}
 
-      fit_slices_real(data.x, data.y, blockSize, title, xtitle);
+//______________________________________________________________________________
+double central_half_width(vector<double>& values)
+{
+   /* Returns half-width of the central 68.3% interval of values, 0 if there
+    * are less than two of them. NOTE: values are reordered.
+    */
+
+   size_t n = values.size();
+   if (n < 2)
+      return 0;
+
+   size_t i1 = (size_t) floor(0.1585 * (n - 1));
+   size_t i2 = (size_t) ceil(0.8415 * (n - 1));
+
+   nth_element(values.begin(), values.begin() + i1, values.end());
+   double lo = values[i1];
+   nth_element(values.begin(), values.begin() + i2, values.end());
+   double hi = values[i2];
+
+   return 0.5 * (hi - lo);
+}
+
+//______________________________________________________________________________
+void bootstrap_block(const vector<float>& by, block_t& res)
+{
+   /* Evaluates bootstrap errors of a block into res.boot: half-widths of the
+    * central 68.3% intervals of the truncated mean and of sigma/mean (see
+    * MeanSigma()) over gBootstrap replicas of by.
+    *
+    * Replicas are drawn as Poisson(1) weights of data points, so the data
+    * are sorted only once: every replica costs one pass which accumulates
+    * weighted prefix sums, every iteration of the truncated mean is then two
+    * binary searches, see WeightedMeanSigma(). Random numbers are seeded
+    * from the block contents, so results do not depend on the number of
+    * threads.
+    */
+
+   size_t siz = by.size();
+   res.boot[0] = res.boot[1] = 0;
+   if (siz < 2)
+      return;
+
+   vector<float> sorted(by);
+   sort(sorted.begin(), sorted.end());
+
+   // cumulative distribution of Poisson(1) in units of 2^-32, for inversion
+   // of 32-bit random numbers
+   const int kmax = 12;
+   unsigned int cdf[kmax];
+   double p = exp(-1.), sum = 0;
+   for (int k = 0; k < kmax; k++) {
+      sum += p;
+      p /= k + 1;
+      cdf[k] = (unsigned int) TMath::Min(4294967295., ldexp(sum, 32));
+   }
+
+   unsigned long long state = siz;
+   float probes[3] = {sorted[0], sorted[siz/2], sorted[siz - 1]};
+   for (int i = 0; i < 3; i++) {
+      unsigned int bits;
+      memcpy(&bits, &probes[i], sizeof(bits));
+      state = state * 1000003 ^ bits;
    }
 
-   // mcVtx in mcE region
-   else if (type == 3) {
-      pair_t data;
-      for (size_t i = 0; i < gDataVtx.x.size(); i++) {
-         if (gDataVtx.z[i] < e1 || gDataVtx.z[i] >= e2) continue;
-         data.x.push_back(gDataVtx.x[i]);
-         data.y.push_back(gDataVtx.y[i]);
+   // splitmix64: fast generator, every number gives weights of two data points
+   auto next = [&state]() {
+      unsigned long long z = (state += 0x9E3779B97F4A7C15ULL);
+      z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+      z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+      return z ^ (z >> 31);
+   };
+
+   auto poisson = [&cdf](unsigned int u) {
+      int w = 0;
+      while (w < kmax - 1 && u >= cdf[w])
+         w++;
+      return w;
+   };
+
+   vector<double> sum0(siz + 1, 0), sum1(siz + 1, 0), sum2(siz + 1, 0);
+   vector<double> means, ratios;
+
+   for (int r = 0; r < gBootstrap; r++) {
+      unsigned long long bits = 0;
+
+      for (size_t i = 0; i < siz; i++) {
+         if (i % 2 == 0)
+            bits = next();
+
+         int w = poisson((unsigned int) (i % 2 == 0 ? bits : bits >> 32));
+
+         double x = sorted[i];
+         sum0[i + 1] = sum0[i] + w;
+         sum1[i + 1] = sum1[i] + w * x;
+         sum2[i + 1] = sum2[i] + w * x * x;
       }
 
-      fit_slices_real(data.x, data.y, blockSize, title, xtitle);
+      double mean, sigma;
+      if (WeightedMeanSigma(sorted, sum0, sum1, sum2, mean, sigma) && mean != 0) {
+         means.push_back(mean);
+         ratios.push_back(sigma/mean);
+      }
+   }
+
+   res.boot[0] = central_half_width(means);
+   res.boot[1] = central_half_width(ratios);
+}
+
+//______________________________________________________________________________
+void store_fit(TH1D* h, TF1* fit, block_t& res)
+{
+   /* Saves fitted histogram and parameters into res.
+    */
+
+   res.contents.assign(h->GetArray(), h->GetArray() + h->GetNbinsX() + 2);
+   for (int i = 0; i < 6; i++) {
+      res.par[i] = fit->GetParameter(i);
+      res.err[i] = fit->GetParError(i);
+   }
+}
+
+//______________________________________________________________________________
+void fit_block(vector<float>& bx, vector<float>& by, TH1D* h, TF1* fit,
+               block_t& res, const block_t* seed = NULL)
+{
+   /* Fits distribution of by in a block of data points (bx, by). Result is
+    * given in res.
+    *
+    * If seed (fit result of the previous block) is given, only the final fit
+    * is performed starting from the seed parameters. The full three-stage
+    * fit (see fit_settings()) is done if there is no seed or the
+    * warm-started fit is not sane, see FitSlice().
+    *
+    * In the preview mode, nothing is fitted, see estimate_block().
+    * Bootstrap errors are evaluated if requested, see set_bootstrap().
+    *
+    * NOTE: h and fit are reused from block to block, so they must not be
+    * shared between threads.
+    */
+
+   TStopwatch timer;
+
+   // analytic gradients, if the fit function provides them
+   slice_fit_t cfg = fit_settings(dynamic_cast<TailShapeTF1*>(fit) != NULL);
+   res.strategy = kStrategyDefault;
+   res.boot[0] = res.boot[1] = 0;
+
+   // preview mode, see set_preview()
+   if (gPreview > 0) {
+      FillSlice(bx, by, h, cfg, res);
+      estimate_block(by, h, res.meanY, res.sigmaY, res);
+      if (gBootstrap > 0)
+         bootstrap_block(by, res);
+      res.time = timer.RealTime();
+      return;
+   }
+
+   slice_hooks_t hooks;
+   hooks.seed = seed;
+   hooks.isSane = is_sane_fit;
+
+   FitSlice(bx, by, h, fit, cfg, res, &hooks);
+
+   if (gBootstrap > 0)
+      bootstrap_block(by, res);
+   res.time = timer.RealTime();
+}
+
+//______________________________________________________________________________
+void fit_block_retry(vector<float>& bx, vector<float>& by, TH1D* h, TF1* fit,
+                     block_t& res)
+{
+   /* Refits a block which failed the quality cut or was slow, see
+    * refit_blocks(): first by the three-stage fit from alternative starting
+    * values, then, if the result is not accepted, by an unbinned likelihood
+    * fit starting from it. res.strategy tells which fit gave the result.
+    */
+
+   TStopwatch timer;
+
+   slice_fit_t cfg = fit_settings(dynamic_cast<TailShapeTF1*>(fit) != NULL);
+   res.strategy = kStrategyStart;
+   res.boot[0] = res.boot[1] = 0;
+
+   slice_hooks_t hooks;
+   hooks.start = set_alternative_start;
+
+   FitSlice(bx, by, h, fit, cfg, res, &hooks);
+
+   if (!is_accepted(res)) {
+      res.strategy = kStrategyUnbinned;
+      fit_block_unbinned(by, h, fit, res.sigmaY, res);
+      store_fit(h, fit, res);
+   }
+
+   if (gBootstrap > 0)
+      bootstrap_block(by, res);
+   res.time = timer.RealTime();
+}
+
+//______________________________________________________________________________
+void fit_block(vector<float>& x, vector<float>& y, const size_t* ind,
+               size_t first, size_t last, TH1D* h, TF1* fit, block_t& res,
+               const block_t* seed = NULL)
+{
+   /* Fits distribution of y in a block [first, last) of data points sorted
+    * by X axis, ind = sorting index. See fit_block() above.
+    */
+
+   vector<float> bx;
+   vector<float> by;
+
+   // fill separate arrays with current block data
+   for (size_t i = first; i < last; i++) {
+      bx.push_back(x[ind[i]]);
+      by.push_back(y[ind[i]]);
+   }
+
+   fit_block(bx, by, h, fit, res, seed);
+}
+
+//______________________________________________________________________________
+void draw_fits_file(const char* fname)
+{
+   /* Draws fitted distributions of blocks saved by collect_blocks() or
+    * fit_map() into fname, see DrawFitsFile().
+    */
+
+   DrawFitsFile(fname, fit_settings(), "%s = %.2f #pm %.2f");
+}
+
+//______________________________________________________________________________
+void fit_parallel(int njobs, const std::function<void(int, TH1D*, TF1*)>& job)
+{
+   /* Runs job(j, h, fit) for j = 0..njobs-1 in gNumThreads threads. Every
+    * thread has its own histogram h and fitting function fit.
+    */
+
+   // NOTE: unlike TMinuit, Minuit2 is reentrant; it is used regardless of the
+   // number of threads in order to get the same results
+   ROOT::Math::MinimizerOptions::SetDefaultMinimizer("Minuit2");
+
+   int nthreads = TMath::Max(1, TMath::Min(gNumThreads, njobs));
+   slice_fit_t cfg = fit_settings();
+
+   // per-thread histograms and fitting functions
+   vector<TH1D*> hs;
+   vector<TF1*> fits;
+   for (int t = 0; t < nthreads; t++) {
+      hs.push_back(new TH1D(Form("h_thread%d", t), "", cfg.nbins, cfg.xmin, cfg.xmax));
+      hs.back()->SetDirectory(0);
+      hs.back()->Sumw2(true);
+      fits.push_back(NewFitFunction(Form("fit_thread%d", t), cfg.xmin, cfg.xmax));
+   }
+
+   ParallelFor(nthreads, njobs, [&](int j, int t) { job(j, hs[t], fits[t]); });
+
+   // memory cleanup
+   for (int t = 0; t < nthreads; t++) {
+      delete hs[t];
+      delete fits[t];
+   }
+}
+
+//______________________________________________________________________________
+void reset_results(size_t ncorr)
+{
+   /* Prepares empty grMeans and grSigmas for ncorr corrections and resets
+    * statistics of fits.
+    */
+
+   // cleanup from previous execution
+   for (size_t c = 0; c < grMeans.size(); c++) {
+      delete grMeans[c];
+      delete grSigmas[c];
+   }
+
+   grMeans.clear();
+   grSigmas.clear();
+   gBlocks.assign(ncorr, vector<block_t>());
+
+   for (size_t c = 0; c < ncorr; c++) {
+      grMeans.push_back(new TGraphErrors());
+      grSigmas.push_back(new TGraphErrors());
+   }
+
+   gFitBlocks = 0;
+   gFitCalls = 0;
+   gFitWarm = 0;
+   gFitRefits = 0;
+   gFitRejected = 0;
+}
+
+//______________________________________________________________________________
+void collect_blocks(int c, const vector<block_t>& blocks, int nrefits,
+                    const char* title, const char* xtitle)
+{
+   /* Fills grMeans[c] and grSigmas[c] with results of fitted blocks of
+    * correction c, saves the fits (see SaveFits()) and adds statistics of
+    * fits. The blocks are kept in gBlocks[c] for diagnostics.
+    *
+    * Errors are bootstrap errors, if evaluated (see set_bootstrap()), and
+    * errors of fits otherwise; only the latter are used by the quality cut.
+    *
+    * NOTE: sigma = width/position.
+    */
+
+   TGraphErrors* grMean = grMeans[c];
+   TGraphErrors* grSigma = grSigmas[c];
+
+   int nblocks = blocks.size();
+   long ncalls = 0;
+   int nwarm = 0;
+
+   // counter of accepted blocks
+   int b0 = 0;
+
+   gBlocks[c] = blocks;
+
+   // collect results in block order
+   for (int b = 0; b < nblocks; b++) {
+      block_t& res = gBlocks[c][b];
+
+      ncalls += res.ncalls;
+      nwarm += res.warm;
+
+      // do not accept really bad fitting results
+      res.accepted = is_accepted(res);
+      if (res.accepted) {
+        double errMean = res.boot[0] > 0 ? res.boot[0] : res.err[1];
+        double errSigma = res.boot[1] > 0 ? res.boot[1] : res.err[2]/res.par[1];
+
+        grMean->SetPoint(b0, res.meanX, res.par[1]);
+        grMean->SetPointError(b0, res.sigmaX, errMean);
+
+        grSigma->SetPoint(b0, res.meanX, res.par[2]/res.par[1]);
+        grSigma->SetPointError(b0, res.sigmaX, errSigma);
+
+        b0++;
+      }
+   }
+
+   gFitBlocks += nblocks;
+   gFitCalls += ncalls;
+   gFitWarm += nwarm;
+   gFitRefits += nrefits;
+   gFitRejected += nblocks - b0;
+
+   if (gPreview > 0) {
+      const char* fmt = "   %s: %d blocks estimated (%d rejected)\n";
+      fprintf(stderr, fmt, title, nblocks, nblocks - b0);
+   } else if (gAdaptive > 0) {
+      const char* fmt = "   %s: %d adaptive blocks fitted (%d refits, %d rejected), %li Minuit calls\n";
+      fprintf(stderr, fmt, title, nblocks, nrefits, nblocks - b0, ncalls);
+   } else {
+      const char* fmt = "   %s: %d blocks fitted (%d warm-started, %d rejected), %li Minuit calls\n";
+      fprintf(stderr, fmt, title, nblocks, nwarm, nblocks - b0, ncalls);
+   }
+
+   // quality assurance; images are drawn only on request, see draw_fits_file()
+   SaveFits(blocks, Form("%s/fits/%s.root", gPlotsDir.c_str(), title), xtitle);
+}
+
+//______________________________________________________________________________
+void fit_blocks(int ncorr, int nblocks, int blockSize,
+                const std::function<void(int, int, vector<float>&, vector<float>&)>& get_block,
+                const vector<string>& titles, const char* xtitle, bool ranked = true)
+{
+    /* Fits distributions of blocks of data points for ncorr corrections,
+     * result is given in grMeans and grSigmas -- positions and widths vs X
+     * axis. get_block(c, b, bx, by) fills data points of block b of
+     * correction c, blocks are ordered by X axis and hold blockSize data
+     * points each, except for the last one.
+     *
+     * Blocks of all corrections are fitted by gNumThreads threads in chains
+     * of gWarmStart consecutive blocks (see set_warm_start()), results do not
+     * depend on the number of threads.
+     *
+     * ranked = false: blocks are not backed by an array of data points (out
+     * of core, see fit_slices_stream()), block_t::first/last are set to -1.
+     */
+
+   reset_results(ncorr);
+
+   vector<vector<block_t> > blocks(ncorr, vector<block_t>(nblocks));
+
+   // blocks within a chain are fitted sequentially, each starting from the
+   // result of the previous one
+   int chainSize = TMath::Max(1, gWarmStart);
+   int nchains = (nblocks + chainSize - 1)/chainSize;
+
+   TStopwatch timer;
+
+   fit_parallel(ncorr * nchains, [&](int job, TH1D* h, TF1* fit) {
+      vector<float> bx;
+      vector<float> by;
+
+      int c = job/nchains;
+      int b1 = (job % nchains) * chainSize;
+      int b2 = TMath::Min(nblocks, b1 + chainSize);
+
+      for (int b = b1; b < b2; b++) {
+         bx.clear();
+         by.clear();
+         get_block(c, b, bx, by);
+
+         const block_t* seed = (b > b1 ? &blocks[c][b - 1] : NULL);
+         fit_block(bx, by, h, fit, blocks[c][b], seed);
+
+         if (ranked) {
+            blocks[c][b].first = (Long64_t) b * blockSize;
+            blocks[c][b].last = blocks[c][b].first + by.size();
+         } else
+            blocks[c][b].first = blocks[c][b].last = -1;
+      }
+   });
+
+   gFitTime = timer.RealTime();
+
+   for (int c = 0; c < ncorr; c++)
+      collect_blocks(c, blocks[c], 0, titles[c].c_str(), xtitle);
+
+   fprintf(stderr, "   %d correction(s) fitted in %.1f s\n", ncorr, gFitTime);
+}
+
+//______________________________________________________________________________
+double block_precision(const block_t& res)
+{
+   /* Returns the larger of relative errors of fitted position and width of a
+    * block, infinity for unusable fits.
+    */
+
+   double m = res.err[1]/res.par[1];
+   double s = res.err[2]/res.par[2];
+
+   if (!(m > 0) || !(s > 0) || !std::isfinite(m) || !std::isfinite(s))
+      return INFINITY;
+
+   return TMath::Max(m, s);
+}
+
+//______________________________________________________________________________
+void fit_segment_adaptive(const std::function<void(size_t, size_t, vector<float>&, vector<float>&)>& get_range,
+                          size_t first, size_t last, int blockSize, TH1D* h, TF1* fit,
+                          vector<block_t>& blocks, int& nrefits)
+{
+   /* Splits data points [first, last) sorted by X axis into blocks of
+    * adaptive size, see set_adaptive(), and fits them one after another.
+    * get_range(i1, i2, bx, by) fills data points [i1, i2).
+    *
+    * Statistical errors scale as 1/sqrt(n), so the size of every block is
+    * predicted from the precision reached by the previous one, aiming at 0.9
+    * of the target. A block which misses the target is grown accordingly and
+    * refitted once, so at most one fit is discarded per block. Sizes stay
+    * within [blockSize/4, 8*blockSize].
+    */
+
+   size_t minSize = TMath::Max(1, blockSize/4);
+   size_t maxSize = 8 * (size_t) blockSize;
+
+   vector<float> bx;
+   vector<float> by;
+
+   size_t n = blockSize;
+
+   for (size_t pos = first; pos < last; ) {
+      block_t res;
+      int ncalls = 0;    // Minuit calls of discarded fits
+      double time = 0;   // wall time of discarded fits
+      bool grown = false;
+
+      while (true) {
+         n = TMath::Max(minSize, TMath::Min(maxSize, n));
+
+         // do not leave less than minSize data points behind
+         if (last - pos < n + minSize)
+            n = last - pos;
+
+         bx.clear();
+         by.clear();
+         get_range(pos, pos + n, bx, by);
+         fit_block(bx, by, h, fit, res);
+
+         double q = block_precision(res)/gAdaptive;
+
+         // grow the block, if the target precision is not reached
+         if (q > 1 && !grown && pos + n < last && n < maxSize) {
+            ncalls += res.ncalls;
+            time += res.time;
+            n = (size_t) ceil(n * TMath::Min(4., q * q/0.81));
+            nrefits++;
+            grown = true;
+            continue;
+         }
+
+         res.ncalls += ncalls;
+         res.time += time;
+         res.first = pos;
+         res.last = pos + n;
+         blocks.push_back(res);
+         pos += n;
+
+         // size of the next block; changes are limited by factor 2, as data
+         // vary smoothly along X axis
+         n = (size_t) ceil(n * TMath::Max(0.5, TMath::Min(2., q * q/0.81)));
+         break;
+      }
+   }
+}
+
+//______________________________________________________________________________
+void fit_blocks_adaptive(int ncorr, size_t siz,
+                         const std::function<void(int, size_t, size_t, vector<float>&, vector<float>&)>& get_range,
+                         int blockSize, const vector<string>& titles, const char* xtitle)
+{
+   /* Adaptive version of fit_blocks(): data points [0, siz) sorted by X axis
+    * are split into blocks by fit_segment_adaptive(), separately for every
+    * correction. get_range(c, i1, i2, bx, by) fills data points [i1, i2) of
+    * correction c.
+    *
+    * The axis is first cut into segments of about 32*blockSize data points,
+    * which are processed by gNumThreads threads, so results do not depend on
+    * the number of threads.
+    */
+
+   reset_results(ncorr);
+
+   int nsegments = TMath::Max(1, TMath::Nint(((double) siz)/(32. * blockSize)));
+
+   vector<vector<block_t> > segments(ncorr * nsegments);
+   vector<int> nrefits(ncorr * nsegments, 0);
+
+   TStopwatch timer;
+
+   fit_parallel(ncorr * nsegments, [&](int job, TH1D* h, TF1* fit) {
+      int c = job/nsegments;
+      int s = job % nsegments;
+
+      size_t first = siz * s/nsegments;
+      size_t last = siz * (s + 1)/nsegments;
+
+      auto get_range_c = [&](size_t i1, size_t i2, vector<float>& bx, vector<float>& by) {
+         get_range(c, i1, i2, bx, by);
+      };
+
+      fit_segment_adaptive(get_range_c, first, last, blockSize, h, fit, segments[job], nrefits[job]);
+   });
+
+   gFitTime = timer.RealTime();
+
+   for (int c = 0; c < ncorr; c++) {
+      // blocks in X order
+      vector<block_t> blocks;
+      int n = 0;
+
+      for (int s = 0; s < nsegments; s++) {
+         const vector<block_t>& seg = segments[c * nsegments + s];
+         blocks.insert(blocks.end(), seg.begin(), seg.end());
+         n += nrefits[c * nsegments + s];
+      }
+
+      collect_blocks(c, blocks, n, titles[c].c_str(), xtitle);
+   }
+
+   fprintf(stderr, "   %d correction(s) fitted in %.1f s\n", ncorr, gFitTime);
+}
+
+//______________________________________________________________________________
+void fit_slices_real(const slicing_t& data, int blockSize, const vector<string>& titles,
+                     const char* xtitle)
+{
+    /* Fits distributions of y of every correction in blocks of blockSize data
+     * points sorted by X axis, see fit_blocks(), or in blocks of adaptive
+     * size, see set_adaptive(). titles = titles of corrections.
+     *
+     * NOTE: data points are sorted once for all corrections, see
+     * make_slicing(), so blocks contain the same entries for all of them.
+     */
+
+   size_t siz = data.x.size();
+   if (siz < 1) FATAL("x.size() < 1");
+
+   int ncorr = data.y.size();
+   if ((int) titles.size() != ncorr)
+      FATAL("titles.size() != number of corrections");
+
+   auto get_range = [&](int c, size_t first, size_t last, vector<float>& bx, vector<float>& by) {
+      bx.assign(data.x.begin() + first, data.x.begin() + last);
+      by.assign(data.y[c].begin() + first, data.y[c].begin() + last);
+   };
+
+   if (gAdaptive > 0) {
+      fit_blocks_adaptive(ncorr, siz, get_range, blockSize, titles, xtitle);
+      return;
+   }
+
+   int nblocks = NumBlocks(siz, blockSize);
+
+   auto get_block = [&](int c, int b, vector<float>& bx, vector<float>& by) {
+      size_t first, last;
+      BlockRange(siz, blockSize, b, first, last);
+      get_range(c, first, last, bx, by);
+   };
+
+   fit_blocks(ncorr, nblocks, blockSize, get_block, titles, xtitle);
+}
+
+//______________________________________________________________________________
+void spill_blocks(vector<pair_t>& buffers, vector<vector<spill_chunk_t> >& chunks, FILE* fo)
+{
+   /* Appends block data from buffers to fo and releases the buffers. Location
+    * of the data is added to chunks.
+    */
+
+   for (size_t b = 0; b < buffers.size(); b++) {
+      size_t n = buffers[b].x.size();
+      if (n == 0) continue;
+
+      spill_chunk_t chunk;
+      chunk.offset = ftello(fo);
+      chunk.n = n;
+      chunks[b].push_back(chunk);
+
+      if (fwrite(&buffers[b].x.front(), sizeof(float), n, fo) != n ||
+          fwrite(&buffers[b].y.front(), sizeof(float), n, fo) != n)
+         FATAL("fwrite() failed");
+
+      buffers[b] = pair_t();
+   }
+}
+
+//______________________________________________________________________________
+void fit_slices_stream(int type, int blockSize, const char* title, const char* xtitle,
+                       double e1, double e2)
+{
+   /* Out-of-core version of fit_slices(): entries selected by fill_arrays()
+    * and by type, e1, e2 are read directly from the ntuple in two passes.
+    *
+    * The first pass fills a quantile sketch of X values (quantile_sketch.h),
+    * from which block boundaries are taken. The second pass routes entries
+    * into per-block buffers; buffers are spilled into a temporary file once
+    * they hold more than gStreamMemory MB. Blocks are then fitted one by one,
+    * see fit_blocks().
+    *
+    * Entries are ordered as in make_slicing(), boundaries of blocks deviate
+    * from the exact ones by at most gStreamError * blockSize entries.
+    */
+
+   const stream_source_t& src = gStreamSource;
+
+   TStopwatch timer;
+
+   // open root file
+   TFile* fi = TFile::Open(src.infile.c_str());
+   if (!fi || fi->IsZombie())
+      FATAL("TFile::Open() failed");
+
+   // get TTree with PFClusters
+   TTree* tree = dynamic_cast<TTree*>(fi->Get("ntuplizer/PFClusterTree"));
+   if (!tree) FATAL("TFile::Get() failed");
+
+   // add branches with outputs from MVAs
+   TFriendElement* fe = tree->AddFriend("ntuplizer/PFClusterTree", src.friendname.c_str());
+   if (!fe || !fe->GetTree())
+      FATAL("TTree::AddFriend() failed");
+
+   // disable all branches by default
+   tree->SetBranchStatus("*", 0);
+
+   // variables to be associated with the input tree branches
+   Int_t nVtx;
+   float mcE, mcPt, mcEta, pfE, pfEta, corr;
+
+   // associate necessary tree branches with variables
+   SetBranchAddress(tree, "mcE",   &mcE);
+   SetBranchAddress(tree, "pfE",   &pfE);
+   SetBranchAddress(tree, "pfEta", &pfEta);
+
+   if (type == 1)      SetBranchAddress(tree, "mcPt",  &mcPt);
+   else if (type == 2) SetBranchAddress(tree, "mcEta", &mcEta);
+   else if (type == 3) SetBranchAddress(tree, "nVtx",  &nVtx);
+   else if (type != 0) FATAL("invalid type");
+
+   if (!src.mva_branch.empty())
+      SetBranchAddress(tree, src.mva_branch.c_str(), &corr);
+
+   Long64_t nent = tree->GetEntriesFast();
+
+   // calls fn(key, y) for selected test entries, the same selection as in
+   // fill_arrays() and fit_slices()
+   auto loop = [&](const std::function<void(const slice_key_t&, float)>& fn) {
+      for (Long64_t ev = 1; ev < nent; ev += 2) {// NOTE: take only test events
+         if (tree->GetEntry(ev) <= 0)
+            FATAL("TTree::GetEntry() failed");
+
+         float resol = pfE/mcE;
+
+         // apply correction, if necessary
+         if (!src.mva_branch.empty())
+            resol *= corr;
+
+         // barrel vs endcaps (except for mcEta)
+         if (type != 2) {
+            if (src.isEE) {
+               if (fabs(pfEta) < 1.479)
+                  continue;
+            } else {
+               if (fabs(pfEta) > 1.479)
+                  continue;
+            }
+         }
+
+         // mcE region
+         if (type >= 2 && (mcE < e1 || mcE >= e2))
+            continue;
+
+         slice_key_t key;
+         key.ev = ev;
+
+         if (type == 0)      key.x = mcE;
+         else if (type == 1) key.x = mcPt;
+         else if (type == 2) key.x = mcEta;
+         else                key.x = (float) nVtx;
+
+         fn(key, resol);
+      } // event loop
+   };
+
+   // first pass: block boundaries;
+   // NOTE: the number of test entries is an upper limit of the number of
+   // selected entries, hence the sketch's rank error is below maxError
+   double maxError = gStreamError * blockSize;
+   QuantileSketch<slice_key_t> sketch(maxError/TMath::Max(1LL, nent/2));
+
+   loop([&](const slice_key_t& key, float) { sketch.Insert(key); });
+
+   Long64_t siz = sketch.Count();
+   if (siz < 1) FATAL("no entries selected");
+
+   int nblocks = NumBlocks(siz, blockSize);
+
+   // first entry of every block except block 0, and the first excluded entry
+   vector<slice_key_t> bounds;
+   for (int b = 1; b <= nblocks; b++)
+      if ((Long64_t) b * blockSize < siz)
+         bounds.push_back(sketch.Query((Long64_t) b * blockSize + 1));
+
+   // second pass: route entries into blocks
+   TString spillname = "draw_results_spill";
+   FILE* spill = gSystem->TempFileName(spillname);
+   if (!spill) FATAL("TSystem::TempFileName() failed");
+
+   vector<pair_t> buffers(nblocks);
+   vector<vector<spill_chunk_t> > chunks(nblocks);
+
+   size_t maxBuffered = (size_t) (gStreamMemory * 1024 * 1024/(2 * sizeof(float)));
+   size_t nbuffered = 0;
+
+   loop([&](const slice_key_t& key, float y) {
+      int b = upper_bound(bounds.begin(), bounds.end(), key) - bounds.begin();
+      if (b >= nblocks) return;
+
+      buffers[b].x.push_back(key.x);
+      buffers[b].y.push_back(y);
+
+      if (++nbuffered >= maxBuffered) {
+         spill_blocks(buffers, chunks, spill);
+         nbuffered = 0;
+      }
+   });
+
+   double spilled = (double) ftello(spill)/(1024 * 1024);
+
+   const char* fmt = "   %s: %lli entries streamed, %d blocks, boundaries within %.0f entries "
+                     "(%lu sketch samples), %.0f MB spilled, %.1f s\n";
+   fprintf(stderr, fmt, title, siz, nblocks, sketch.Error(), sketch.Size(), spilled,
+           timer.RealTime());
+
+   delete fi;
+
+   // block data: spilled chunks first, then what is left in memory
+   std::mutex spillMutex;
+   auto get_block = [&](int, int b, vector<float>& bx, vector<float>& by) {
+      for (size_t k = 0; k < chunks[b].size(); k++) {
+         const spill_chunk_t& chunk = chunks[b][k];
+         size_t n0 = bx.size();
+
+         bx.resize(n0 + chunk.n);
+         by.resize(n0 + chunk.n);
+
+         std::lock_guard<std::mutex> lock(spillMutex);
+         if (fseeko(spill, chunk.offset, SEEK_SET) != 0 ||
+             fread(&bx[n0], sizeof(float), chunk.n, spill) != chunk.n ||
+             fread(&by[n0], sizeof(float), chunk.n, spill) != chunk.n)
+            FATAL("fread() failed");
+      }
+
+      bx.insert(bx.end(), buffers[b].x.begin(), buffers[b].x.end());
+      by.insert(by.end(), buffers[b].y.begin(), buffers[b].y.end());
+
+      // memory cleanup
+      buffers[b] = pair_t();
+   };
+
+   // NOTE: blocks cannot be refitted by refit_blocks() later, since their
+   // entries are not kept anywhere
+   fit_blocks(1, nblocks, blockSize, get_block, vector<string>(1, title), xtitle, false);
+
+   fclose(spill);
+   gSystem->Unlink(spillname);
+}
+
+//______________________________________________________________________________
+const slicing_t& get_slicing(int type, int region)
+{
+   /* Returns data points filled by fill_arrays() for slicing type (see
+    * fit_slices()) and energy region.
+    */
+
+   // mcE
+   if (type == 0)
+      return gDataE;
+
+   // mcPt
+   if (type == 1)
+      return gDataPt;
+
+   if (type == 2 || type == 3) {
+      if (region < 0 || region >= (int) gDataEta.size())
+         FATAL("invalid energy region");
+
+      // mcEta or nVtx in mcE region
+      return type == 2 ? gDataEta[region] : gDataVtx[region];
+   }
+
+   FATAL("invalid type");
+   return gDataE;  // never reached
+}
+
+//______________________________________________________________________________
+void fit_slices(int type, int blockSize, const vector<string>& titles, const char* xtitle,
+                int region = -1)
+{
+   /* Steers work of fit_slices_real(): fits all corrections filled by
+    * fill_arrays(), titles = their titles. Results are given in grMeans and
+    * grSigmas.
+    *
+    * region = index of energy region for types 2 and 3, see set_eregions().
+    */
+
+   double e1 = 0, e2 = 0;
+   if (type == 2 || type == 3) {
+      if (region < 0 || region >= (int) gERegions.size())
+         FATAL("invalid energy region");
+
+      e1 = gERegions[region].first;
+      e2 = gERegions[region].second;
+   }
+
+   // out-of-core mode, see set_streaming()
+   if (gStreamMemory > 0) {
+      if (titles.size() != 1)
+         FATAL("out-of-core mode takes one correction at a time");
+      if (gPreview > 0)
+         FATAL("preview mode is not available out of core");
+
+      fit_slices_stream(type, blockSize, titles[0].c_str(), xtitle, e1, e2);
+      return;
+   }
+
+   fit_slices_real(get_slicing(type, region), blockSize, titles, xtitle);
+}
+
+//______________________________________________________________________________
+void fit_slices(int type, int blockSize, const char* title, const char* xtitle,
+                int region = -1)
+{
+   // Fits one correction filled by fill_arrays(), see above.
+
+   fit_slices(type, blockSize, vector<string>(1, title), xtitle, region);
+}
+
+//______________________________________________________________________________
+void refit_blocks(int type, int region, int c, const vector<Long64_t>& first,
+                  const vector<Long64_t>& last, const char* title)
+{
+   /* Refits blocks [first[i], last[i]) of data points of correction c in a
+    * slicing (see fit_slices()) with alternative strategies, see
+    * fit_block_retry(). Results are given in gRefits, in the order of
+    * blocks.
+    *
+    * Data points must be filled by fill_arrays() as for the original fits,
+    * so that [first, last) select the same entries. Not available out of
+    * core.
+    */
+
+   if (gStreamMemory > 0)
+      FATAL("refits are not available out of core");
+
+   const slicing_t& data = get_slicing(type, region);
+   if (c < 0 || c >= (int) data.y.size())
+      FATAL("invalid correction");
+
+   if (first.size() != last.size())
+      FATAL("first.size() != last.size()");
+
+   for (size_t i = 0; i < first.size(); i++)
+      if (first[i] < 0 || first[i] >= last[i] || last[i] > (Long64_t) data.x.size())
+         FATAL("invalid block range");
+
+   gRefits.assign(first.size(), block_t());
+
+   TStopwatch timer;
+
+   fit_parallel(first.size(), [&](int i, TH1D* h, TF1* fit) {
+      vector<float> bx(data.x.begin() + first[i], data.x.begin() + last[i]);
+      vector<float> by(data.y[c].begin() + first[i], data.y[c].begin() + last[i]);
+
+      block_t& res = gRefits[i];
+      fit_block_retry(bx, by, h, fit, res);
+
+      res.first = first[i];
+      res.last = last[i];
+      res.accepted = is_accepted(res);
+   });
+
+   int naccepted = 0;
+   for (size_t i = 0; i < gRefits.size(); i++)
+      naccepted += gRefits[i].accepted;
+
+   fprintf(stderr, "   %s: %d of %lu refitted blocks accepted in %.1f s\n", title, naccepted,
+           gRefits.size(), timer.RealTime());
+}
+
+//______________________________________________________________________________
+const vector<float>& map_column(const string& name)
+{
+   /* Returns column of gNtuple which can be mapped by fit_map().
+    */
+
+   if (name == "mcE")   return gNtuple.mcE;
+   if (name == "mcPt")  return gNtuple.mcPt;
+   if (name == "mcEta") return gNtuple.mcEta;
+   if (name == "nVtx")  return gNtuple.nVtx;
+   if (name == "pfE")   return gNtuple.pfE;
+   if (name == "pfEta") return gNtuple.pfEta;
+
+   FATAL(Form("unknown variable \"%s\"", name.c_str()));
+   return gNtuple.mcE;  // never reached
+}
+
+//______________________________________________________________________________
+void fit_map(const vector<string>& vars, int blockSize, const vector<string>& titles,
+             int layers = 1)
+{
+   /* Fits resolution in cells of about blockSize entries in two or three
+    * variables vars (see map_column()) for all corrections filled by
+    * fill_arrays(), titles = their titles.
+    *
+    * Cells are leaves of a k-d tree of equal-population splits, see
+    * BuildMap() in kd_map.h; with three variables, every one of the layers
+    * along the third variable is a 2-D map in the first two.
+    *
+    * Results are given in gLeaves and, per correction, in gBlocks (one block
+    * per leaf). Leaves of all corrections are fitted by gNumThreads threads.
+    */
+
+   if (gStreamMemory > 0)
+      FATAL("maps are not available out of core");
+
+   size_t ndim = vars.size();
+   if (ndim != 2 && ndim != 3)
+      FATAL("two or three variables expected");
+
+   int ncorr = gCorrections.size();
+   if ((int) titles.size() != ncorr)
+      FATAL("titles.size() != number of corrections");
+
+   if (gEntries.empty())
+      FATAL("no entries to map");
+
+   vector<const float*> cols;
+   for (size_t d = 0; d < ndim; d++)
+      cols.push_back(map_column(vars[d]).data());
+
+   TStopwatch timer;
+
+   gMapEntries = gEntries;
+   gLeaves = BuildMap(cols, gMapEntries, TMath::Max(1, blockSize), layers);
+
+   double timeTree = timer.RealTime();
+   timer.Start();
+
+   // fit leaves
+   reset_results(ncorr);
+
+   int nleaves = gLeaves.size();
+   vector<vector<block_t> > blocks(ncorr, vector<block_t>(nleaves));
+
+   fit_parallel(ncorr * nleaves, [&](int job, TH1D* h, TF1* fit) {
+      int c = job/nleaves;
+      const map_leaf_t& leaf = gLeaves[job % nleaves];
+
+      vector<float> bx;
+      vector<float> by;
+
+      for (size_t k = leaf.first; k < leaf.last; k++) {
+         size_t i = gMapEntries[k];
+         bx.push_back(cols[0][i]);
+         by.push_back(resolution(i, gCorrections[c]));
+      }
+
+      block_t& res = blocks[c][job % nleaves];
+      fit_block(bx, by, h, fit, res);
+
+      res.first = leaf.first;
+      res.last = leaf.last;
+   });
+
+   gFitTime = timer.RealTime();
+
+   for (int c = 0; c < ncorr; c++) {
+      long ncalls = 0;
+      int nrejected = 0;
+
+      for (int l = 0; l < nleaves; l++) {
+         block_t& res = blocks[c][l];
+         res.accepted = is_accepted(res);
+
+         ncalls += res.ncalls;
+         nrejected += !res.accepted;
+      }
+
+      gBlocks[c] = blocks[c];
+      gFitBlocks += nleaves;
+      gFitCalls += ncalls;
+      gFitRejected += nrejected;
+
+      fprintf(stderr, "   %s: %d cells fitted (%d rejected), %li Minuit calls\n", titles[c].c_str(),
+              nleaves, nrejected, ncalls);
+
+      // quality assurance, see draw_fits_file()
+      SaveFits(blocks[c], Form("%s/fits/%s.root", gPlotsDir.c_str(), titles[c].c_str()),
+               vars[0].c_str());
    }
 
-   else
-      FATAL("invalid type");
+   fprintf(stderr, "   k-d tree of %d cells built in %.2f s, %d correction(s) fitted in %.1f s\n",
+           nleaves, timeTree, ncorr, gFitTime);
 }
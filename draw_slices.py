@@ -7,13 +7,26 @@ from __future__ import division        # 1/2 = 0.5, not 0
 from __future__ import print_function  # print() syntax from python-3
 
 import os
-import pickle
+import sys
 import fnmatch
+import numpy as np
 import ROOT
 
+import result_cache
+import tree_columns
+from result_cache import Histo
+
 # for keeping drawed objects in memory
 saves = []
 
+# binning of the cubes of make_cube(): edges in true pT and reco |eta|, and
+# (nbins, xmin, xmax) in correction * pfE/mcE
+PT_EDGES = np.round(np.concatenate([np.arange(0, 1, 0.05), np.arange(1, 10, 0.5),
+                                    np.arange(10, 100.1, 5)]), 6)
+ETA_EDGES = np.round(np.concatenate([np.linspace(0, 1.479, 16),
+                                     np.linspace(1.479, 3, 17)[1:]]), 6)
+RATIO_BINS = (1000, 0, 2)
+
 def main():
     """Steering function.
     """
@@ -50,10 +63,13 @@ def main():
         if not os.access(d, os.X_OK):
             os.mkdir(d)
 
+    # cubes of all ntuples, shared by EB and EE
+    cubes = [make_cube(infile, mvas) for infile in infiles]
+
     # evaluate/draw shapes of pfE/mcE distributions per ntuple for EB/EE
     for (slices, det, custom) in zip([slicesEB, slicesEE], ['EB', 'EE'], [customEB, customEE]):
-        for (infile, sfx) in zip(infiles, sfxs):
-            r = [make_histos(infile, slices, mva) for mva in mvas]
+        for (cube, sfx) in zip(cubes, sfxs):
+            r = [slice_histos(cube, slices, k) for k in range(len(mvas))]
 
             # repack histograms into per-slice tuples
             r = list(zip(*r))
@@ -71,41 +87,26 @@ def main():
         c = canvases.At(i)
         c.SaveAs('output/plots_slices/slices_{0}.png'.format(c.GetTitle()))
 
-def make_histos(infile, regions, mva_branch_name):
-    """Fills requested energy resolution histograms.
-
-    Results are cached into file.
+def make_cube(infile, mvas):
+    """Fills cubes of test entries of ntuple infile in (true pT, reco |eta|,
+    correction * pfE/mcE), one cube per branch of mvas with MVA outputs
+    ('' = no correction), all of them in one pass over the ntuple.
 
-    regions = list of (true pt1, true pt2, reco |eta1|, reco |eta2|) tuples.
+    Histograms of any pt+eta slices are then summed from the cubes by
+    slice_histos(). Results are cached into file.
 
-    Empty mva_branch_name implies filling histograms without energy corrections.
+    Returns (pT edges, |eta| edges, list of cubes, [number of entries]).
     """
-    cache = {}
-
-    # load cache, if any
+    # return cached results, if any
     fname = os.path.basename(infile).replace('.root', '')
-    cachefile = 'output/cache/draw_slices_{0}.pkl'.format(fname)
-    if os.access(cachefile, os.R_OK):
-        with open(cachefile, 'rb') as f:
-            cache = pickle.load(f)
-
-    if mva_branch_name not in cache:
-        cache[mva_branch_name] = {}
-
-    cache1 = cache[mva_branch_name]
-
-    # return cached results if the cache exists for all pt+eta slices
-    try:
-        return [cache1[key] for key in regions]
-    except KeyError:
-        pass
-
-    tofill = {}
-
-    # prepare empty histograms
-    for key in regions:
-        if key not in cache1:
-            tofill[key] = ROOT.TH1D('h', '', 1000, 0, 2)
+    friend = 'output/friend_{0}.root'.format(fname)
+    name = 'draw_slices_{0}'.format(fname)
+    cachefile = result_cache.key(name, [infile, friend], [make_cube, ratio_bins, 'tree_columns.py'],
+                                 mvas=list(mvas), ptEdges=PT_EDGES.tolist(),
+                                 etaEdges=ETA_EDGES.tolist(), ratioBins=RATIO_BINS)
+    result = result_cache.load(cachefile)
+    if result is not None:
+        return result
 
     # get TTree with PFClusters
     fi = ROOT.TFile(infile)
@@ -114,44 +115,96 @@ def make_histos(infile, regions, mva_branch_name):
         raise Exception('TTree not found')
 
     # add branches with outputs from MVAs
-    tree.AddFriend('ntuplizer/PFClusterTree', 'output/friend_{0}.root'.format(fname))
+    tree.AddFriend('ntuplizer/PFClusterTree', friend)
+
+    # test events only; NOTE: true generated pT
+    exprs = ['mcPt', 'abs(pfEta)', 'pfE/mcE'] + [mva for mva in mvas if mva]
+    columns = tree_columns.read(tree, exprs, 'Entry$ % 2 == 1')
 
-    # fill histograms
-    for ev in range(1, tree.GetEntriesFast(), 2):  # test events only
-        if tree.GetEntry(ev) <= 0:
-            raise Exception
+    # NOTE: entries with non-finite pT or |eta| fall into no slice, as they
+    # fail every range cut; they are not filled, but count in normalization
+    good = np.isfinite(columns[0]) & np.isfinite(columns[1])
+    columns = [c[good] for c in columns]
 
-        # value of correction
-        if mva_branch_name:
-            corr = getattr(tree, mva_branch_name)
-        else:
-            corr = 1
+    (pt, aeta, ratio) = columns[:3]
+    corrs = iter(columns[3:])
 
-        pt    = tree.mcPt  # NOTE: true generated pT
-        aeta  = abs(tree.pfEta)
-        ratio = corr * tree.pfE / tree.mcE
+    # bins of entries; 0 = underflow, len(edges) = overflow
+    ipt = np.searchsorted(PT_EDGES, pt, side='right')
+    ieta = np.searchsorted(ETA_EDGES, aeta, side='right')
 
-        for (pt1, pt2, aeta1, aeta2) in tofill:
-            if pt1 <= pt < pt2 and aeta1 <= aeta < aeta2:
-                tofill[(pt1, pt2, aeta1, aeta2)].Fill(ratio)
+    shape = (len(PT_EDGES) + 1, len(ETA_EDGES) + 1, RATIO_BINS[0] + 2)
 
-    # normalization
-    for h in tofill.values():
-        h.Scale(1/tree.GetEntriesFast())
+    cubes = []
+    for mva in mvas:
+        corr = next(corrs) if mva else 1
+        ind = np.ravel_multi_index((ipt, ieta, ratio_bins(corr * ratio)), shape)
+        cubes.append(np.bincount(ind, minlength=np.prod(shape)).reshape(shape).astype(np.uint32))
 
-    # update cache
-    for (key, item) in tofill.items():
-        cache1[key] = item
+    # NOTE: normalized to all entries, see slice_histos()
+    result = (PT_EDGES, ETA_EDGES, cubes, np.array([tree.GetEntriesFast()], dtype=float))
 
-    # save updated cache
-    with open(cachefile, 'wb') as f:
-        pickle.dump(cache, f)
+    # save cache
+    result_cache.save(cachefile, result)
+
+    return result
+
+def ratio_bins(x):
+    """Returns bins of TH1D booked with RATIO_BINS which values x fall into,
+    the same as TAxis::FindFixBin() (NaN goes to overflow).
+    """
+    (n, xmin, xmax) = RATIO_BINS
 
-    return [cache1[key] for key in regions]
+    with np.errstate(invalid='ignore'):
+        b = 1 + np.floor(n * (x - xmin)/(xmax - xmin))
+        b = np.where(x < xmin, 0, np.where(x < xmax, b, n + 1))
+
+    return b.astype(int)
+
+def slice_histos(cube, regions, k):
+    """Returns energy resolution histograms of k-th correction of cube, see
+    make_cube(), normalized to the number of entries.
+
+    regions = list of (true pt1, true pt2, reco |eta1|, reco |eta2|) tuples;
+    boundaries snap to the nearest edges of the cube binning.
+    """
+    (ptEdges, etaEdges, counts, entries) = cube
+    (n, xmin, xmax) = RATIO_BINS
+
+    edges = np.linspace(xmin, xmax, n + 1)
+
+    result = []
+    for (pt1, pt2, aeta1, aeta2) in regions:
+        ipt = edge_range(ptEdges, pt1, pt2)
+        ieta = edge_range(etaEdges, aeta1, aeta2)
+
+        c = counts[k][ipt, ieta].sum(axis=(0, 1)).astype(float)
+        result.append(Histo(edges, c/entries[0], np.sqrt(c)/entries[0]))
+
+    return result
+
+def edge_range(edges, x1, x2):
+    """Returns slice of cube bins (0 = underflow) between the edges nearest to
+    x1 and x2; x1 below the first edge or x2 beyond the last edge takes the
+    underflow or overflow too.
+    """
+    def nearest(x):
+        i = int(np.argmin(abs(edges - x)))
+        if not np.isclose(edges[i], x):
+            print('draw_slices: boundary {0} snapped to {1}'.format(x, edges[i]), file=sys.stderr)
+        return i
+
+    i1 = 0 if x1 < edges[0] else nearest(x1) + 1
+    i2 = len(edges) + 1 if x2 > edges[-1] else nearest(x2) + 1
+
+    return slice(i1, i2)
 
 def combine(histos, txts, cname, title, xtitle, rebin=1, xmin=0, xmax=-1, logY=False):
     """Visualization of several histograms on single canvas.
     """
+    # ROOT objects from cached arrays
+    histos = [result_cache.to_root(h) for h in histos]
+
     # rebin histograms, if requested
     if rebin > 1:
         for h in histos:
@@ -0,0 +1,156 @@
+/* Function to fit distributions of Erec/Etrue (or Etrue/Erec) with: Gaussian
+ * core + power-law tail on one side + exponential tail on the other side.
+ *
+ * Compiled replacement of the TFormula expression used before, with analytic
+ * gradients with respect to parameters (fit option "G"). Shared by
+ * draw_results_helper.cc, draw_mva_pars.cc and auxiliary/draw_fit_params.py.
+ */
+
+#ifndef FIT_SHAPE_H
+#define FIT_SHAPE_H
+
+#include <cmath>
+
+#include <TF1.h>
+
+//______________________________________________________________________________
+inline double TailShapeCore(double t, double aPow, double nPow, double aExp, double* d = 0)
+{
+   /* Evaluates the shape in units t = (x - mean)/sigma: power-law tail for
+    * t <= -aPow, Gaussian core for -aPow < t < aExp, exponential tail for
+    * t >= aExp. The function is continuous and smooth at both junctions.
+    *
+    * If d is given, d[0..3] = derivatives with respect to t, aPow, nPow and
+    * aExp.
+    */
+
+   // power-law tail
+   if (t <= -aPow) {
+      double w = nPow/aPow - aPow - t;
+      double g = pow(nPow/aPow, nPow) * exp(-0.5 * aPow * aPow) * pow(w, -nPow);
+
+      if (d) {
+         d[0] = g * nPow/w;
+         d[1] = g * (-nPow/aPow - aPow + nPow * (nPow/(aPow * aPow) + 1)/w);
+         d[2] = g * (log(nPow/aPow) + 1 - log(w) - nPow/(aPow * w));
+         d[3] = 0;
+      }
+
+      return g;
+   }
+
+   // Gaussian core
+   if (t < aExp) {
+      double g = exp(-0.5 * t * t);
+
+      if (d) {
+         d[0] = -t * g;
+         d[1] = d[2] = d[3] = 0;
+      }
+
+      return g;
+   }
+
+   // exponential tail
+   double g = exp(0.5 * aExp * aExp - aExp * t);
+
+   if (d) {
+      d[0] = -aExp * g;
+      d[1] = d[2] = 0;
+      d[3] = (aExp - t) * g;
+   }
+
+   return g;
+}
+
+//______________________________________________________________________________
+struct TailShape {
+   /* Functor with 6 parameters: [0] = amplitude, [1] = mean, [2] = sigma,
+    * [3]-[5] = tails.
+    *
+    * powerLawOnRight = false: tails are [3] = alpha and [4] = power of the left
+    * power-law tail, [5] = alpha of the right exponential tail (layout of
+    * draw_results_helper.cc and draw_mva_pars.cc);
+    *
+    * powerLawOnRight = true: tails are [3] = alpha of the left exponential
+    * tail, [4] = alpha and [5] = power of the right power-law tail (layout of
+    * auxiliary/draw_fit_params.py).
+    */
+
+   bool powerLawOnRight;
+
+   TailShape(bool right = false) : powerLawOnRight(right) {}
+
+   // indices of tail parameters
+   int iPow() const { return powerLawOnRight ? 4 : 3; }
+   int iN()   const { return powerLawOnRight ? 5 : 4; }
+   int iExp() const { return powerLawOnRight ? 3 : 5; }
+
+   // mirror for the power-law tail on the right
+   double sign() const { return powerLawOnRight ? -1 : 1; }
+
+   double operator()(const double* x, const double* p) const
+   {
+      double t = sign() * (x[0] - p[1])/p[2];
+      return p[0] * TailShapeCore(t, p[iPow()], p[iN()], p[iExp()]);
+   }
+
+   void Gradient(const double* x, const double* p, double* grad) const
+   {
+      double t = sign() * (x[0] - p[1])/p[2];
+
+      double d[4];
+      double g = TailShapeCore(t, p[iPow()], p[iN()], p[iExp()], d);
+
+      grad[0] = g;
+      grad[1] = -p[0] * d[0] * sign()/p[2];
+      grad[2] = -p[0] * d[0] * t/p[2];
+      grad[iPow()] = p[0] * d[1];
+      grad[iN()] = p[0] * d[2];
+      grad[iExp()] = p[0] * d[3];
+   }
+};
+
+//______________________________________________________________________________
+class TailShapeTF1 : public TF1 {
+   /* TF1 of TailShape which supplies analytic parameter gradients.
+    */
+
+public:
+   TailShapeTF1() : TF1(), fShape() {}
+
+   TailShapeTF1(const char* name, double xmin, double xmax, bool powerLawOnRight = false)
+      : TF1(name, TailShape(powerLawOnRight), xmin, xmax, 6), fShape(powerLawOnRight) {}
+
+   using TF1::GradientPar;
+
+   virtual Double_t GradientPar(Int_t ipar, const Double_t* x, Double_t /*eps*/ = 0.01)
+   {
+      double grad[6];
+      fShape.Gradient(x, GetParameters(), grad);
+      return grad[ipar];
+   }
+
+   virtual void GradientPar(const Double_t* x, Double_t* grad, Double_t /*eps*/ = 0.01)
+   {
+      fShape.Gradient(x, GetParameters(), grad);
+   }
+
+   virtual void Copy(TObject& obj) const
+   {
+      TF1::Copy(obj);
+
+      // without ClassDef(), IsA() is that of TF1 and the target of a clone
+      // (e.g. the copy stored by TH1::Fit()) may be a plain TF1
+      TailShapeTF1* f = dynamic_cast<TailShapeTF1*>(&obj);
+      if (f) f->fShape = fShape;
+   }
+
+private:
+   TailShape fShape;
+
+   // NOTE: no ClassDef(): the class is never streamed, and ACLiC generates
+   // dictionaries only for classes of the compiled macro, not of its headers
+};
+
+#endif
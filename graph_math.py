@@ -0,0 +1,102 @@
+"""Vectorized arithmetic on graphs for the draw_*.py scripts.
+
+Graphs are handled as (x, y, ex, ey) arrays, see result_cache.Graph; arrays()
+turns a TGraphErrors into NumPy views of its own memory without copying.
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import numpy as np
+
+from result_cache import Graph
+
+def arrays(gr):
+    """Returns Graph with arrays of points and errors of a TGraphErrors.
+
+    NOTE: arrays are views of memory of gr, so gr must be kept alive while
+    they are in use. Graph is returned as is.
+    """
+    if isinstance(gr, Graph):
+        return gr
+
+    n = gr.GetN()
+    return Graph(*[_view(buf, n) for buf in (gr.GetX(), gr.GetY(), gr.GetEX(), gr.GetEY())])
+
+def _view(buf, n):
+    """Returns NumPy view of a PyROOT buffer of n doubles.
+    """
+    if n == 0:
+        return np.zeros(0)
+
+    # buffers of PyROOT before ROOT 6.22 do not know their size
+    if hasattr(buf, 'SetSize'):
+        buf.SetSize(n)
+
+    return np.frombuffer(buf, dtype=np.float64, count=n)
+
+def bounds(grs):
+    """Returns (xmin, xmax, ymin, ymax) over all points of graphs grs.
+    """
+    grs = [arrays(gr) for gr in grs]
+    x = np.concatenate([gr.x for gr in grs])
+    y = np.concatenate([gr.y for gr in grs])
+
+    return (x.min(), x.max(), y.min(), y.max())
+
+def interpolate(gr, x):
+    """Returns (y, ey) arrays of graph gr at points x.
+
+    y and ey are linearly interpolated between the nearest points of gr
+    which surround x. Values of the first (last) point of gr are taken for x
+    before (after) all points.
+
+    NOTE: points of gr must be sorted in x.
+    """
+    gr = arrays(gr)
+    x = np.asarray(x, dtype=np.float64)
+    n = len(gr.x)
+
+    # values at edges
+    before = x < gr.x[0]
+    y = np.where(before, gr.y[0], gr.y[n - 1])
+    ey = np.where(before, gr.ey[0], gr.ey[n - 1])
+
+    if n < 2:
+        return (y, ey)
+
+    # index j of the interval gr.x[j] <= x < gr.x[j + 1]
+    j = np.searchsorted(gr.x, x, side='right') - 1
+    inside = (j >= 0) & (j < n - 1)
+    j = np.clip(j, 0, n - 2)
+
+    x1 = gr.x[j]
+    x2 = gr.x[j + 1]
+
+    # NOTE: x1 == x2 happens only outside, where values are discarded
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (gr.y[j] - gr.y[j + 1]) / (x1 - x2)
+        b = gr.y[j] - a * x1
+
+        ea = (gr.ey[j] - gr.ey[j + 1]) / (x1 - x2)
+        eb = gr.ey[j] - ea * x1
+
+        y = np.where(inside, a * x + b, y)
+        ey = np.where(inside, ea * x + eb, ey)
+
+    return (y, ey)
+
+def ratio(num, den):
+    """Returns Graph num/den.
+
+    den is evaluated at points of num with interpolate(), x errors of num are
+    kept, relative y errors are added in quadrature.
+    """
+    num = arrays(num)
+    (y2, ey2) = interpolate(den, num.x)
+
+    y = num.y / y2
+    ey = y * np.sqrt((num.ey / num.y)**2 + (ey2 / y2)**2)
+
+    return Graph(np.array(num.x), y, np.array(num.ex), ey)
@@ -0,0 +1,119 @@
+/* Cells of equal population in two or three variables for resolution maps:
+ * entries are split at medians, alternately along the variables, by a k-d
+ * tree whose leaves are the cells.
+ *
+ * Used by fit_map() of draw_results_helper.cc. Columns are passed as pointers,
+ * as in slice_fit.h, and no ROOT class is needed, so that the partition can be
+ * checked on its own, see auxiliary/check_kd_map.cc.
+ */
+
+#ifndef KD_MAP_H
+#define KD_MAP_H
+
+#include <algorithm>
+#include <cstddef>
+#include <vector>
+
+// leaf of the k-d tree: box in the mapped variables
+struct map_leaf_t {
+   size_t first, last;   // entries[first..last) of BuildMap()
+   double lo[3], hi[3];  // box, per variable
+   int layer;            // layer along the third variable, 0 for two variables
+};
+
+//______________________________________________________________________________
+inline void SplitMap(const std::vector<const float*>& cols, std::vector<size_t>& entries,
+                     const map_leaf_t& node, int depth, int layerDepth, size_t blockSize,
+                     std::vector<map_leaf_t>& leaves)
+{
+   /* Splits entries[node.first..node.last) of a node of the k-d tree into
+    * halves of equal population, recursively, until nodes have less than
+    * 2*blockSize entries; leaves are appended to leaves.
+    *
+    * The first layerDepth levels split along the third variable, the next
+    * ones alternate between the first two. Every level costs O(n), there are
+    * O(log n) of them.
+    */
+
+   size_t n = node.last - node.first;
+   bool layerLevel = depth < layerDepth;
+
+   if (n < 2 || (!layerLevel && n < 2 * blockSize)) {
+      leaves.push_back(node);
+      return;
+   }
+
+   int dim = layerLevel ? 2 : (depth - layerDepth) % 2;
+   const float* col = cols[dim];
+
+   // median along dim
+   size_t mid = node.first + n/2;
+   std::nth_element(entries.begin() + node.first, entries.begin() + mid,
+                    entries.begin() + node.last,
+                    [col](size_t i, size_t j) { return col[i] < col[j]; });
+   double split = col[entries[mid]];
+
+   map_leaf_t left = node;
+   left.last = mid;
+   left.hi[dim] = split;
+
+   map_leaf_t right = node;
+   right.first = mid;
+   right.lo[dim] = split;
+
+   if (layerLevel) {
+      left.layer = 2 * node.layer;
+      right.layer = 2 * node.layer + 1;
+   }
+
+   SplitMap(cols, entries, left, depth + 1, layerDepth, blockSize, leaves);
+   SplitMap(cols, entries, right, depth + 1, layerDepth, blockSize, leaves);
+}
+
+//______________________________________________________________________________
+inline std::vector<map_leaf_t> BuildMap(const std::vector<const float*>& cols,
+                                        std::vector<size_t>& entries, size_t blockSize,
+                                        int layers = 1)
+{
+   /* Returns leaves of the k-d tree of entries (indices into columns cols of
+    * two or three variables) with about blockSize entries per leaf; entries
+    * are reordered, so that every leaf is a range of them.
+    *
+    * With three variables, the tree first splits along the third one into
+    * layers (their number is rounded up to a power of 2), so that every layer
+    * is a 2-D map in the first two variables. Building the tree takes
+    * O(n log n) time and no memory besides entries.
+    */
+
+   size_t ndim = cols.size();
+
+   int layerDepth = 0;
+   if (ndim == 3)
+      while ((1 << layerDepth) < layers)
+         layerDepth++;
+
+   // root box
+   map_leaf_t root;
+   root.first = 0;
+   root.last = entries.size();
+   root.layer = 0;
+
+   for (size_t d = 0; d < 3; d++) {
+      root.lo[d] = root.hi[d] = 0;
+      if (d >= ndim || entries.empty())
+         continue;
+
+      const float* col = cols[d];
+      auto range = std::minmax_element(entries.begin(), entries.end(),
+                                       [col](size_t i, size_t j) { return col[i] < col[j]; });
+      root.lo[d] = col[*range.first];
+      root.hi[d] = col[*range.second];
+   }
+
+   std::vector<map_leaf_t> leaves;
+   SplitMap(cols, entries, root, 0, layerDepth, std::max<size_t>(1, blockSize), leaves);
+
+   return leaves;
+}
+
+#endif
@@ -0,0 +1,149 @@
+"""Incremental aggregation of histograms over production batches of samples.
+
+A sample is either a single ntuple input/<sample>.root or a directory
+input/<sample>/ with ntuples of several production batches, see
+find_samples(). Histograms of a sample are sums of partial histograms of its
+ntuples, see aggregate():
+
+    - partials are cached per ntuple with result_cache, i.e. by contents of
+      the ntuple and source code, so that only ntuples which are new or have
+      changed are read when a batch lands;
+    - output/cache/<name>.manifest keeps provenance of every sum: path, size,
+      modification time and digest of each ntuple and the cache file of its
+      partial;
+    - partials of ntuples which have disappeared or changed, or of outdated
+      code, are removed as soon as the sum no longer includes them.
+
+Partials are (nested tuples/lists of) Histo and NumPy arrays, e.g. numbers of
+entries for normalization, see add() and scale().
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import os
+import sys
+import pickle
+import fnmatch
+
+import numpy as np
+
+import result_cache
+from result_cache import Histo
+
+def find_samples(indir='input', batches=True):
+    """Returns list of (sample, ntuples) in directory indir, sorted by name of
+    samples: ntuples <sample>.root are samples of their own, ntuples inside a
+    subdirectory <sample> are production batches of one sample.
+
+    batches = False: subdirectories are skipped, e.g. for scripts which need
+    friends with MVA outputs; runall.sh trains and evaluates MVAs only for
+    ntuples input/*.root.
+    """
+    samples = []
+
+    for f in sorted(os.listdir(indir)):
+        path = os.path.join(indir, f)
+
+        if os.path.isdir(path):
+            if not batches:
+                continue
+
+            batches = sorted(fnmatch.filter(os.listdir(path), '*.root'))
+            if batches:
+                samples.append((f, [os.path.join(path, b) for b in batches]))
+
+        elif fnmatch.fnmatch(f, '*.root'):
+            samples.append((f[:-len('.root')], [path]))
+
+    return samples
+
+def aggregate(name, infiles, fill, sources=(), inputs=None, **params):
+    """Returns sum of partial results fill(infile, **params) over ntuples
+    infiles, see the module documentation.
+
+    sources = code the partials depend on besides fill() (file names or
+    functions), inputs(infile) = files the partial of infile depends on
+    (default: infile only), params = parameters of fill(), also used as keys
+    of cached partials.
+    """
+    manifestfile = os.path.join(result_cache.CACHE_DIR, name + '.manifest')
+    sources = [fill] + list(sources)
+
+    try:
+        with open(manifestfile, 'rb') as f:
+            old = pickle.load(f)
+    except (IOError, OSError, EOFError):
+        old = {}
+
+    manifest = {}
+    total = None
+    nfilled = 0
+
+    for infile in infiles:
+        deps = inputs(infile) if inputs else [infile]
+
+        base = os.path.basename(infile).replace('.root', '')
+        cachefile = result_cache.key('{0}_{1}'.format(name, base), deps, sources, **params)
+
+        partial = result_cache.load(cachefile)
+        if partial is None:
+            partial = fill(infile, **params)
+            result_cache.save(cachefile, partial)
+            nfilled += 1
+
+        total = partial if total is None else add(total, partial)
+
+        # provenance: (path, size, modification time, digest) of inputs
+        prov = []
+        for path in deps:
+            st = os.stat(path)
+            prov.append((path, st.st_size, st.st_mtime, result_cache.file_digest(path)))
+
+        manifest[os.path.abspath(infile)] = {'partial': cachefile, 'inputs': prov}
+
+    # drop partials which are not a part of the sum anymore
+    ndropped = 0
+    for (path, entry) in old.items():
+        if path in manifest and manifest[path]['partial'] == entry['partial']:
+            continue
+
+        try:
+            os.remove(entry['partial'])
+        except OSError:  # evicted or removed by hand
+            pass
+
+        ndropped += 1
+
+    result_cache.write_atomically(manifestfile, manifest)
+
+    if nfilled or ndropped:
+        fmt = '{0}: {1} ntuple(s), {2} filled, {3} partial(s) dropped'
+        print(fmt.format(name, len(infiles), nfilled, ndropped), file=sys.stderr)
+
+    return total
+
+def add(a, b):
+    """Returns sum of partials a and b with the same layout.
+
+    Contents of Histo are added, errors are added in quadrature.
+    """
+    if isinstance(a, Histo):
+        if not np.array_equal(a.edges, b.edges):
+            raise ValueError('cannot add histograms with different binning')
+
+        return Histo(a.edges, a.contents + b.contents, np.hypot(a.errors, b.errors))
+
+    if isinstance(a, (tuple, list)):
+        return type(a)(add(x, y) for (x, y) in zip(a, b))
+
+    if isinstance(a, np.ndarray):
+        return a + b
+
+    raise TypeError('cannot add {0}'.format(type(a).__name__))
+
+def scale(h, c):
+    """Returns Histo h with contents and errors multiplied by c.
+    """
+    return Histo(h.edges, h.contents * c, h.errors * abs(c))
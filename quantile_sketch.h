@@ -0,0 +1,186 @@
+/* Streaming quantile sketch for equal-population slicing of samples larger
+ * than memory, see fit_slices_stream() in draw_results_helper.cc.
+ *
+ * Greenwald-Khanna summary (SIGMOD 2001) with buffered insertions: a sorted
+ * subset of inserted values is kept together with bounds of their ranks.
+ * Rank queries are answered with a value whose true rank differs from the
+ * requested one by at most Error() <= eps * N entries, N = number of inserted
+ * values. Memory is O(1/eps * log(eps * N)) instead of O(N).
+ *
+ * No ROOT dependencies.
+ */
+
+#ifndef QUANTILE_SKETCH_H
+#define QUANTILE_SKETCH_H
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+template <class T>
+class QuantileSketch {
+public:
+   //______________________________________________________________________________
+   explicit QuantileSketch(double eps, size_t bufferSize = 50000)
+      : fEps(eps), fBufferSize(bufferSize), fCount(0)
+   {
+      /* eps = relative rank error, bufferSize = number of values to collect
+       * before they are merged into the summary.
+       */
+   }
+
+   //______________________________________________________________________________
+   void Insert(const T& value)
+   {
+      fBuffer.push_back(value);
+
+      if (fBuffer.size() >= fBufferSize)
+         Flush();
+   }
+
+   //______________________________________________________________________________
+   long long Count() const
+   {
+      /* Returns number of inserted values.
+       */
+
+      return fCount + fBuffer.size();
+   }
+
+   //______________________________________________________________________________
+   size_t Size()
+   {
+      /* Returns number of values kept by the summary.
+       */
+
+      Flush();
+      return fSamples.size();
+   }
+
+   //______________________________________________________________________________
+   double Error()
+   {
+      /* Returns maximum difference between requested and true ranks of values
+       * returned by Query(), in number of entries.
+       */
+
+      Flush();
+
+      long long maxWidth = 0;
+      for (size_t i = 0; i < fSamples.size(); i++)
+         maxWidth = std::max(maxWidth, fSamples[i].g + fSamples[i].delta);
+
+      return 0.5 * maxWidth;
+   }
+
+   //______________________________________________________________________________
+   T Query(long long rank)
+   {
+      /* Returns value of rank "rank" = 1..Count() in ascending order.
+       */
+
+      Flush();
+
+      double err = Error();
+
+      // find sample whose rank bounds are within err of rank
+      long long rmin = 0;
+      for (size_t i = 0; i + 1 < fSamples.size(); i++) {
+         rmin += fSamples[i].g;
+         long long rmax = rmin + fSamples[i].delta;
+
+         if (rmax - err <= rank && rank <= rmin + err)
+            return fSamples[i].value;
+      }
+
+      return fSamples.back().value;
+   }
+
+private:
+   struct sample_t {
+      T value;
+      long long g;      // rmin(this) - rmin(previous)
+      long long delta;  // rmax(this) - rmin(this)
+   };
+
+   //______________________________________________________________________________
+   void Flush()
+   {
+      /* Merges buffered values into the summary and compresses it.
+       */
+
+      if (fBuffer.empty())
+         return;
+
+      std::sort(fBuffer.begin(), fBuffer.end());
+
+      std::vector<sample_t> merged;
+      merged.reserve(fSamples.size() + fBuffer.size());
+
+      size_t s = 0;
+      for (size_t i = 0; i < fBuffer.size(); i++) {
+         while (s < fSamples.size() && !(fBuffer[i] < fSamples[s].value))
+            merged.push_back(fSamples[s++]);
+
+         // rank of new minimum/maximum is known exactly
+         bool edge = merged.empty() || (s == fSamples.size() && i + 1 == fBuffer.size());
+
+         sample_t smp;
+         smp.value = fBuffer[i];
+         smp.g = 1;
+         smp.delta = edge ? 0 : (long long) floor(2 * fEps * fCount);
+         merged.push_back(smp);
+
+         fCount++;
+      }
+
+      while (s < fSamples.size())
+         merged.push_back(fSamples[s++]);
+
+      fBuffer.clear();
+      fSamples.swap(merged);
+
+      Compress();
+   }
+
+   //______________________________________________________________________________
+   void Compress()
+   {
+      /* Merges neighbouring samples while rank bounds allow, from right to
+       * left; the first and the last samples (minimum, maximum) are kept.
+       */
+
+      if (fSamples.size() < 3)
+         return;
+
+      double threshold = 2 * fEps * fCount;
+
+      std::vector<sample_t> res;
+      res.reserve(fSamples.size());
+
+      sample_t head = fSamples.back();
+      for (size_t i = fSamples.size() - 2; i >= 1; i--) {
+         if (fSamples[i].g + head.g + head.delta < threshold)
+            head.g += fSamples[i].g;
+         else {
+            res.push_back(head);
+            head = fSamples[i];
+         }
+      }
+
+      res.push_back(head);
+      res.push_back(fSamples.front());
+
+      std::reverse(res.begin(), res.end());
+      fSamples.swap(res);
+   }
+
+   double fEps;
+   size_t fBufferSize;
+   long long fCount;  // number of values merged into fSamples
+
+   std::vector<T> fBuffer;
+   std::vector<sample_t> fSamples;
+};
+
+#endif
@@ -0,0 +1,146 @@
+"""Resolution maps of draw_results.py: resolution is fitted in cells of equal
+population in two or three variables, see fit_map() in draw_results_helper.cc
+and the k-d tree of the cells in kd_map.h, and drawn as TH2Poly.
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import os
+import numpy as np
+import ROOT
+
+import result_cache
+
+# for keeping drawed ROOT objects in memory
+saves = []
+
+# cells of resolution maps, see map_table(); lo, hi = box per variable
+MAP_CELLS = [('layer', 'i4'), ('lo', 'f8', (3,)), ('hi', 'f8', (3,)), ('entries', 'i8'),
+             ('accepted', '?'), ('mean', 'f8'), ('errMean', 'f8'), ('sigma', 'f8'), ('errSigma', 'f8')]
+
+# variables of resolution maps and their axis titles, see map_column() in
+# draw_results_helper.cc
+MAP_VARS = {'mcE': 'E^{gen}', 'mcPt': 'p_{T}^{gen}', 'mcEta': '#eta^{gen}', 'nVtx': 'nVtx',
+            'pfE': 'E^{rec}', 'pfEta': '#eta^{rec}'}
+
+
+def make_maps(infile, det, branches, mapvars, blockSize, layers):
+    """Fills and fits maps of resolution in variables mapvars for corrections
+    from branches, see fit_map() in draw_results_helper.cc; returns list of
+    tables of cells, see map_table().
+
+    Results are cached into files, one per correction, keyed as in
+    make_graphs() of draw_results.py.
+    """
+    fname = os.path.basename(infile).replace('.root', '')
+    friend = 'output/friend_{0}.root'.format(fname)
+
+    cachefiles = []
+    for branch in branches:
+        name = 'draw_results_map_{0}_{1}_{2}_{3}_{4}'.format(fname, det, branch, '-'.join(mapvars), blockSize)
+        cachefiles.append(result_cache.key(name, [infile, friend],
+                                           ['resolution_maps.py', 'draw_results_helper.cc',
+                                            'fit_shape.h', 'kd_map.h', 'quantile_sketch.h',
+                                            'slice_fit.h'],
+                                           layers=layers if len(mapvars) == 3 else 1,
+                                           preview=(ROOT.gPreview, ROOT.gPreviewEstimator),
+                                           bootstrap=ROOT.gBootstrap))
+
+    results = [result_cache.load(f) for f in cachefiles]
+    todo = [c for (c, result) in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    ROOT.fill_arrays(infile, friend, string_vector([branches[c] for c in todo]),
+                     True if det == 'EE' else False)
+
+    titles = ['map_{0}_{1}_{2}_{3}'.format('-'.join(mapvars), fname, det, branches[c]) for c in todo]
+    ROOT.fit_map(string_vector(mapvars), blockSize, string_vector(titles), layers)
+
+    for (k, c) in enumerate(todo):
+        results[c] = map_table(ROOT.gLeaves, ROOT.gBlocks[k])
+        result_cache.save(cachefiles[c], results[c])
+
+    return results
+
+def map_table(leaves, blocks):
+    """Returns table of cells of a resolution map from leaves of the k-d tree
+    and fitted blocks of one correction, see MAP_CELLS.
+
+    Errors are taken as in collect_blocks() in draw_results_helper.cc.
+    """
+    table = np.zeros(len(leaves), dtype=MAP_CELLS)
+
+    for (l, (leaf, res)) in enumerate(zip(leaves, blocks)):
+        errMean = res.boot[0] if res.boot[0] > 0 else res.err[1]
+        errSigma = res.boot[1] if res.boot[1] > 0 else res.err[2]/res.par[1]
+
+        table[l] = (leaf.layer, [leaf.lo[d] for d in range(3)], [leaf.hi[d] for d in range(3)],
+                    leaf.last - leaf.first, res.accepted, res.par[1], errMean,
+                    res.par[2]/res.par[1], errSigma)
+
+    return table
+
+def draw_map(table, mapvars, name, title, plotsdir):
+    """Draws maps of mean and sigma/mean of cells in table (see map_table())
+    as TH2Poly in the first two variables of mapvars, one pair per layer
+    along the third variable; plots are saved into directory plotsdir.
+
+    NOTE: for discrete variables, e.g. nVtx, neighbouring cells may share
+    their boundary values.
+    """
+    for layer in sorted(set(table['layer'])):
+        cells = table[table['layer'] == layer]
+
+        suffix = ''
+        caption = title
+        if len(mapvars) == 3:
+            suffix = '_L{0}'.format(layer)
+            caption += ', {0:.3g} < {1} < {2:.3g}'.format(cells['lo'][0][2], MAP_VARS[mapvars[2]],
+                                                          cells['hi'][0][2])
+
+        (xmin, xmax) = (cells['lo'][:, 0].min(), cells['hi'][:, 0].max())
+        (ymin, ymax) = (cells['lo'][:, 1].min(), cells['hi'][:, 1].max())
+
+        for (what, ztitle) in [('mean', 'Mean_{E^{rec}/E^{gen}}'), ('sigma', '#sigma_{E^{rec}/E^{gen}}/mean')]:
+            cname = 'map_{0}_{1}{2}'.format(what, name, suffix)
+
+            h = ROOT.TH2Poly(cname, caption, xmin, xmax, ymin, ymax)
+            for cell in cells:
+                b = h.AddBin(cell['lo'][0], cell['lo'][1], cell['hi'][0], cell['hi'][1])
+                if cell['accepted']:
+                    h.SetBinContent(b, cell[what])
+                    h.SetBinError(b, cell['err' + what.capitalize()])
+
+            c = ROOT.TCanvas(cname, cname, 700, 700)
+            saves.append((c, h))
+
+            c.SetLeftMargin(0.12)
+            c.SetRightMargin(0.16)
+            c.SetTopMargin(0.06)
+            c.SetBottomMargin(0.1)
+
+            # energies span orders of magnitude
+            if mapvars[0] in ('mcE', 'mcPt', 'pfE') and xmin > 0:
+                c.SetLogx()
+
+            h.SetXTitle(MAP_VARS[mapvars[0]])
+            h.SetYTitle(MAP_VARS[mapvars[1]])
+            h.SetZTitle(ztitle)
+            h.SetTitleOffset(1.2, 'X')
+            h.SetTitleOffset(1.5, 'Y')
+            h.SetTitleOffset(1.5, 'Z')
+            h.Draw('COLZ')
+
+            c.Update()
+            c.SaveAs(os.path.join(plotsdir, '{0}.png'.format(c.GetTitle())))
+
+def string_vector(items):
+    """Returns std::vector<string> filled with items.
+    """
+    v = ROOT.std.vector('string')()
+    for item in items:
+        v.push_back(item)
+    return v
@@ -0,0 +1,308 @@
+"""Content-addressed cache of results of the draw_*.py scripts.
+
+Results are saved as plain arrays into output/cache/<name>.<digest>.npz, where
+the digest is a hash of everything a result depends on:
+
+    - contents of input files (ntuple, friend with MVA outputs, ...);
+    - source code which produces the result: functions of the scripts (their
+      source includes cuts and binning) and C++ helpers;
+    - remaining parameters (blockSize, energy regions, ...).
+
+Hence stale results are never returned after retraining or regenerating an
+ntuple, and only results which depend on what has changed are recomputed.
+Least recently used results are removed once the total size of the cache
+exceeds MAX_SIZE.
+
+Results are (nested tuples/lists of) Graph and Histo arrays, see from_root(),
+and plain NumPy arrays, e.g. tables as structured arrays; ROOT objects are
+rebuilt with to_root() only for drawing, so loading a result needs neither
+ROOT nor its streamers.
+
+Typical usage:
+
+    cachefile = result_cache.key(name, [infile], [make_histos], det=det)
+    result = result_cache.load(cachefile)
+    if result is None:
+        result = result_cache.from_root(...)
+        result_cache.save(cachefile, result)
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import os
+import re
+import glob
+import json
+import pickle
+import hashlib
+import inspect
+import zipfile
+import zlib
+import collections
+
+import numpy as np
+
+# directory with cached results
+CACHE_DIR = 'output/cache'
+
+# maximum total size of cached results, in bytes
+MAX_SIZE = 2 * 1024**3
+
+# digests of input files, see file_digest()
+DIGESTS_FILE = 'file_digests.pkl'
+_digests = None
+
+# TGraphErrors as arrays of points and their errors
+Graph = collections.namedtuple('Graph', ['x', 'y', 'ex', 'ey'])
+
+# TH1 as arrays of bin edges, and contents and errors including under/overflows
+Histo = collections.namedtuple('Histo', ['edges', 'contents', 'errors'])
+
+def from_root(obj):
+    """Converts TGraphErrors/TH1 in (nested tuples/lists of) obj into Graph/Histo.
+
+    NumPy arrays are kept as they are.
+    """
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(from_root(x) for x in obj)
+
+    if isinstance(obj, np.ndarray):
+        return obj
+
+    if obj.InheritsFrom('TGraphErrors'):
+        n = obj.GetN()
+        arrays = [obj.GetX(), obj.GetY(), obj.GetEX(), obj.GetEY()]
+        return Graph(*[np.array([a[i] for i in range(n)]) for a in arrays])
+
+    if obj.InheritsFrom('TH1'):
+        obj.BufferEmpty()  # NOTE: binning of auto-binned histograms is set here
+        n = obj.GetNbinsX()
+        edges = [obj.GetXaxis().GetBinLowEdge(i) for i in range(1, n + 2)]
+        contents = [obj.GetBinContent(i) for i in range(n + 2)]
+        errors = [obj.GetBinError(i) for i in range(n + 2)]
+        return Histo(np.array(edges), np.array(contents), np.array(errors))
+
+    raise TypeError('cannot convert {0} to arrays'.format(obj.ClassName()))
+
+def to_root(obj):
+    """Converts Graph/Histo in (nested tuples/lists of) obj into TGraphErrors/TH1D.
+    """
+    import ROOT
+
+    if isinstance(obj, Graph):
+        if len(obj.x) == 0:
+            return ROOT.TGraphErrors()
+
+        arrays = [np.ascontiguousarray(a, dtype=np.float64) for a in obj]
+        return ROOT.TGraphErrors(len(obj.x), *arrays)
+
+    if isinstance(obj, Histo):
+        edges = np.ascontiguousarray(obj.edges, dtype=np.float64)
+        h = ROOT.TH1D('h', '', len(edges) - 1, edges)
+
+        for i in range(len(obj.contents)):
+            h.SetBinContent(i, obj.contents[i])
+            h.SetBinError(i, obj.errors[i])
+
+        return h
+
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(to_root(x) for x in obj)
+
+    if isinstance(obj, np.ndarray):
+        return obj
+
+    raise TypeError('cannot convert {0} to ROOT'.format(type(obj).__name__))
+
+def file_digest(path):
+    """Returns SHA-1 digest of contents of a file.
+
+    Digests are remembered together with size and modification time of files,
+    so that ntuples are read only once after they have changed.
+    """
+    global _digests
+
+    digestsfile = os.path.join(CACHE_DIR, DIGESTS_FILE)
+
+    if _digests is None:
+        _digests = {}
+        if os.access(digestsfile, os.R_OK):
+            with open(digestsfile, 'rb') as f:
+                _digests = pickle.load(f)
+
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime)
+    apath = os.path.abspath(path)
+
+    if apath in _digests and _digests[apath][0] == stamp:
+        return _digests[apath][1]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    _digests[apath] = (stamp, h.hexdigest())
+
+    # NOTE: scripts may run in parallel; at worst a digest is computed twice
+    write_atomically(digestsfile, _digests)
+
+    return _digests[apath][1]
+
+def key(name, infiles=(), sources=(), **params):
+    """Returns path of the cache file for results called name (file name
+    prefix), which are produced from infiles by code in sources (file names
+    or python functions) with keyword parameters params.
+    """
+    h = hashlib.sha1()
+
+    for path in infiles:
+        h.update(file_digest(path).encode())
+
+    for src in sources:
+        if callable(src):
+            text = inspect.getsource(src)
+        else:
+            with open(src, 'rb') as f:
+                text = f.read()
+
+        h.update(text if isinstance(text, bytes) else text.encode('utf-8'))
+
+    h.update(repr(sorted(params.items())).encode())
+
+    return os.path.join(CACHE_DIR, '{0}.{1}.npz'.format(name, h.hexdigest()[:16]))
+
+def load(cachefile):
+    """Returns cached result or None if there is none.
+
+    Unreadable cache files (e.g. truncated by a killed save() or a full disk)
+    are removed and treated as missing.
+    """
+    if not os.path.exists(cachefile):
+        return None
+
+    try:
+        with np.load(cachefile) as f:
+            arrays = dict(f.items())
+        result = unpack(json.loads(str(arrays['layout'])), arrays)
+    except (IOError, OSError, ValueError, KeyError, EOFError, zlib.error, zipfile.BadZipfile):
+        try:
+            os.remove(cachefile)
+        except OSError:  # removed by another process
+            pass
+        return None
+
+    # mark as recently used, see evict()
+    try:
+        os.utime(cachefile, None)
+    except OSError:
+        pass
+
+    return result
+
+def load_latest(name, cachedir=CACHE_DIR):
+    """Returns the most recently used result called name regardless of its
+    digest, or None if there is none.
+
+    Useful for results of other trainings, e.g. output_<training>/cache.
+    """
+    pattern = re.compile(re.escape(name) + r'\.[0-9a-f]{16}\.npz$')
+
+    paths = glob.glob(os.path.join(cachedir, name + '.*.npz'))
+    paths = [p for p in paths if pattern.match(os.path.basename(p))]
+    if not paths:
+        return None
+
+    return load(max(paths, key=os.path.getmtime))
+
+def save(cachefile, result, max_size=MAX_SIZE):
+    """Saves result (see from_root()) into cache and evicts least recently used
+    results.
+    """
+    arrays = {}
+    arrays['layout'] = np.array(json.dumps(pack(result, arrays)))
+
+    tmpfile = '{0}.tmp{1}'.format(cachefile, os.getpid())
+    with open(tmpfile, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.rename(tmpfile, cachefile)
+
+    evict(max_size)
+
+def pack(obj, arrays):
+    """Adds arrays of obj into dictionary arrays, returns layout of obj.
+    """
+    if isinstance(obj, (Graph, Histo)):
+        names = []
+        for a in obj:
+            names.append('a{0}'.format(len(arrays)))
+            arrays[names[-1]] = a
+        return {type(obj).__name__: names}
+
+    if isinstance(obj, (tuple, list)):
+        return {type(obj).__name__: [pack(x, arrays) for x in obj]}
+
+    if isinstance(obj, np.ndarray):
+        name = 'a{0}'.format(len(arrays))
+        arrays[name] = obj
+        return {'ndarray': name}
+
+    raise TypeError('cannot cache {0}'.format(type(obj).__name__))
+
+def unpack(layout, arrays):
+    """Inverse of pack().
+    """
+    ((kind, items),) = layout.items()
+
+    if kind == 'Graph':
+        return Graph(*[arrays[a] for a in items])
+    if kind == 'Histo':
+        return Histo(*[arrays[a] for a in items])
+    if kind == 'tuple':
+        return tuple(unpack(x, arrays) for x in items)
+    if kind == 'list':
+        return [unpack(x, arrays) for x in items]
+    if kind == 'ndarray':
+        return arrays[items]
+
+    raise ValueError('unknown layout: {0}'.format(kind))
+
+def evict(max_size=MAX_SIZE, cachedir=CACHE_DIR):
+    """Removes least recently used cache files until their total size is not
+    larger than max_size bytes.
+    """
+    entries = []
+
+    for path in glob.glob(os.path.join(cachedir, '*.npz')):
+        try:
+            st = os.stat(path)
+        except OSError:  # removed by another process
+            continue
+
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for (_, size, _) in entries)
+
+    for (_, size, path) in sorted(entries):
+        if total <= max_size:
+            break
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        total -= size
+
+def write_atomically(path, obj):
+    """Pickles obj into path such that scripts running in parallel never see
+    incomplete files.
+    """
+    tmpfile = '{0}.tmp{1}'.format(path, os.getpid())
+
+    with open(tmpfile, 'wb') as f:
+        pickle.dump(obj, f)
+
+    os.rename(tmpfile, path)
@@ -0,0 +1,720 @@
+/* Fits of distributions of y in slices of X axis: data points are sorted by X
+ * and split into blocks of equal population, positions and widths of every
+ * block are evaluated with truncated statistics and its histogram of y is
+ * fitted with the tail shape of fit_shape.h. Fitted blocks can be saved and
+ * drawn for quality assurance, see SaveFits() and DrawFitsFile().
+ *
+ * Shared by draw_results_helper.cc, draw_mva_pars.cc and
+ * auxiliary/draw_fit_params.py. Arrays are passed as pointer + size, so that
+ * NumPy arrays of float32 can be given from python as they are, e.g.
+ *
+ *    blocks = ROOT.FitSlices(x, y, len(x), blockSize, settings, nthreads)
+ */
+
+#ifndef SLICE_FIT_H
+#define SLICE_FIT_H
+
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <cstdio>
+#include <functional>
+#include <numeric>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+#include <TF1.h>
+#include <TH1D.h>
+#include <TFile.h>
+#include <TTree.h>
+#include <TMath.h>
+#include <TROOT.h>
+#include <TCanvas.h>
+#include <TString.h>
+#include <TSystem.h>
+#include <TFitResult.h>
+#include <Math/MinimizerOptions.h>
+
+#include "fit_shape.h"
+
+// settings of the tail-shape fit of blocks, see FitSlice()
+struct slice_fit_t {
+   bool powerLawOnRight;  // layout of tail parameters, see TailShape
+   int nbins;             // number of bins of the histogram of y
+   double xmin, xmax;     // range of the histogram and of the fit
+   bool relative;         // true = xmin and xmax in units of sigmaY around meanY
+   double sigma0;         // starting value of parameter [2] in units of sigmaY
+   double tails[3];       // starting values of parameters [3]-[5]
+   double lo[6], hi[6];   // parameter limits, lo >= hi = no limits; [0] in units
+                          // of the histogram maximum, [2] in units of sigmaY
+   double preLo[6], preHi[6];  // parameter limits of pre-fits, preLo >= preHi =
+                               // those of the final fit; units as of lo and hi,
+                               // except for [1]: in units of sigmaY around meanY
+   bool fixTails;         // true = pre-fit first with parameters [3]-[5] fixed
+   std::string prefit;    // options of pre-fits, "" = no pre-fits
+   std::string option;    // options of the final fit
+
+   slice_fit_t() : powerLawOnRight(false), nbins(100), xmin(0.55), xmax(1.3),
+                   relative(false), sigma0(1), fixTails(false), option("QENLG")
+   {
+      SetTails(1.5, 5, 1.5);
+      for (int i = 0; i < 6; i++)
+         lo[i] = hi[i] = preLo[i] = preHi[i] = 0;
+   }
+
+   void SetTails(double p3, double p4, double p5)
+   {
+      tails[0] = p3;
+      tails[1] = p4;
+      tails[2] = p5;
+   }
+
+   void SetLimits(int i, double parmin, double parmax)
+   {
+      lo[i] = parmin;
+      hi[i] = parmax;
+   }
+
+   void SetPreLimits(int i, double parmin, double parmax)
+   {
+      preLo[i] = parmin;
+      preHi[i] = parmax;
+   }
+};
+
+// result of the tail-shape fit of one block, see FitSlice()
+struct slice_t {
+   Long64_t first, last;     // data points [first, last) in the order of X axis,
+                             // -1 = no such order is kept
+   double meanX, sigmaX;     // position and width of the block along X axis
+   double meanY, sigmaY;     // truncated mean and sigma of y in the block
+   double xmin, xmax;        // range of the fitted histogram
+   std::vector<double> contents;  // fitted histogram, including under/overflows
+   double par[6];            // fitted parameters
+   double err[6];            // errors of fitted parameters
+   double chi2;              // chi2 of the final fit, as given by TF1
+   int ndf;                  // number of degrees of freedom of the final fit
+   int ncalls;               // number of function calls made by Minuit
+   int status;               // Minuit status of the final fit, -1 = no fit result
+   double edm;               // estimated distance to minimum of the final fit
+   bool warm;                // true = warm-started fit was accepted
+};
+
+// NOTE: numbers of calls, status and EDM are known only for fit option "S"
+
+// hooks of FitSlice() for warm starts and refits
+struct slice_hooks_t {
+   const slice_t* seed;   // warm start: only the final fit is made, starting
+                          // from parameters of seed; NULL = fit from scratch
+   std::function<bool(TFitResultPtr&, TF1*, const slice_t&)> isSane;
+                          // accepts the warm-started fit, otherwise the block
+                          // is fitted from scratch; empty = status 0
+   std::function<void(const slice_t&, TH1D*, TF1*)> start;
+                          // sets starting values of the fit from scratch
+                          // instead of those of slice_fit_t, e.g. for refits
+
+   slice_hooks_t() : seed(NULL) {}
+};
+
+//______________________________________________________________________________
+inline void MeanSigma(const float* numbers, size_t siz, double &mean, double &sigma)
+{
+   /* Evaluates average (mean) and dispersion (sigma) of siz numbers "numbers".
+    *
+    * Mean and sigma are recalculated iteratively several times. During each
+    * calculation, a region [mean - 3*sigma, mean + 3*sigma] is used, where
+    * "mean" and "sigma" are taken from a previous iteration.
+    *
+    * Usually few iterations are needed, each of them is a plain scan over the
+    * numbers. If iterations converge slowly, the numbers are sorted once and
+    * prefix sums of x and x^2 are built, so that each further iteration costs
+    * two binary searches. Switching happens after 2*log2(N) scans, i.e. when
+    * the scans have cost about as much as the sorting.
+    */
+
+   // number of iterations with plain scans
+   int nscans = 2 * (int) ceil(log2(siz + 1.));
+
+   // sorted numbers and prefix sums, filled on demand:
+   // sum1[i] = sum of sorted[0..i), sum2[i] = sum of sorted[0..i)^2
+   std::vector<float> sorted;
+   std::vector<double> sum1, sum2;
+
+   // zero-order iteration
+   mean = 0;
+   sigma = 0;
+   for (size_t i = 0; i < siz; i++) {
+      mean += numbers[i];
+      sigma += numbers[i] * numbers[i];
+   }
+   mean /= siz;
+   sigma = sqrt(sigma/siz - mean*mean);
+
+   // iterations
+   for (int c = 0; c < 1000; c++) {
+      double mean_prev = mean;
+      double sigma_prev = sigma;
+
+      double xmin = mean - 3*sigma;
+      double xmax = mean + 3*sigma;
+
+      // evaluate peak position and width
+      mean = 0;
+      sigma = 0;
+      int nent = 0;
+
+      if (c < nscans) {
+         for (size_t i = 0; i < siz; i++) {
+            if (numbers[i] < xmin || numbers[i] > xmax) continue;
+
+            mean += numbers[i];
+            sigma += numbers[i] * numbers[i];
+            nent++;
+         }
+      } else {
+         if (sorted.empty()) {
+            sorted.assign(numbers, numbers + siz);
+            std::sort(sorted.begin(), sorted.end());
+
+            // NOTE: squares in float precision, as in the scans above
+            sum1.assign(siz + 1, 0);
+            sum2.assign(siz + 1, 0);
+            for (size_t i = 0; i < siz; i++) {
+               sum1[i + 1] = sum1[i] + sorted[i];
+               sum2[i + 1] = sum2[i] + sorted[i] * sorted[i];
+            }
+         }
+
+         // numbers inside [xmin, xmax]
+         size_t i1 = std::lower_bound(sorted.begin(), sorted.end(), xmin) - sorted.begin();
+         size_t i2 = std::upper_bound(sorted.begin(), sorted.end(), xmax) - sorted.begin();
+
+         mean = sum1[i2] - sum1[i1];
+         sigma = sum2[i2] - sum2[i1];
+         nent = i2 - i1;
+      }
+
+      mean /= nent;
+      sigma = sqrt(sigma/nent - mean*mean);
+
+      // break when converged
+      if (fabs(mean - mean_prev) <= 1e-6 * fabs(mean) &&
+          fabs(sigma - sigma_prev) <= 1e-6 * fabs(sigma))
+         return;
+   }
+
+   fprintf(stderr, "nent_total=%lu, mean=%f, sigma=%f\n", (unsigned long) siz, mean, sigma);
+   fprintf(stderr, "FATAL: mean and/or sigma did not converged\n");
+   gSystem->Exit(1);
+}
+
+//______________________________________________________________________________
+inline void MeanSigma(const std::vector<float>& numbers, double &mean, double &sigma)
+{
+   // Evaluates average and dispersion of numbers, see above.
+
+   MeanSigma(numbers.data(), numbers.size(), mean, sigma);
+}
+
+//______________________________________________________________________________
+inline int NumBlocks(size_t siz, int blockSize)
+{
+   /* Returns number of blocks of blockSize data points out of siz data points.
+    *
+    * NOTE: last block is excluded if it has less than 0.5 * blockSize entries.
+    */
+
+   return TMath::Nint(round(((float)siz)/blockSize));
+}
+
+//______________________________________________________________________________
+inline void BlockRange(size_t siz, int blockSize, int b, size_t& first, size_t& last)
+{
+   /* Gives data points [first, last) of block b, see NumBlocks(). All blocks
+    * hold blockSize data points, except for the last one.
+    */
+
+   first = (size_t) b * blockSize;
+   last = std::min(siz, (size_t) (b + 1) * blockSize);
+}
+
+//______________________________________________________________________________
+inline std::vector<size_t> SortIndex(const float* x, size_t siz)
+{
+   /* Returns indices of siz data points sorted by x.
+    *
+    * NOTE: stable sort, i.e. ties are kept in the original order.
+    */
+
+   std::vector<size_t> ind(siz);
+   std::iota(ind.begin(), ind.end(), 0);
+   std::stable_sort(ind.begin(), ind.end(), [x](size_t i, size_t j) { return x[i] < x[j]; });
+
+   return ind;
+}
+
+//______________________________________________________________________________
+inline int InitThreads(int n)
+{
+   /* Returns number of threads to be used for n requested, n < 1 = number of
+    * available CPU cores, and prepares ROOT for simultaneous fits.
+    */
+
+   if (n < 1)
+      n = std::thread::hardware_concurrency();
+   if (n < 1)
+      n = 1;
+
+   // required for simultaneous fits
+   if (n > 1)
+      ROOT::EnableThreadSafety();
+
+   return n;
+}
+
+//______________________________________________________________________________
+inline void ParallelFor(int nthreads, int njobs, const std::function<void(int, int)>& job)
+{
+   /* Runs job(j, t) for j = 0..njobs-1 in nthreads threads, t = 0..nthreads-1
+    * is the index of the running thread. Threads take the next job until all
+    * jobs are done.
+    */
+
+   nthreads = std::max(1, std::min(nthreads, njobs));
+
+   std::atomic<int> next(0);
+   auto worker = [&](int t) {
+      for (int j = next++; j < njobs; j = next++)
+         job(j, t);
+   };
+
+   std::vector<std::thread> pool;
+   for (int t = 1; t < nthreads; t++)
+      pool.push_back(std::thread(worker, t));
+   worker(0);
+   for (size_t t = 0; t < pool.size(); t++)
+      pool[t].join();
+}
+
+//______________________________________________________________________________
+inline TF1* NewFitFunction(const char* name, double xmin, double xmax, int npx = 500,
+                           bool powerLawOnRight = false)
+{
+   /* Returns new TF1 of the tail shape in [xmin, xmax], drawn with npx
+    * points.
+    */
+
+   TF1* fit = new TailShapeTF1(name, xmin, xmax, powerLawOnRight);
+   fit->SetLineWidth(1);
+   fit->SetNpx(npx);
+
+   return fit;
+}
+
+//______________________________________________________________________________
+inline void FillSlice(const std::vector<float>& bx, const std::vector<float>& by,
+                      TH1D* h, const slice_fit_t& cfg, slice_t& res)
+{
+   /* Evaluates positions and widths of a block of data points (bx, by) along
+    * X and Y axes and fills histogram h of by with the binning of cfg. Fit
+    * statistics of res are reset.
+    */
+
+   // mean and sigma in the block along X and Y axes
+   MeanSigma(bx, res.meanX, res.sigmaX);
+   MeanSigma(by, res.meanY, res.sigmaY);
+
+   res.xmin = cfg.relative ? res.meanY + cfg.xmin * res.sigmaY : cfg.xmin;
+   res.xmax = cfg.relative ? res.meanY + cfg.xmax * res.sigmaY : cfg.xmax;
+
+   // fill histogram
+   h->Reset();
+   h->SetBins(cfg.nbins, res.xmin, res.xmax);
+   for (size_t i = 0; i < by.size(); i++)
+      h->Fill(by[i]);
+
+   res.chi2 = 0;
+   res.ndf = 0;
+   res.ncalls = 0;
+   res.status = -1;
+   res.edm = 0;
+   res.warm = false;
+}
+
+//______________________________________________________________________________
+inline void FitSlice(const std::vector<float>& bx, const std::vector<float>& by,
+                     TH1D* h, TF1* fit, const slice_fit_t& cfg, slice_t& res,
+                     const slice_hooks_t* hooks = NULL)
+{
+   /* Fits distribution of by in a block of data points (bx, by) with the tail
+    * shape. Result is given in res, except for res.first and res.last.
+    *
+    * The fit starts from cfg.sigma0 and cfg.tails, or from the start hook;
+    * pre-fits with tails fixed (cfg.fixTails) and free (cfg.prefit) precede
+    * the final fit. With a seed in hooks, only the final fit is made from the
+    * seed parameters, and the block is fitted from scratch only if the isSane
+    * hook rejects it.
+    *
+    * NOTE: h and fit are reused from block to block, so they must not be
+    * shared between threads.
+    */
+
+   FillSlice(bx, by, h, cfg, res);
+   fit->SetRange(res.xmin, res.xmax);
+
+   double meanY = res.meanY;
+   double sigmaY = res.sigmaY;
+   double hmax = h->GetMaximum();
+
+   // sets parameter limits of pre-fits (pre = true) or of the final fit
+   auto setLimits = [&](bool pre) {
+      for (int i = 0; i < 6; i++) {
+         bool own = pre && cfg.preLo[i] < cfg.preHi[i];
+         double lo = own ? cfg.preLo[i] : cfg.lo[i];
+         double hi = own ? cfg.preHi[i] : cfg.hi[i];
+
+         // scales of parameter limits
+         double scale[6] = {hmax, own ? sigmaY : 1, sigmaY, 1, 1, 1};
+         double offset = own && i == 1 ? meanY : 0;
+
+         if (lo < hi)
+            fit->SetParLimits(i, offset + lo * scale[i], offset + hi * scale[i]);
+         else
+            fit->ReleaseParameter(i);
+      }
+   };
+
+   // fits and accumulates statistics of fits
+   auto doFit = [&](const std::string& option) {
+      TFitResultPtr r = h->Fit(fit, option.c_str(), "", res.xmin, res.xmax);
+      if (r.Get()) {
+         res.ncalls += r->NCalls();
+         res.status = r->Status();
+         res.edm = r->Edm();
+      }
+      return r;
+   };
+
+   if (hooks && hooks->seed) {
+      fit->SetParameters(hooks->seed->par);
+      fit->SetParErrors(hooks->seed->err);  // initial step sizes
+      setLimits(false);
+
+      TFitResultPtr r = doFit(cfg.option);
+      res.warm = hooks->isSane ? hooks->isSane(r, fit, res) : r.Get() && r->Status() == 0;
+   }
+
+   if (!res.warm) {
+      // forget errors from previous block: they serve as initial step sizes, so
+      // results would depend on the order in which blocks are fitted
+      double zeros[6] = {0, 0, 0, 0, 0, 0};
+      fit->SetParErrors(zeros);
+
+      fit->SetParameters(hmax, meanY, cfg.sigma0 * sigmaY, cfg.tails[0], cfg.tails[1],
+                         cfg.tails[2]);
+      if (hooks && hooks->start)
+         hooks->start(res, h, fit);
+
+      // pre-fits improve convergence
+      if (cfg.fixTails && !cfg.prefit.empty()) {
+         setLimits(true);
+         for (int i = 3; i < 6; i++)
+            fit->FixParameter(i, fit->GetParameter(i));
+         doFit(cfg.prefit);
+      }
+
+      if (!cfg.prefit.empty()) {
+         setLimits(true);
+         doFit(cfg.prefit);
+      }
+
+      setLimits(false);
+      doFit(cfg.option);
+   }
+
+   // save result
+   res.contents.assign(h->GetArray(), h->GetArray() + h->GetNbinsX() + 2);
+   for (int i = 0; i < 6; i++) {
+      res.par[i] = fit->GetParameter(i);
+      res.err[i] = fit->GetParError(i);
+   }
+
+   res.chi2 = fit->GetChisquare();
+   res.ndf = fit->GetNDF();
+}
+
+//______________________________________________________________________________
+inline std::vector<std::vector<slice_t> > FitBuckets(const float* x, const float* y,
+                                                     const std::vector<std::vector<size_t> >& buckets,
+                                                     int blockSize, const slice_fit_t& cfg,
+                                                     int nthreads = 1)
+{
+   /* Fits slices of several buckets of data points (x, y) at once: data points
+    * buckets[k] (indices in ascending order) are sorted by x, split into blocks
+    * and fitted as by FitSlices(). Returns fit results of every bucket in
+    * block order, no results for empty buckets.
+    *
+    * Blocks of all buckets are fitted by one pool of nthreads threads, so that
+    * threads do not wait for the slowest block of every bucket. Results do not
+    * depend on the number of threads.
+    */
+
+   std::vector<std::vector<size_t> > ind(buckets.size());
+   std::vector<std::vector<slice_t> > results(buckets.size());
+
+   // jobs = (bucket, block)
+   std::vector<std::pair<size_t, int> > jobs;
+
+   for (size_t k = 0; k < buckets.size(); k++) {
+      ind[k] = buckets[k];
+      std::stable_sort(ind[k].begin(), ind[k].end(), [x](size_t i, size_t j) { return x[i] < x[j]; });
+
+      results[k].resize(buckets[k].empty() ? 0 : NumBlocks(buckets[k].size(), blockSize));
+      for (int b = 0; b < (int) results[k].size(); b++)
+         jobs.push_back(std::make_pair(k, b));
+   }
+
+   // NOTE: unlike TMinuit, Minuit2 is reentrant; it is used regardless of the
+   // number of threads in order to get the same results
+   ROOT::Math::MinimizerOptions::SetDefaultMinimizer("Minuit2");
+
+   nthreads = std::max(1, std::min(nthreads, (int) jobs.size()));
+
+   // per-thread histograms and fitting functions
+   std::vector<TH1D*> hs;
+   std::vector<TF1*> fits;
+   for (int t = 0; t < nthreads; t++) {
+      hs.push_back(new TH1D(Form("h_slice_thread%d", t), "", cfg.nbins, 0, 1));
+      hs.back()->SetDirectory(0);
+      hs.back()->Sumw2(true);
+      fits.push_back(NewFitFunction(Form("fit_slice_thread%d", t), cfg.xmin, cfg.xmax, 500,
+                                    cfg.powerLawOnRight));
+   }
+
+   ParallelFor(nthreads, jobs.size(), [&](int j, int t) {
+      size_t k = jobs[j].first;
+      int b = jobs[j].second;
+
+      size_t first, last;
+      BlockRange(ind[k].size(), blockSize, b, first, last);
+
+      slice_t& res = results[k][b];
+      res.first = first;
+      res.last = last;
+
+      // fill separate arrays with current block data
+      std::vector<float> bx;
+      std::vector<float> by;
+      for (size_t i = first; i < last; i++) {
+         bx.push_back(x[ind[k][i]]);
+         by.push_back(y[ind[k][i]]);
+      }
+
+      FitSlice(bx, by, hs[t], fits[t], cfg, res);
+   });
+
+   // memory cleanup
+   for (int t = 0; t < nthreads; t++) {
+      delete hs[t];
+      delete fits[t];
+   }
+
+   return results;
+}
+
+//______________________________________________________________________________
+inline std::vector<slice_t> FitSlices(const float* x, const float* y, size_t siz,
+                                      int blockSize, const slice_fit_t& cfg,
+                                      int nthreads = 1)
+{
+   /* Sorts siz data points (x, y) by x, splits them into blocks of blockSize
+    * data points (see NumBlocks()) and fits distribution of y in every block,
+    * see FitSlice(). Returns fit results in block order.
+    *
+    * Blocks are fitted by nthreads threads (see InitThreads()), results do not
+    * depend on the number of threads.
+    */
+
+   if (siz < 1) {
+      fprintf(stderr, "FATAL: no data points to fit\n");
+      gSystem->Exit(1);
+   }
+
+   std::vector<std::vector<size_t> > buckets(1, std::vector<size_t>(siz));
+   std::iota(buckets[0].begin(), buckets[0].end(), 0);
+
+   return FitBuckets(x, y, buckets, blockSize, cfg, nthreads)[0];
+}
+
+
+//______________________________________________________________________________
+template <class T>
+inline void SaveFits(const std::vector<T>& blocks, const char* fname, const char* xtitle)
+{
+   /* Saves fitted histograms and parameters of blocks (slice_t or structs
+    * derived from it) into file fname, to be drawn later on request by
+    * DrawFitsFile().
+    */
+
+   TFile* fo = TFile::Open(fname, "RECREATE");
+   if (!fo || fo->IsZombie()) {
+      fprintf(stderr, "FATAL: TFile::Open() failed\n");
+      gSystem->Exit(1);
+   }
+
+   // NOTE: X axis title is kept as the title of the tree
+   TTree* tree = new TTree("blocks", xtitle);
+
+   slice_t res;
+   std::vector<double>* contents = &res.contents;
+
+   tree->Branch("meanX", &res.meanX, "meanX/D");
+   tree->Branch("sigmaX", &res.sigmaX, "sigmaX/D");
+   tree->Branch("contents", &contents);
+   tree->Branch("par", res.par, "par[6]/D");
+   tree->Branch("err", res.err, "err[6]/D");
+
+   for (size_t b = 0; b < blocks.size(); b++) {
+      res = blocks[b];
+      tree->Fill();
+   }
+
+   fo->Write();
+   delete fo;
+}
+
+//______________________________________________________________________________
+inline void DrawFits(const std::vector<slice_t>& blocks, const slice_fit_t& cfg,
+                     const char* dir, const char* title, const char* xtitle,
+                     const char* format, double scale = 1)
+{
+   /* Draws fitted distributions of blocks (nine per canvas) and saves
+    * canvases as images into directory dir. Histograms are restored with the
+    * binning of cfg, which must be absolute (cfg.relative = false). Titles of
+    * histograms are format(xtitle, meanX * scale, sigmaX * scale).
+    */
+
+   TCanvas* c = NULL;
+   std::vector<TObject*> todel;
+
+   for (int b = 0; b < (int) blocks.size(); b++) {
+      const slice_t& res = blocks[b];
+
+      // create new canvas, if necessary
+      if (b % 9 == 0) {
+         if (c) {
+            c->SaveAs(Form("%s/%s.png", dir, c->GetTitle()));
+
+            // memory cleanup
+            delete c;
+            for (size_t k = 0; k < todel.size(); k++)
+               delete todel[k];
+            todel.clear();
+         }
+
+         TString cname = TString::Format("fits_%s_blk%03dto%03d", title, b + 1, b + 9);
+         c = new TCanvas(cname, cname, 1000, 700);
+
+         c->SetLeftMargin(0);
+         c->SetRightMargin(0);
+         c->SetTopMargin(0);
+         c->SetBottomMargin(0);
+         c->Divide(3, 3);
+      }
+
+      c->cd(b % 9 + 1);
+      gPad->SetLeftMargin(0.12);
+      gPad->SetRightMargin(0.02);
+      gPad->SetTopMargin(0.08);
+      gPad->SetBottomMargin(0.08);
+
+      // restore fitted histogram
+      TH1* h = new TH1D("h", "", cfg.nbins, cfg.xmin, cfg.xmax);
+      for (int i = 0; i < (int) res.contents.size(); i++) {
+         h->SetBinContent(i, res.contents[i]);
+         h->SetBinError(i, sqrt(res.contents[i]));
+      }
+
+      h->SetTitle(Form(format, xtitle, res.meanX * scale, res.sigmaX * scale));
+      h->SetXTitle("E^{rec}/E^{gen}");
+      h->SetYTitle("Entries");
+      h->SetTitleOffset(1.6, "Y");
+
+      h->SetLineColor(kBlack);
+      h->Draw();
+
+      TF1* fit = NewFitFunction("fit", cfg.xmin, cfg.xmax, 500, cfg.powerLawOnRight);
+      fit->SetParameters(res.par);
+      fit->Draw("same");
+
+      todel.push_back(h);
+      todel.push_back(fit);
+   } // block loop
+
+   // save the very last canvas
+   if (c) {
+      c->SaveAs(Form("%s/%s.png", dir, c->GetTitle()));
+
+      // memory cleanup
+      delete c;
+      for (size_t k = 0; k < todel.size(); k++)
+         delete todel[k];
+   }
+}
+
+//______________________________________________________________________________
+inline void DrawFitsFile(const char* fname, const slice_fit_t& cfg, const char* format,
+                         double scale = 1)
+{
+   /* Draws fitted distributions of blocks saved by SaveFits() into fname,
+    * see DrawFits(); images are saved next to fname.
+    */
+
+   TFile* fi = TFile::Open(fname);
+   if (!fi || fi->IsZombie()) {
+      fprintf(stderr, "FATAL: TFile::Open() failed\n");
+      gSystem->Exit(1);
+   }
+
+   TTree* tree = (TTree*) fi->Get("blocks");
+   if (!tree) {
+      fprintf(stderr, "FATAL: TFile::Get() failed\n");
+      gSystem->Exit(1);
+   }
+
+   slice_t res;
+   std::vector<double>* contents = &res.contents;
+
+   const char* bnames[5] = {"meanX", "sigmaX", "contents", "par", "err"};
+   void* ptrs[5] = {&res.meanX, &res.sigmaX, &contents, res.par, res.err};
+
+   // NOTE: return code 4 = match with conversion
+   for (int i = 0; i < 5; i++) {
+      Int_t ret = tree->GetBranch(bnames[i]) ? tree->SetBranchAddress(bnames[i], ptrs[i]) : -1;
+      if (ret != 0 && ret != 4) {
+         fprintf(stderr, "FATAL: cannot read tree branch \"%s\"\n", bnames[i]);
+         gSystem->Exit(1);
+      }
+   }
+
+   std::vector<slice_t> blocks;
+   for (Long64_t b = 0; b < tree->GetEntries(); b++) {
+      if (tree->GetEntry(b) <= 0) {
+         fprintf(stderr, "FATAL: TTree::GetEntry() failed\n");
+         gSystem->Exit(1);
+      }
+      blocks.push_back(res);
+   }
+
+   TString dir = gSystem->GetDirName(fname);
+   TString title = gSystem->BaseName(fname);
+   title.ReplaceAll(".root", "");
+
+   DrawFits(blocks, cfg, dir, title, tree->GetTitle(), format, scale);
+
+   delete fi;
+}
+
+#endif
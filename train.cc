@@ -1,14 +1,18 @@
 /* Trainer of semi-parametric MVAs.
  */
 
+#include <cstdio>
+#include <cstring>
+#include <list>
 #include <vector>
+#include <sys/resource.h>
 
 #include <TCut.h>
 #include <TFile.h>
 #include <TTree.h>
-#include <TROOT.h>
 #include <TSystem.h>
 #include <TString.h>
+#include <TTreeFormula.h>
 #include <RooRealVar.h>
 #include <RooDataSet.h>
 #include <RooConstVar.h>
@@ -25,6 +29,192 @@
 
 using namespace RooFit;
 
+// number of rows per chunk of the column store
+const size_t kChunkSize = 1 << 20;
+
+// float32 columns of a chunk of rows of training data
+struct chunk_t {
+   std::vector<std::vector<float> > x;  // one column per variable
+   std::vector<float> w;                // per-event weights
+};
+
+// compact float32 column store of training data; kept in chunks, so that it
+// can be released chunk by chunk while converted, see create_dataset()
+struct columns_t {
+   std::list<chunk_t> chunks;
+   size_t size;                         // total number of rows
+};
+
+//______________________________________________________________________________
+void fill_columns(TTree* tree, const RooArgList& vars, const char* weight, columns_t& data)
+{
+   /* Reads training data into the column store.
+    *
+    * Expressions are taken from titles of "vars", "weight" is an expression
+    * for per-event weights. Entries with zero weight are not stored. Only even
+    * tree entries are taken (odd entries are reserved for tests).
+    */
+
+   std::vector<TTreeFormula*> forms;
+   for (int i = 0; i < vars.getSize(); i++) {
+      TTreeFormula* form = new TTreeFormula(vars.at(i)->GetName(), vars.at(i)->GetTitle(), tree);
+      if (form->GetNdim() == 0)
+         FATAL(Form("invalid expression \"%s\"", vars.at(i)->GetTitle()));
+      forms.push_back(form);
+   }
+
+   TTreeFormula wform("weight", weight, tree);
+   if (wform.GetNdim() == 0)
+      FATAL(Form("invalid expression \"%s\"", weight));
+
+   data.chunks.clear();
+   data.size = 0;
+
+   for (Long64_t ev = 0; ev < tree->GetEntriesFast(); ev += 2) {
+      if (tree->LoadTree(ev) < 0)
+         FATAL("TTree::LoadTree() failed");
+
+      wform.GetNdata();
+      float w = wform.EvalInstance();
+      if (w == 0) continue;
+
+      // start new chunk; NOTE: columns are allocated once, at full size
+      if (data.size % kChunkSize == 0) {
+         data.chunks.push_back(chunk_t());
+         chunk_t& chunk = data.chunks.back();
+
+         chunk.x.resize(forms.size());
+         for (size_t i = 0; i < forms.size(); i++)
+            chunk.x[i].reserve(kChunkSize);
+         chunk.w.reserve(kChunkSize);
+      }
+
+      chunk_t& chunk = data.chunks.back();
+
+      for (size_t i = 0; i < forms.size(); i++) {
+         forms[i]->GetNdata();
+         chunk.x[i].push_back(forms[i]->EvalInstance());
+      }
+
+      chunk.w.push_back(w);
+      data.size++;
+   }
+
+   for (size_t i = 0; i < forms.size(); i++)
+      delete forms[i];
+}
+
+//______________________________________________________________________________
+RooDataSet* create_dataset(const char* name, columns_t& data, const RooArgList& vars,
+                           RooRealVar& weightvar)
+{
+   /* Converts the column store into a weighted RooDataSet, as required by
+    * RooHybridBDTAutoPdf. Chunks of the column store are released as soon
+    * as they are converted, the store is empty on return.
+    *
+    * NOTE: values are clipped to ranges of the corresponding variables.
+    */
+
+   RooArgSet varsw(vars);
+   varsw.add(weightvar);
+
+   RooDataSet* dataset = new RooDataSet(name, name, varsw, WeightVar(weightvar));
+
+   while (!data.chunks.empty()) {
+      const chunk_t& chunk = data.chunks.front();
+
+      for (size_t ev = 0; ev < chunk.w.size(); ev++) {
+         for (int i = 0; i < vars.getSize(); i++) {
+            RooRealVar* var = static_cast<RooRealVar*>(vars.at(i));
+            double val = chunk.x[i][ev];
+
+            if (val < var->getMin())
+               val = var->getMin();
+            else if (val > var->getMax())
+               val = var->getMax();
+
+            var->setVal(val);
+         }
+
+         dataset->add(varsw, chunk.w[ev]);
+      }
+
+      // release memory
+      data.chunks.pop_front();
+   }
+
+   data.size = 0;
+
+   return dataset;
+}
+
+//______________________________________________________________________________
+bool reset_peak_memory()
+{
+   /* Resets the peak resident memory size of the process (VmHWM), so that
+    * the next print_memory_usage() gives the peak since this call. Needs
+    * Linux >= 4.0; returns false if the reset is not available.
+    */
+
+   FILE* f = fopen("/proc/self/clear_refs", "w");
+   if (!f) return false;
+
+   bool ok = fputs("5", f) >= 0;
+   return fclose(f) == 0 && ok;
+}
+
+//______________________________________________________________________________
+long status_kb(const char* key)
+{
+   /* Returns value of field key of /proc/self/status in kB, -1 if not found.
+    */
+
+   FILE* f = fopen("/proc/self/status", "r");
+   if (!f) return -1;
+
+   char line[256];
+   long value = -1;
+   size_t n = strlen(key);
+
+   while (fgets(line, sizeof(line), f))
+      if (strncmp(line, key, n) == 0 && line[n] == ':') {
+         sscanf(line + n + 1, "%ld", &value);
+         break;
+      }
+
+   fclose(f);
+   return value;
+}
+
+//______________________________________________________________________________
+void print_memory_usage(const char* label, bool perCategory)
+{
+   /* Prints peak and current resident memory sizes. perCategory = the peak
+    * was reset by reset_peak_memory() when the category started, so that it
+    * is the peak of the category; otherwise it is the peak since process
+    * start, which never goes down.
+    */
+
+   ProcInfo_t info;
+   gSystem->GetProcInfo(&info);
+
+   long peak = perCategory ? status_kb("VmHWM") : -1;
+
+   if (peak < 0) {
+      struct rusage usage;
+      if (getrusage(RUSAGE_SELF, &usage) != 0)
+         FATAL("getrusage() failed");
+
+      peak = usage.ru_maxrss;  // NOTE: on Linux, ru_maxrss is given in kilobytes
+      perCategory = false;
+   }
+
+   printf("MEMORY: %s: peak RSS %s = %.1f MB, current RSS = %.1f MB\n", label,
+          perCategory ? "of category" : "since start", peak/1024., info.fMemResident/1024.);
+   fflush(stdout);
+}
+
+//______________________________________________________________________________
 void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, bool useNumVtx,
                double ptMin = -1, double ptMax = -1)
 {
@@ -43,6 +233,9 @@ void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, b
    fprintf(stderr, "   %s, pfSize=%i%s, useNumVtx=%i, ptMin=%.1f, ptMax=%.1f: %s ...\n",
           isEE ? "EE" : "EB", pfSize, pfSize > 2 ? "+" : " ", (int)useNumVtx, ptMin, ptMax, infile);
 
+   // peak memory of this category, see print_memory_usage()
+   bool perCategory = reset_peak_memory();
+
    // input variables + target variable
    RooArgList allvars;
 
@@ -132,30 +325,11 @@ void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, b
    std::vector<RooAbsReal*> pdfs;
    pdfs.push_back(pdf);
 
-   // open file and get tree with the inputs and the target
-   TFile* fi = TFile::Open(infile);
-   if (!fi || fi->IsZombie())
-      FATAL("TFile::Open() failed");
-
-   TTree* tree = dynamic_cast<TTree*>(fi->Get("ntuplizer/PFClusterTree"));
-   if (!tree) FATAL("TFile::Get() failed");
-
-   // create a memory-resident friend TTree with linear event numbers
-   if (!gROOT->cd()) FATAL("TROOT::cd() failed");
-   TTree evtree("ntuplizer/PFClusterTree", "Trivial event numbers");
-   evtree.SetAutoFlush(0);
-   evtree.SetAutoSave(0);
-   Long64_t event;
-   evtree.Branch("event", &event);
-   for (event = 0; event < tree->GetEntriesFast(); event++)
-      evtree.Fill();
-   tree->AddFriend(&evtree);
-
    // pre-filtering cuts
+   // NOTE: only even tree entries are taken, see fill_columns()
    TCut cuts = (isEE ? "abs(pfEta) > 1.479" : "abs(pfEta) < 1.479");
    cuts += "pfE/mcE > 0.4";      // NOTE: evaluated with draw_inputs.py
    cuts += "pfPhoDeltaR < 0.03"; // NOTE: evaluated with draw_inputs.py
-   cuts += "event % 2 == 0";     // NOTE: take only even tree entries
 
    if (pfSize == 1)
       cuts += "pfSize5x5_ZS == 1";
@@ -174,8 +348,22 @@ void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, b
    RooRealVar weightvar("weightvar", "", 1.);
    weightvar.SetTitle(cuts);
 
+   // open file and get tree with the inputs and the target
+   TFile* fi = TFile::Open(infile);
+   if (!fi || fi->IsZombie())
+      FATAL("TFile::Open() failed");
+
+   TTree* tree = dynamic_cast<TTree*>(fi->Get("ntuplizer/PFClusterTree"));
+   if (!tree) FATAL("TFile::Get() failed");
+
+   // read training data into the compact column store; the input file is not
+   // needed afterwards
+   columns_t columns;
+   fill_columns(tree, allvars, weightvar.GetTitle(), columns);
+   delete fi;
+
    // list of training datasets
-   RooDataSet* dataset = RooTreeConvert::CreateDataSet("data", tree, allvars, weightvar);
+   RooDataSet* dataset = create_dataset("data", columns, allvars, weightvar);
    std::vector<RooAbsData*> datasets;
    datasets.push_back(dataset);
 
@@ -189,16 +377,19 @@ void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, b
    r.setConstant(true);
 
    // training
-   RooHybridBDTAutoPdf bdtpdfdiff("bdtpdfdiff", "", tgts, etermconst, r, datasets, pdfs);
-   if (pfSize == 1 || pfSize == 2)
-      bdtpdfdiff.SetMinCutSignificance(1.);
-   else
-      bdtpdfdiff.SetMinCutSignificance(5.);
-   //bdtpdfdiff.SetPrescaleInit(100);
-   bdtpdfdiff.SetShrinkage(0.1);
-   bdtpdfdiff.SetMinWeights(minweights);
-   bdtpdfdiff.SetMaxNodes(750);
-   bdtpdfdiff.TrainForest(1e+6); // NOTE: valid training will stop at ~100-500 trees
+   // NOTE: separate scope, the trainer must be destroyed before the dataset
+   {
+      RooHybridBDTAutoPdf bdtpdfdiff("bdtpdfdiff", "", tgts, etermconst, r, datasets, pdfs);
+      if (pfSize == 1 || pfSize == 2)
+         bdtpdfdiff.SetMinCutSignificance(1.);
+      else
+         bdtpdfdiff.SetMinCutSignificance(5.);
+      //bdtpdfdiff.SetPrescaleInit(100);
+      bdtpdfdiff.SetShrinkage(0.1);
+      bdtpdfdiff.SetMinWeights(minweights);
+      bdtpdfdiff.SetMaxNodes(750);
+      bdtpdfdiff.TrainForest(1e+6); // NOTE: valid training will stop at ~100-500 trees
+   }
 
    // unique name of output workspace
    TString wsname = TString::Format("ws_mva_%s_pfSize%i", isEE ? "EE" : "EB", pfSize);
@@ -212,7 +403,13 @@ void train_one(const char* infile, const char* outfile, bool isEE, int pfSize, b
    ws->import(*pdf);
    ws->writeToFile(outfile, false); // false = update output file, not recreate
 
-   // NOTE: no memory cleanup for simplicity
+   // memory cleanup
+   // NOTE: clients are deleted before their servers
+   delete ws;
+   delete pdf;
+   delete dataset;
+
+   print_memory_usage(wsname, perCategory);
 }
 
 void train(const char* infile, const char* outfile, bool useNumVtx)
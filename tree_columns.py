@@ -0,0 +1,79 @@
+"""Columnar reading of TTrees for the draw_*.py scripts.
+
+Expressions of branches are evaluated by TTree::Draw() in C++ into NumPy
+arrays, so that python does not loop over entries and only the branches used
+by the expressions are read. Histograms are filled from the arrays with
+TH1::FillN() and TH2::FillN(), which give the same histograms as Fill()
+called for every value.
+"""
+
+# python-2 compatibility
+from __future__ import division        # 1/2 = 0.5, not 0
+from __future__ import print_function  # print() syntax from python-3
+
+import numpy as np
+
+# maximum number of expressions evaluated by one TTree::Draw() call
+MAX_EXPRS = 4
+
+def read(tree, exprs, selection=''):
+    """Returns list of float64 arrays with values of expressions exprs for
+    entries of tree which pass selection, in the order of entries.
+
+    Only scalar expressions and selections are supported, i.e. one value per
+    entry; expressions of array branches (multiplicity != 0 in terms of
+    TTreeFormula::GetMultiplicity()) raise an exception.
+
+    Expressions are evaluated in groups of MAX_EXPRS, every group costs one
+    pass over the tree.
+    """
+    tree.SetEstimate(-1)  # keep all selected rows in memory
+
+    columns = []
+    for i in range(0, len(exprs), MAX_EXPRS):
+        group = exprs[i:i + MAX_EXPRS]
+
+        n = tree.Draw(':'.join(group), selection, 'goff')
+        if n < 0:
+            raise Exception('TTree::Draw() failed for ' + ':'.join(group))
+
+        formulas = [tree.GetVar(j) for j in range(len(group))]
+        if tree.GetSelect():
+            formulas.append(tree.GetSelect())
+        if any(f.GetMultiplicity() != 0 for f in formulas):
+            raise Exception('array expressions are not supported: ' + ':'.join(group) +
+                            (' with selection ' + selection if selection else ''))
+
+        for j in range(len(group)):
+            columns.append(_array(tree.GetVal(j), n))
+
+    return columns
+
+def _array(buf, n):
+    """Returns copy of a PyROOT buffer of n doubles as NumPy array.
+
+    NOTE: buffers of TTree::Draw() are reused by the next call.
+    """
+    if n == 0:
+        return np.zeros(0)
+
+    # buffers of PyROOT before ROOT 6.22 do not know their size
+    if hasattr(buf, 'SetSize'):
+        buf.SetSize(n)
+
+    return np.frombuffer(buf, dtype=np.float64, count=n).copy()
+
+def fill(h, x):
+    """Fills histogram h with every value of array x.
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    if len(x) > 0:
+        h.FillN(len(x), x, np.ones(len(x)))
+
+def fill2(h, x, y):
+    """Fills 2-D histogram h with every pair of values of arrays x and y.
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    if len(x) > 0:
+        h.FillN(len(x), x, y, np.ones(len(x)))